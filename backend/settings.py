@@ -128,6 +128,7 @@ STATICFILES_DIRS = [
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 import os
+import tempfile
 
 from dotenv import load_dotenv
 
@@ -143,6 +144,140 @@ GHL_TOKEN = os.getenv("GHL_TOKEN")
 GHL_BASE_URL = os.getenv("GHL_BASE_URL")
 GHL_LOCATION_ID = os.getenv("GHL_LOCATION_ID")
 
+# Procesamiento de webhooks
+# "queue": mp_webhook solo guarda el evento y responde; el worker lo procesa
+# "inline": se procesa dentro del mismo request (comportamiento anterior)
+WEBHOOK_PROCESSING_MODE = os.getenv("WEBHOOK_PROCESSING_MODE", "queue")
+# Eventos que el worker toma por lote
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "10"))
+# Espera del worker con la cola vacía: empieza en WEBHOOK_POLL_INTERVAL y se
+# duplica en cada consulta vacía hasta WEBHOOK_MAX_IDLE_SLEEP segundos
+WEBHOOK_POLL_INTERVAL = float(os.getenv("WEBHOOK_POLL_INTERVAL", "1.0"))
+WEBHOOK_MAX_IDLE_SLEEP = float(os.getenv("WEBHOOK_MAX_IDLE_SLEEP", "30"))
+# Aviso inmediato a los workers al recibir un webhook: LISTEN/NOTIFY en
+# PostgreSQL, sockets Unix en WEBHOOK_NOTIFY_DIR con SQLite
+WEBHOOK_NOTIFY_ENABLED = os.getenv("WEBHOOK_NOTIFY_ENABLED", "true").lower() == "true"
+WEBHOOK_NOTIFY_CHANNEL = os.getenv("WEBHOOK_NOTIFY_CHANNEL", "webhook_events")
+WEBHOOK_NOTIFY_DIR = os.getenv(
+    "WEBHOOK_NOTIFY_DIR", os.path.join(tempfile.gettempdir(), "ghl-webhooks")
+)
+# Ingesta por micro-lotes: junta webhooks durante WEBHOOK_INGEST_BATCH_WAIT_MS
+# (o hasta WEBHOOK_INGEST_BATCH_SIZE) y los guarda en una sola transacción
+WEBHOOK_INGEST_BATCHING = (
+    os.getenv("WEBHOOK_INGEST_BATCHING", "false").lower() == "true"
+)
+WEBHOOK_INGEST_BATCH_SIZE = int(os.getenv("WEBHOOK_INGEST_BATCH_SIZE", "100"))
+WEBHOOK_INGEST_BATCH_WAIT_MS = float(os.getenv("WEBHOOK_INGEST_BATCH_WAIT_MS", "5"))
+# Máximo que un request espera a que la BD confirme su evento (o su lote);
+# después se usa el spool en disco
+WEBHOOK_INGEST_TIMEOUT = float(os.getenv("WEBHOOK_INGEST_TIMEOUT", "2"))
+# Spool en disco: si la BD falla o no confirma a tiempo, el webhook se guarda
+# en WEBHOOK_SPOOL_DIR y el worker lo pasa a la cola después
+WEBHOOK_SPOOL_ENABLED = os.getenv("WEBHOOK_SPOOL_ENABLED", "true").lower() == "true"
+WEBHOOK_SPOOL_DIR = os.getenv("WEBHOOK_SPOOL_DIR", str(BASE_DIR / "spool"))
+WEBHOOK_SPOOL_SEGMENT_MAX_BYTES = int(
+    os.getenv("WEBHOOK_SPOOL_SEGMENT_MAX_BYTES", str(8 * 1024 * 1024))
+)
+WEBHOOK_SPOOL_SEGMENT_MAX_AGE = float(os.getenv("WEBHOOK_SPOOL_SEGMENT_MAX_AGE", "5"))
+WEBHOOK_SPOOL_REPLAY_INTERVAL = float(os.getenv("WEBHOOK_SPOOL_REPLAY_INTERVAL", "5"))
+# Filtro en memoria de webhooks ya procesados (duplicados de MP sin ir a la BD)
+WEBHOOK_DEDUP_CACHE_SIZE = int(os.getenv("WEBHOOK_DEDUP_CACHE_SIZE", "10000"))
+WEBHOOK_DEDUP_CACHE_TTL = float(os.getenv("WEBHOOK_DEDUP_CACHE_TTL", "600"))
+# Segundos que un worker mantiene tomado un evento antes de que expire su claim
+WEBHOOK_LEASE_SECONDS = int(os.getenv("WEBHOOK_LEASE_SECONDS", "300"))
+# Cada cuántos segundos el worker reclama eventos con lease expirado
+WEBHOOK_RECLAIM_INTERVAL = float(os.getenv("WEBHOOK_RECLAIM_INTERVAL", "30"))
+# Eventos de un lote que se procesan en paralelo (threads)
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "1"))
+# Supervisor (process_webhooks --workers): autoescalado por backlog
+WEBHOOK_SCALE_INTERVAL = float(os.getenv("WEBHOOK_SCALE_INTERVAL", "5"))
+WEBHOOK_BACKLOG_PER_WORKER = int(os.getenv("WEBHOOK_BACKLOG_PER_WORKER", "100"))
+WEBHOOK_MAX_EVENT_AGE = float(os.getenv("WEBHOOK_MAX_EVENT_AGE", "30"))
+# Espera mínima a que los workers terminen su lote al detener el supervisor
+# (se alarga sola hasta cubrir el peor caso de un lote, ver WEBHOOK_EVENT_BUDGET)
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "60"))
+# Espera antes de relanzar un worker caído: se duplica con cada caída seguida
+WEBHOOK_RESPAWN_BACKOFF = float(os.getenv("WEBHOOK_RESPAWN_BACKOFF", "1"))
+WEBHOOK_RESPAWN_BACKOFF_MAX = float(os.getenv("WEBHOOK_RESPAWN_BACKOFF_MAX", "60"))
+# Ventana en la que un evento payment/merchant_order ya resuelto por otro
+# evento del mismo pago se cierra sin volver a procesarlo (segundos)
+WEBHOOK_COALESCE_WINDOW = float(os.getenv("WEBHOOK_COALESCE_WINDOW", "300"))
+
+# Outbox de GHL: los tags/custom fields se encolan en la misma transacción
+# que el cambio de estado del pago y los envía el dispatcher (dispatch_ghl)
+GHL_OUTBOX_MAX_ATTEMPTS = int(os.getenv("GHL_OUTBOX_MAX_ATTEMPTS", "8"))
+GHL_OUTBOX_LEASE_SECONDS = int(os.getenv("GHL_OUTBOX_LEASE_SECONDS", "120"))
+# Backoff entre reintentos: base * 2^(intento-1), hasta el máximo (segundos)
+GHL_OUTBOX_RETRY_BASE = int(os.getenv("GHL_OUTBOX_RETRY_BASE", "30"))
+GHL_OUTBOX_RETRY_MAX = int(os.getenv("GHL_OUTBOX_RETRY_MAX", "3600"))
+GHL_OUTBOX_NOTIFY_CHANNEL = os.getenv("GHL_OUTBOX_NOTIFY_CHANNEL", "ghl_outbox")
+# Ventana en la que los cambios de un mismo contacto se juntan en un solo
+# actualización a GHL (segundos; 0 = enviar apenas se encolan)
+GHL_COALESCE_WINDOW = float(os.getenv("GHL_COALESCE_WINDOW", "2"))
+# Tags conocidos por contacto (evita reenviar a GHL los que ya tiene).
+# Un tag quitado directamente en GHL puede tardar hasta GHL_TAG_CACHE_TTL
+# segundos en volver a agregarse (0 = enviar siempre los tags)
+GHL_TAG_CACHE_SIZE = int(os.getenv("GHL_TAG_CACHE_SIZE", "5000"))
+GHL_TAG_CACHE_TTL = float(os.getenv("GHL_TAG_CACHE_TTL", "300"))
+# Cache del listado de contactos de GHL: vigente GHL_CONTACTS_CACHE_TTL
+# segundos y servido vencido (mientras se refresca) hasta
+# GHL_CONTACTS_CACHE_STALE segundos más
+GHL_CONTACTS_CACHE_TTL = float(os.getenv("GHL_CONTACTS_CACHE_TTL", "60"))
+GHL_CONTACTS_CACHE_STALE = float(os.getenv("GHL_CONTACTS_CACHE_STALE", "300"))
+# Sincronización de contactos (sync_ghl_contacts): contactos por página
+GHL_CONTACT_SYNC_PAGE_SIZE = int(os.getenv("GHL_CONTACT_SYNC_PAGE_SIZE", "100"))
+# Contactos que faltan localmente y se piden a GHL en segundo plano por
+# carga del historial; un ID que GHL no reconoce se reintenta tras
+# GHL_CONTACT_BACKFILL_RETRY segundos
+GHL_CONTACT_BACKFILL_BATCH = int(os.getenv("GHL_CONTACT_BACKFILL_BATCH", "20"))
+GHL_CONTACT_BACKFILL_RETRY = float(os.getenv("GHL_CONTACT_BACKFILL_RETRY", "3600"))
+GHL_DISPATCH_BATCH_SIZE = int(os.getenv("GHL_DISPATCH_BATCH_SIZE", "20"))
+GHL_DISPATCH_CONCURRENCY = int(os.getenv("GHL_DISPATCH_CONCURRENCY", "4"))
+# Presupuesto de tiempo de cada envío a GHL (segundos)
+GHL_DISPATCH_BUDGET = float(os.getenv("GHL_DISPATCH_BUDGET", "30"))
+
+# Cliente HTTP compartido (MercadoPago / GHL): conexiones keep-alive por host.
+# HTTP_POOL_MAXSIZE debe cubrir la concurrencia (threads del worker/servidor)
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "10"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "20"))
+# Timeouts por defecto de cada llamada (segundos), siempre acotados por el
+# presupuesto total del request/evento que la hace
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+# Presupuesto total de create_payment y de cada evento de webhook (debe ser
+# menor que WEBHOOK_LEASE_SECONDS)
+CREATE_PAYMENT_BUDGET = float(os.getenv("CREATE_PAYMENT_BUDGET", "15"))
+WEBHOOK_EVENT_BUDGET = float(os.getenv("WEBHOOK_EVENT_BUDGET", "30"))
+# Circuit breaker por host: se abre si en CIRCUIT_WINDOW_SECONDS fallan al
+# menos CIRCUIT_FAILURE_RATE de las llamadas (mínimo CIRCUIT_MIN_CALLS) y
+# deja pasar una llamada de prueba después de CIRCUIT_OPEN_SECONDS
+CIRCUIT_WINDOW_SECONDS = float(os.getenv("CIRCUIT_WINDOW_SECONDS", "60"))
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "5"))
+CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+# Rate limit compartido por todos los procesos (token bucket en la BD):
+# tokens por segundo y ráfaga máxima, por host de MP y por location de GHL
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "10"))
+MP_RATE_LIMIT = float(os.getenv("MP_RATE_LIMIT", "20"))
+MP_RATE_BURST = float(os.getenv("MP_RATE_BURST", "40"))
+GHL_RATE_LIMIT = float(os.getenv("GHL_RATE_LIMIT", "8"))
+GHL_RATE_BURST = float(os.getenv("GHL_RATE_BURST", "20"))
+# Lecturas a MercadoPago: read timeout por petición, reintentos con backoff
+# exponencial + jitter y petición de respaldo (hedging) tras el p95 reciente
+MP_READ_TIMEOUT = float(os.getenv("MP_READ_TIMEOUT", "5"))
+MP_READ_RETRIES = int(os.getenv("MP_READ_RETRIES", "2"))
+MP_RETRY_BACKOFF = float(os.getenv("MP_RETRY_BACKOFF", "0.2"))
+MP_RETRY_BACKOFF_MAX = float(os.getenv("MP_RETRY_BACKOFF_MAX", "2"))
+MP_HEDGE_ENABLED = os.getenv("MP_HEDGE_ENABLED", "false").lower() == "true"
+MP_HEDGE_PERCENTILE = float(os.getenv("MP_HEDGE_PERCENTILE", "0.95"))
+MP_HEDGE_MIN_SAMPLES = int(os.getenv("MP_HEDGE_MIN_SAMPLES", "20"))
+MP_HEDGE_MIN_DELAY = float(os.getenv("MP_HEDGE_MIN_DELAY", "0.05"))
+MP_HEDGE_THREADS = int(os.getenv("MP_HEDGE_THREADS", "16"))
+# Cache de documentos de MP (payments / merchant_orders) por recurso
+MP_CACHE_SIZE = int(os.getenv("MP_CACHE_SIZE", "1000"))
+MP_CACHE_TTL = float(os.getenv("MP_CACHE_TTL", "15"))
+
 # Configuración de logging
 # Configuración de logging
 LOGGING = {
@@ -186,6 +321,26 @@ LOGGING = {
             "level": "INFO",
             "propagate": False,
         },
+        "payments.services.webhook_worker": {
+            "handlers": ["console", "file"],
+            "level": "INFO",
+            "propagate": False,
+        },
+        "payments.services.webhook_supervisor": {
+            "handlers": ["console", "file"],
+            "level": "INFO",
+            "propagate": False,
+        },
+        "payments.services.ghl_dispatcher": {
+            "handlers": ["console", "file"],
+            "level": "INFO",
+            "propagate": False,
+        },
+        "payments.services.contact_sync": {
+            "handlers": ["console", "file"],
+            "level": "INFO",
+            "propagate": False,
+        },
         # Silenciar logs del servidor de desarrollo
         "django.server": {
             "handlers": ["console"],
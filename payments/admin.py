@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.utils.html import format_html
 
-from .models import Payment, WebhookEvent
+from .models import Contact, GhlOutboxMessage, Payment, SyncState, WebhookEvent
 
 
 @admin.register(Payment)
@@ -41,6 +41,8 @@ class WebhookEventAdmin(admin.ModelAdmin):
         "updated_at",
         "processed_at",
         "error_details",
+        "locked_by",
+        "lease_expires_at",
     )
     ordering = ("-created_at",)
 
@@ -49,6 +51,7 @@ class WebhookEventAdmin(admin.ModelAdmin):
         ("Relaciones", {"fields": ("payment", "mp_payment_id", "preference_id")}),
         ("Estado", {"fields": ("status", "processed", "attempts", "max_attempts")}),
         ("Timestamps", {"fields": ("updated_at", "processed_at", "next_retry_at")}),
+        ("Worker", {"fields": ("locked_by", "lease_expires_at")}),
         ("Datos", {"fields": ("raw_payload",), "classes": ("collapse",)}),
         (
             "Errores",
@@ -99,3 +102,40 @@ class WebhookEventAdmin(admin.ModelAdmin):
         self.message_user(request, f"{count} eventos programados para reintento")
 
     retry_failed_events.short_description = "Reintentar eventos seleccionados"
+
+
+@admin.register(GhlOutboxMessage)
+class GhlOutboxMessageAdmin(admin.ModelAdmin):
+    list_display = (
+        "contact_id",
+        "action",
+        "status",
+        "attempts",
+        "created_at",
+        "next_retry_at",
+    )
+    list_filter = ("status", "action", "created_at")
+    search_fields = ("contact_id",)
+    readonly_fields = (
+        "created_at",
+        "updated_at",
+        "processed_at",
+        "locked_by",
+        "lease_expires_at",
+        "last_error",
+    )
+    ordering = ("-created_at",)
+
+
+@admin.register(Contact)
+class ContactAdmin(admin.ModelAdmin):
+    list_display = ("name", "email", "phone", "ghl_id", "date_updated", "synced_at")
+    search_fields = ("name", "email", "phone", "ghl_id")
+    readonly_fields = ("synced_at",)
+    ordering = ("name",)
+
+
+@admin.register(SyncState)
+class SyncStateAdmin(admin.ModelAdmin):
+    list_display = ("name", "cursor", "completed_at", "updated_at")
+    readonly_fields = ("updated_at",)
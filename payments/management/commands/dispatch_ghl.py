@@ -0,0 +1,114 @@
+"""
+Comando de Django para enviar a GHL los mensajes del outbox
+
+Uso:
+    python manage.py dispatch_ghl
+    python manage.py dispatch_ghl --once
+    python manage.py dispatch_ghl --drain
+    python manage.py dispatch_ghl --loop
+    python manage.py dispatch_ghl --loop --concurrency 8
+
+El procesamiento de webhooks solo deja los tags/custom fields en el outbox
+(GhlOutboxMessage), en la misma transacción que el cambio de estado del
+pago; este comando los envía con su propia concurrencia, reintentos y
+rate limit. En modo --loop despierta apenas se encola un mensaje.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.services.ghl_dispatcher import GhlDispatcher
+
+
+class Command(BaseCommand):
+    help = "Envía a GHL los mensajes pendientes del outbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help=(
+                "Enviar un solo lote y salir (útil para cron; no se combina "
+                "con --loop ni --drain)"
+            ),
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Ejecutar como dispatcher continuo hasta recibir SIGTERM/Ctrl+C",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=None,
+            help=(
+                "Espera inicial con el outbox vacío, en segundos "
+                "(default: WEBHOOK_POLL_INTERVAL)"
+            ),
+        )
+        parser.add_argument(
+            "--max-idle",
+            type=float,
+            default=None,
+            help=(
+                "Espera máxima con el outbox vacío, en segundos "
+                "(default: WEBHOOK_MAX_IDLE_SLEEP)"
+            ),
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Mensajes que se toman por lote (default: GHL_DISPATCH_BATCH_SIZE)",
+        )
+        parser.add_argument(
+            "--drain",
+            action="store_true",
+            help="Sin --loop: enviar lotes hasta vaciar el outbox y salir",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=None,
+            help=(
+                "Mensajes enviados en paralelo por lote "
+                "(default: GHL_DISPATCH_CONCURRENCY)"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        if options["once"] and (options["loop"] or options["drain"]):
+            raise CommandError("✗ --once no se combina con --loop ni --drain")
+
+        dispatcher = GhlDispatcher(
+            poll_interval=options["interval"],
+            concurrency=options["concurrency"],
+            batch_size=options["batch_size"],
+            max_idle=options["max_idle"],
+        )
+
+        if options["loop"]:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"🔄 Modo dispatcher: lotes de {dispatcher.batch_size}, "
+                    f"{dispatcher.concurrency} en paralelo..."
+                )
+            )
+            self.stdout.write(self.style.WARNING("   Presiona Ctrl+C para detener\n"))
+
+            dispatcher.install_signal_handlers()
+            dispatcher.run()
+            self.stdout.write(self.style.WARNING("\n⏹ Detenido"))
+            return
+
+        self.stdout.write("⚡ Enviando mensajes pendientes a GHL...")
+        if options["drain"]:
+            sent = dispatcher.drain()
+        else:
+            sent = dispatcher.run_once()
+        if dispatcher.reclaimed:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"♻ {dispatcher.reclaimed} mensajes con lease expirado"
+                )
+            )
+        self.stdout.write(self.style.SUCCESS(f"✓ Envío completado ({sent} mensajes)"))
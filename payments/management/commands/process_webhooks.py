@@ -3,8 +3,19 @@ Comando de Django para procesar webhooks pendientes
 
 Uso:
     python manage.py process_webhooks
+    python manage.py process_webhooks --drain
+    python manage.py process_webhooks --loop
+    python manage.py process_webhooks --loop --concurrency 8
+    python manage.py process_webhooks --workers 2 --max-workers 8
 
-Este comando debe ejecutarse periódicamente (ej: cada 1 minuto con cron o Task Scheduler)
+En modo --loop el comando queda como worker de larga duración: mientras
+haya eventos pendientes pide lotes seguidos (--batch-size); con la cola
+vacía espera desde --interval hasta --max-idle segundos (backoff).
+
+Con --workers el comando actúa como supervisor: levanta procesos worker,
+reemplaza los que mueren y escala hasta --max-workers según el backlog.
+
+Sin --loop debe ejecutarse periódicamente (ej: cada 1 minuto con cron o Task Scheduler)
 
 En Windows con Task Scheduler:
     - Acción: Iniciar un programa
@@ -18,7 +29,8 @@ import logging
 
 from django.core.management.base import BaseCommand
 
-from payments.services.webhook_processor import process_pending_webhooks
+from payments.services.webhook_supervisor import WebhookSupervisor
+from payments.services.webhook_worker import WebhookWorker
 
 logger = logging.getLogger(__name__)
 
@@ -35,28 +47,126 @@ class Command(BaseCommand):
         parser.add_argument(
             "--loop",
             action="store_true",
-            help="Ejecutar en loop infinito cada 60 segundos (útil para desarrollo)",
+            help="Ejecutar como worker continuo hasta recibir SIGTERM/Ctrl+C",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=None,
+            help=(
+                "Espera inicial con la cola vacía, en segundos "
+                "(default: WEBHOOK_POLL_INTERVAL)"
+            ),
+        )
+        parser.add_argument(
+            "--max-idle",
+            type=float,
+            default=None,
+            help=(
+                "Espera máxima con la cola vacía, en segundos "
+                "(default: WEBHOOK_MAX_IDLE_SLEEP)"
+            ),
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Eventos que se toman por lote (default: WEBHOOK_BATCH_SIZE)",
+        )
+        parser.add_argument(
+            "--drain",
+            action="store_true",
+            help="Sin --loop: procesar lotes hasta vaciar la cola y salir",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=None,
+            help=(
+                "Eventos procesados en paralelo por lote "
+                "(default: WEBHOOK_CONCURRENCY)"
+            ),
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Modo supervisor: mínimo de procesos worker a mantener vivos",
+        )
+        parser.add_argument(
+            "--max-workers",
+            type=int,
+            default=None,
+            help=(
+                "Modo supervisor: máximo de workers al escalar por backlog "
+                "(default: --workers)"
+            ),
         )
 
     def handle(self, *args, **options):
-        if options["loop"]:
+        if options["workers"]:
+            supervisor = WebhookSupervisor(
+                min_workers=options["workers"],
+                max_workers=options["max_workers"],
+                poll_interval=options["interval"],
+                concurrency=options["concurrency"],
+                batch_size=options["batch_size"],
+                max_idle=options["max_idle"],
+            )
             self.stdout.write(
                 self.style.SUCCESS(
-                    "🔄 Modo loop: procesando webhooks cada 60 segundos..."
+                    f"🧭 Modo supervisor: {supervisor.min_workers}-"
+                    f"{supervisor.max_workers} workers..."
                 )
             )
             self.stdout.write(self.style.WARNING("   Presiona Ctrl+C para detener\n"))
 
-            import time
+            supervisor.install_signal_handlers()
+            supervisor.run()
+            self.stdout.write(self.style.WARNING("\n⏹ Detenido"))
+        elif options["loop"]:
+            worker = self._build_worker(options)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"🔄 Modo worker: lotes de {worker.batch_size}, "
+                    f"espera máxima {worker.max_idle} segundos..."
+                )
+            )
+            self.stdout.write(self.style.WARNING("   Presiona Ctrl+C para detener\n"))
 
-            try:
-                while True:
-                    process_pending_webhooks()
-                    time.sleep(60)
-            except KeyboardInterrupt:
-                self.stdout.write(self.style.WARNING("\n⏹ Detenido por el usuario"))
+            worker.install_signal_handlers()
+            worker.run()
+            self.stdout.write(self.style.WARNING("\n⏹ Detenido"))
         else:
-            # Modo por defecto: ejecutar una vez
+            # Modo por defecto: ejecutar una vez (un lote, o hasta vaciar con --drain)
+            # El worker reclama leases vencidos y re-inyecta el spool antes
+            # del primer lote; aquí solo se informa lo que hizo
+            worker = self._build_worker(options)
             self.stdout.write("⚡ Procesando webhooks pendientes...")
-            process_pending_webhooks()
-            self.stdout.write(self.style.SUCCESS("✓ Procesamiento completado"))
+            if options["drain"]:
+                processed = worker.drain()
+            else:
+                processed = worker.run_once()
+            if worker.reclaimed:
+                self.stdout.write(
+                    self.style.WARNING(
+                        f"♻ {worker.reclaimed} eventos con lease expirado"
+                    )
+                )
+            if worker.replayed:
+                self.stdout.write(
+                    self.style.WARNING(
+                        f"💾 {worker.replayed} eventos re-inyectados del spool"
+                    )
+                )
+            self.stdout.write(
+                self.style.SUCCESS(f"✓ Procesamiento completado ({processed} eventos)")
+            )
+
+    def _build_worker(self, options):
+        return WebhookWorker(
+            poll_interval=options["interval"],
+            concurrency=options["concurrency"],
+            batch_size=options["batch_size"],
+            max_idle=options["max_idle"],
+        )
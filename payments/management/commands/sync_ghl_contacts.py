@@ -0,0 +1,62 @@
+"""
+Comando de Django para sincronizar los contactos de GHL a la tabla Contact
+
+Uso:
+    python manage.py sync_ghl_contacts
+    python manage.py sync_ghl_contacts --full
+    python manage.py sync_ghl_contacts --max-pages 50
+
+Recorre el directorio de contactos página por página y guarda el cursor
+después de cada una: si se corta (o con --max-pages), la próxima ejecución
+sigue donde quedó. Solo escribe contactos nuevos o con otro dateUpdated.
+
+Debe ejecutarse periódicamente (ej: cada 15 minutos con cron o Task Scheduler)
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.services.contact_sync import sync_contacts
+
+
+class Command(BaseCommand):
+    help = "Sincroniza los contactos de GoHighLevel a la base de datos local"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Ignorar el cursor guardado y recorrer el directorio desde el inicio",
+        )
+        parser.add_argument(
+            "--max-pages",
+            type=int,
+            default=None,
+            help="Páginas a procesar en esta ejecución (default: hasta el final)",
+        )
+        parser.add_argument(
+            "--page-size",
+            type=int,
+            default=None,
+            help="Contactos por página (default: GHL_CONTACT_SYNC_PAGE_SIZE)",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("👥 Sincronizando contactos de GHL...")
+        result = sync_contacts(
+            max_pages=options["max_pages"],
+            page_size=options["page_size"],
+            full=options["full"],
+        )
+        if not result["success"]:
+            raise CommandError(
+                f"✗ {result['message']} (la próxima ejecución sigue desde la "
+                f"última página guardada)"
+            )
+
+        status = "completa" if result["completed"] else "parcial, se reanudará"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"✓ Sincronización {status} | Páginas: {result['pages']} | "
+                f"Leídos: {result['fetched']} | Guardados: {result['saved']}"
+            )
+        )
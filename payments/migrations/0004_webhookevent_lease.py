@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0003_webhookevent"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="webhookevent",
+            name="lease_expires_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="Hasta cuándo es válido el claim del worker",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="webhookevent",
+            name="lease_token",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                help_text="Token del claim actual (identifica el lote del worker)",
+                max_length=32,
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="webhookevent",
+            name="locked_by",
+            field=models.CharField(
+                blank=True,
+                help_text="Worker que tomó el evento para procesarlo",
+                max_length=255,
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0004_webhookevent_lease"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="webhookevent",
+            name="reclaim_count",
+            field=models.IntegerField(
+                default=0, help_text="Veces que el evento se reclamó por lease expirado"
+            ),
+        ),
+    ]
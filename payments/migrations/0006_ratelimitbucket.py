@@ -0,0 +1,49 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0005_webhookevent_reclaim_count"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RateLimitBucket",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=150, unique=True)),
+                (
+                    "tokens",
+                    models.FloatField(help_text="Tokens disponibles en refilled_at"),
+                ),
+                (
+                    "capacity",
+                    models.FloatField(help_text="Máximo de tokens (ráfaga permitida)"),
+                ),
+                (
+                    "rate",
+                    models.FloatField(help_text="Tokens que se recargan por segundo"),
+                ),
+                (
+                    "refilled_at",
+                    models.FloatField(
+                        help_text="Epoch (segundos) de la última recarga"
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "payments_rate_limit_bucket",
+            },
+        ),
+    ]
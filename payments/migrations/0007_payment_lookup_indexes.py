@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0006_ratelimitbucket"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="payment",
+            name="appointment_id",
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name="payment",
+            name="preference_id",
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+    ]
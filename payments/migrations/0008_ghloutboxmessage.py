@@ -0,0 +1,120 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0007_payment_lookup_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GhlOutboxMessage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "contact_id",
+                    models.CharField(
+                        help_text="ID del contacto en GHL", max_length=100
+                    ),
+                ),
+                (
+                    "action",
+                    models.CharField(
+                        choices=[
+                            ("add_tag", "Agregar tag"),
+                            ("update_custom_field", "Actualizar custom field"),
+                        ],
+                        max_length=50,
+                    ),
+                ),
+                (
+                    "payload",
+                    models.JSONField(
+                        default=dict,
+                        help_text="Argumentos de la acción (ej: {'tag': ...})",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pendiente"),
+                            ("processing", "Enviando"),
+                            ("success", "Enviado"),
+                            ("failed", "Fallido"),
+                        ],
+                        db_index=True,
+                        default="pending",
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "attempts",
+                    models.IntegerField(
+                        default=0, help_text="Número de envíos intentados"
+                    ),
+                ),
+                (
+                    "max_attempts",
+                    models.IntegerField(
+                        default=8,
+                        help_text="Máximo de intentos antes de marcar como fallido",
+                    ),
+                ),
+                (
+                    "next_retry_at",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="Cuándo debe intentarse el próximo envío",
+                        null=True,
+                    ),
+                ),
+                ("last_error", models.TextField(blank=True, null=True)),
+                ("locked_by", models.CharField(blank=True, max_length=255, null=True)),
+                (
+                    "lease_token",
+                    models.CharField(
+                        blank=True, db_index=True, max_length=32, null=True
+                    ),
+                ),
+                ("lease_expires_at", models.DateTimeField(blank=True, null=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("processed_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "payment",
+                    models.ForeignKey(
+                        blank=True,
+                        help_text="Pago cuyo cambio de estado originó el mensaje",
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="ghl_messages",
+                        to="payments.payment",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Mensaje a GHL",
+                "verbose_name_plural": "Outbox de GHL",
+                "ordering": ["-created_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["status", "next_retry_at"],
+                        name="payments_gh_status_df804a_idx",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0008_ghloutboxmessage"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="ghloutboxmessage",
+            name="contact_id",
+            field=models.CharField(
+                db_index=True, help_text="ID del contacto en GHL", max_length=100
+            ),
+        ),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0009_ghloutbox_contact_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Contact",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "ghl_id",
+                    models.CharField(
+                        help_text="ID en GHL", max_length=100, unique=True
+                    ),
+                ),
+                ("name", models.CharField(db_index=True, max_length=255)),
+                (
+                    "email",
+                    models.CharField(
+                        blank=True, db_index=True, default="", max_length=255
+                    ),
+                ),
+                ("phone", models.CharField(blank=True, default="", max_length=50)),
+                ("tags", models.JSONField(blank=True, default=list)),
+                (
+                    "date_updated",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="dateUpdated del contacto en GHL",
+                        null=True,
+                    ),
+                ),
+                ("synced_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "Contacto GHL",
+                "verbose_name_plural": "Contactos GHL",
+                "ordering": ["name"],
+            },
+        ),
+        migrations.CreateModel(
+            name="SyncState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=100, unique=True)),
+                (
+                    "cursor",
+                    models.JSONField(
+                        blank=True,
+                        default=dict,
+                        help_text="Cursor de la próxima página",
+                    ),
+                ),
+                ("pass_started_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "completed_at",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="Fin de la última pasada completa",
+                        null=True,
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "Estado de sincronización",
+                "verbose_name_plural": "Estados de sincronización",
+            },
+        ),
+    ]
@@ -1,11 +1,17 @@
-from django.db import models
+import time
+import uuid
+
+from django.conf import settings
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models.functions import Least
+from django.db.models.lookups import GreaterThanOrEqual
 from django.utils import timezone
 
 
 class Payment(models.Model):
-    appointment_id = models.CharField(max_length=100)
+    appointment_id = models.CharField(max_length=100, db_index=True)
     contact_id = models.CharField(max_length=100)
-    preference_id = models.CharField(max_length=100)
+    preference_id = models.CharField(max_length=100, db_index=True)
     payment_id = models.CharField(max_length=100, null=True, blank=True, unique=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, default="pending")
@@ -14,6 +20,68 @@ class Payment(models.Model):
     def __str__(self):
         return f"{self.appointment_id} - {self.status}"
 
+    @classmethod
+    def resolve(cls, preference_id=None, appointment_id=None, payment_id=None):
+        """
+        Buscar el pago local de una notificación de MP con una sola query
+
+        Un OR sobre columnas indexadas reemplaza las tres búsquedas
+        secuenciales; la prioridad se mantiene: preference_id, luego
+        appointment_id (external_reference) y por último payment_id.
+
+        Returns:
+            tuple: (Payment | None, campo por el que se encontró)
+        """
+        lookups = [
+            ("preference_id", preference_id),
+            ("appointment_id", appointment_id),
+            ("payment_id", payment_id),
+        ]
+        lookups = [(field, value) for field, value in lookups if value]
+        if not lookups:
+            return None, None
+
+        condition = models.Q()
+        for field, value in lookups:
+            condition |= models.Q(**{field: value})
+        candidates = list(cls.objects.filter(condition).order_by("id"))
+
+        for field, value in lookups:
+            for payment in candidates:
+                if getattr(payment, field) == value:
+                    return payment, field
+        return None, None
+
+    def apply_mp_status(self, payment_id, status, **fields):
+        """
+        Guardar el estado informado por MercadoPago solo si cambió
+
+        Es un UPDATE condicional: si dos eventos del mismo pago (payment_X y
+        merchant_order_Y) llegan a la vez, solo uno ve cambiar la fila y
+        solo ese notifica a GHL. Un pago aprobado tampoco se pisa con el
+        estado de otro intento de la misma preferencia (ej: un rejected
+        que llega tarde o fuera de orden).
+
+        Returns:
+            bool: True si este llamado cambió la fila
+        """
+        rows = (
+            type(self)
+            .objects.filter(pk=self.pk)
+            .exclude(payment_id=payment_id, status=status)
+        )
+        if status != "approved":
+            rows = rows.exclude(
+                models.Q(status="approved") & ~models.Q(payment_id=payment_id)
+            )
+        updated = rows.update(payment_id=payment_id, status=status, **fields)
+        if updated:
+            self.payment_id = payment_id
+            self.status = status
+            for field, value in fields.items():
+                setattr(self, field, value)
+        return updated > 0
+
 
 class WebhookEvent(models.Model):
     """
@@ -85,6 +153,31 @@ class WebhookEvent(models.Model):
         default=3, help_text="Máximo de reintentos antes de marcar como fallido"
     )
 
+    # Claim atómico entre workers (quién tiene el evento y hasta cuándo)
+    locked_by = models.CharField(
+        max_length=255,
+        null=True,
+        blank=True,
+        help_text="Worker que tomó el evento para procesarlo",
+    )
+    lease_token = models.CharField(
+        max_length=32,
+        null=True,
+        blank=True,
+        db_index=True,
+        help_text="Token del claim actual (identifica el lote del worker)",
+    )
+    lease_expires_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="Hasta cuándo es válido el claim del worker",
+    )
+
+    reclaim_count = models.IntegerField(
+        default=0,
+        help_text="Veces que el evento se reclamó por lease expirado",
+    )
+
     # Información de errores
     last_error = models.TextField(
         null=True, blank=True, help_text="Último error encontrado"
@@ -121,11 +214,236 @@ class WebhookEvent(models.Model):
     def __str__(self):
         return f"{self.webhook_type} - {self.webhook_id} ({self.status})"
 
-    def mark_processing(self):
-        """Marcar como en proceso"""
-        self.status = self.STATUS_PROCESSING
-        self.attempts += 1
-        self.save(update_fields=["status", "attempts", "updated_at"])
+    # Resultados de ingest()
+    INGEST_RECEIVED = "received"  # Evento nuevo, queda en la cola
+    INGEST_ALREADY_RECEIVED = "already_received"  # Duplicado aún sin procesar
+    INGEST_ALREADY_PROCESSED = "already_processed"  # Duplicado ya procesado
+    INGEST_SPOOLED = "spooled"  # BD no disponible, guardado en el spool en disco
+
+    @classmethod
+    def ingest(cls, webhook_id, webhook_type, mp_payment_id=None, raw_payload=None):
+        """
+        Guardar un webhook con un único INSERT ... ON CONFLICT DO NOTHING
+
+        Evita el SELECT previo (una sola ida a la BD para eventos nuevos) y
+        la carrera entre reintentos simultáneos de MP: si dos requests traen
+        el mismo webhook_id, solo uno inserta y el otro ve el duplicado.
+
+        Returns:
+            tuple: (id del evento, INGEST_RECEIVED | INGEST_ALREADY_RECEIVED |
+                INGEST_ALREADY_PROCESSED)
+        """
+        event = cls(
+            webhook_id=webhook_id,
+            webhook_type=webhook_type,
+            mp_payment_id=mp_payment_id,
+            raw_payload=raw_payload if raw_payload is not None else {},
+            status=cls.STATUS_PENDING,
+        )
+
+        if connection.vendor in ("postgresql", "sqlite") and (
+            connection.features.can_return_columns_from_insert
+        ):
+            event_id = cls._insert_or_ignore(event)
+            if event_id is not None:
+                return event_id, cls.INGEST_RECEIVED
+        else:
+            try:
+                with transaction.atomic():
+                    event.save()
+                return event.id, cls.INGEST_RECEIVED
+            except IntegrityError:
+                pass
+
+        # Ya existía: informar si se procesó o sigue pendiente
+        existing = cls.objects.filter(webhook_id=webhook_id).values("id", "processed")[
+            :1
+        ]
+        if not existing:
+            return None, cls.INGEST_ALREADY_RECEIVED
+        if existing[0]["processed"]:
+            return existing[0]["id"], cls.INGEST_ALREADY_PROCESSED
+        return existing[0]["id"], cls.INGEST_ALREADY_RECEIVED
+
+    @classmethod
+    def ingest_many(cls, rows):
+        """
+        Guardar varios webhooks en una sola transacción con bulk_create
+
+        Args:
+            rows: lista de dicts con webhook_id, webhook_type, mp_payment_id
+                y raw_payload
+
+        Returns:
+            dict: webhook_id → (id del evento, resultado como en ingest())
+        """
+        results = {}
+        new_events = {}
+
+        with transaction.atomic():
+            existing = dict(
+                cls.objects.filter(
+                    webhook_id__in={row["webhook_id"] for row in rows}
+                ).values_list("webhook_id", "processed")
+            )
+            for row in rows:
+                webhook_id = row["webhook_id"]
+                if webhook_id in existing or webhook_id in new_events:
+                    continue
+                new_events[webhook_id] = cls(
+                    webhook_id=webhook_id,
+                    webhook_type=row["webhook_type"],
+                    mp_payment_id=row.get("mp_payment_id"),
+                    raw_payload=row.get("raw_payload") or {},
+                    status=cls.STATUS_PENDING,
+                )
+
+            # ignore_conflicts: otro proceso pudo insertar el mismo id recién
+            cls.objects.bulk_create(new_events.values(), ignore_conflicts=True)
+            ids = dict(
+                cls.objects.filter(
+                    webhook_id__in=set(existing) | set(new_events)
+                ).values_list("webhook_id", "id")
+            )
+
+        for webhook_id in new_events:
+            results[webhook_id] = (ids.get(webhook_id), cls.INGEST_RECEIVED)
+        for webhook_id, processed in existing.items():
+            status = (
+                cls.INGEST_ALREADY_PROCESSED
+                if processed
+                else cls.INGEST_ALREADY_RECEIVED
+            )
+            results[webhook_id] = (ids.get(webhook_id), status)
+        return results
+
+    @classmethod
+    def _insert_or_ignore(cls, event):
+        """
+        INSERT ... ON CONFLICT (webhook_id) DO NOTHING RETURNING id
+
+        Returns:
+            int | None: id del evento insertado, None si ya existía
+        """
+        quote = connection.ops.quote_name
+        fields = [f for f in cls._meta.concrete_fields if not f.primary_key]
+        values = [
+            f.get_db_prep_save(f.pre_save(event, add=True), connection) for f in fields
+        ]
+        sql = (
+            f"INSERT INTO {quote(cls._meta.db_table)} "
+            f"({', '.join(quote(f.column) for f in fields)}) "
+            f"VALUES ({', '.join(['%s'] * len(fields))}) "
+            f"ON CONFLICT ({quote(cls._meta.get_field('webhook_id').column)}) "
+            f"DO NOTHING RETURNING {quote(cls._meta.pk.column)}"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, values)
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    @classmethod
+    def _claim(cls, ids, worker_id, lease_seconds=None):
+        """
+        UPDATE condicional pending → processing sobre `ids` (subquery)
+
+        Se ejecuta como una sola sentencia: solo las filas que siguen
+        pendientes cambian de estado, así dos workers nunca toman el mismo
+        evento. En PostgreSQL la subquery usa FOR UPDATE SKIP LOCKED para
+        que los workers no se bloqueen entre sí.
+
+        Returns:
+            str | None: Token del claim si se tomó al menos un evento
+        """
+        if lease_seconds is None:
+            lease_seconds = settings.WEBHOOK_LEASE_SECONDS
+
+        now = timezone.now()
+        token = uuid.uuid4().hex
+
+        if connection.features.has_select_for_update_skip_locked:
+            ids = ids.select_for_update(skip_locked=True)
+
+        with transaction.atomic():
+            claimed = cls.objects.filter(
+                id__in=ids, status=cls.STATUS_PENDING, processed=False
+            ).update(
+                status=cls.STATUS_PROCESSING,
+                attempts=models.F("attempts") + 1,
+                locked_by=worker_id,
+                lease_token=token,
+                lease_expires_at=now + timezone.timedelta(seconds=lease_seconds),
+                updated_at=now,
+            )
+
+        return token if claimed else None
+
+    @classmethod
+    def claim_batch(cls, worker_id, limit=10, lease_seconds=None):
+        """
+        Tomar atómicamente hasta `limit` eventos listos para procesar
+
+        Returns:
+            list[WebhookEvent]: Eventos tomados por este worker
+        """
+        ready_ids = cls.ready_queryset().order_by("created_at").values("id")[:limit]
+
+        token = cls._claim(ready_ids, worker_id, lease_seconds)
+        if not token:
+            return []
+
+        return list(cls.objects.filter(lease_token=token).order_by("created_at"))
+
+    @classmethod
+    def ready_queryset(cls):
+        """Eventos pendientes listos para procesar (sin reintento a futuro)"""
+        return cls.objects.filter(status=cls.STATUS_PENDING, processed=False).filter(
+            models.Q(next_retry_at__isnull=True)
+            | models.Q(next_retry_at__lte=timezone.now())
+        )
+
+    @classmethod
+    def backlog_stats(cls):
+        """
+        Tamaño de la cola y antigüedad del evento más viejo
+
+        Returns:
+            dict: {"pending": int, "oldest_age": segundos (0 si está vacía)}
+        """
+        stats = cls.ready_queryset().aggregate(
+            pending=models.Count("id"), oldest=models.Min("created_at")
+        )
+        oldest_age = 0
+        if stats["oldest"]:
+            oldest_age = (timezone.now() - stats["oldest"]).total_seconds()
+        return {"pending": stats["pending"], "oldest_age": oldest_age}
+
+    def mark_processing(self, worker_id=None, lease_seconds=None):
+        """
+        Marcar como en proceso (claim atómico de este evento)
+
+        Returns:
+            bool: False si otro worker ya lo había tomado
+        """
+        token = type(self)._claim(
+            type(self).objects.filter(pk=self.pk).values("id"),
+            worker_id,
+            lease_seconds,
+        )
+        if not token:
+            return False
+
+        self.refresh_from_db(
+            fields=[
+                "status",
+                "attempts",
+                "locked_by",
+                "lease_token",
+                "lease_expires_at",
+                "updated_at",
+            ]
+        )
+        return True
 
     def mark_success(self):
         """Marcar como exitoso"""
@@ -134,14 +452,13 @@ class WebhookEvent(models.Model):
         self.processed_at = timezone.now()
         self.last_error = None
         self.next_retry_at = None
-        self.save(
-            update_fields=[
+        return self._release_and_save(
+            [
                 "status",
                 "processed",
                 "processed_at",
                 "last_error",
                 "next_retry_at",
-                "updated_at",
             ]
         )
 
@@ -163,12 +480,601 @@ class WebhookEvent(models.Model):
             self.status = self.STATUS_FAILED
             self.next_retry_at = None
 
-        self.save(
-            update_fields=[
+        return self._release_and_save(
+            [
                 "status",
                 "last_error",
                 "error_details",
                 "next_retry_at",
-                "updated_at",
             ]
         )
+
+    def mark_deferred(self, delay, reason):
+        """
+        Devolver a la cola sin consumir un intento (ej: circuito abierto)
+
+        El claim sumó un intento; se descuenta porque el evento no llegó a
+        procesarse.
+        """
+        self.status = self.STATUS_PENDING
+        self.attempts = max(0, self.attempts - 1)
+        self.last_error = reason
+        self.next_retry_at = timezone.now() + timezone.timedelta(seconds=delay)
+        return self._release_and_save(
+            ["status", "attempts", "last_error", "next_retry_at"]
+        )
+
+    def mark_coalesced(self, into_webhook_id):
+        """Marcar como resuelto por otro evento del mismo pago"""
+        self.error_details = {"coalesced_into": into_webhook_id}
+        self.status = self.STATUS_SUCCESS
+        self.processed = True
+        self.processed_at = timezone.now()
+        self.last_error = None
+        self.next_retry_at = None
+        return self._release_and_save(
+            [
+                "status",
+                "processed",
+                "processed_at",
+                "last_error",
+                "error_details",
+                "next_retry_at",
+            ]
+        )
+
+    @classmethod
+    def coalesce_pending(cls, webhook_ids, into_webhook_id):
+        """
+        Resolver los eventos aún en cola de `webhook_ids` con el trabajo de otro
+
+        Solo toca eventos pending sin claim: los que otro worker está
+        procesando terminan por su cuenta (el UPDATE condicional del pago
+        evita el doble aviso a GHL).
+
+        Returns:
+            int: Número de eventos resueltos
+        """
+        now = timezone.now()
+        return cls.objects.filter(
+            webhook_id__in=webhook_ids, status=cls.STATUS_PENDING, processed=False
+        ).update(
+            status=cls.STATUS_SUCCESS,
+            processed=True,
+            processed_at=now,
+            last_error=None,
+            next_retry_at=None,
+            error_details={"coalesced_into": into_webhook_id},
+            updated_at=now,
+        )
+
+    def _release_and_save(self, update_fields):
+        """
+        Liberar el claim y guardar los cambios
+
+        Si el evento se tomó con un claim, solo se guarda mientras el token
+        siga siendo nuestro: si el lease expiró y otro worker lo reclamó, no
+        pisamos su trabajo.
+
+        Returns:
+            bool: False si el claim ya no pertenecía a este worker
+        """
+        token = self.lease_token
+        self.locked_by = None
+        self.lease_token = None
+        self.lease_expires_at = None
+        update_fields = update_fields + ["locked_by", "lease_token", "lease_expires_at"]
+
+        if not token:
+            self.save(update_fields=update_fields + ["updated_at"])
+            return True
+
+        self.updated_at = timezone.now()
+        values = {field: getattr(self, field) for field in update_fields}
+        updated = (
+            type(self)
+            .objects.filter(pk=self.pk, lease_token=token)
+            .update(updated_at=self.updated_at, **values)
+        )
+        return updated > 0
+
+    @classmethod
+    def extend_lease(cls, lease_token, lease_seconds=None):
+        """
+        Heartbeat: renovar el lease de los eventos tomados con `lease_token`
+
+        Returns:
+            int: Número de eventos cuyo lease se renovó
+        """
+        if lease_seconds is None:
+            lease_seconds = settings.WEBHOOK_LEASE_SECONDS
+
+        now = timezone.now()
+        return cls.objects.filter(
+            lease_token=lease_token, status=cls.STATUS_PROCESSING
+        ).update(lease_expires_at=now + timezone.timedelta(seconds=lease_seconds))
+
+    def heartbeat(self, lease_seconds=None):
+        """
+        Renovar el lease de este evento
+
+        Returns:
+            bool: False si el lease ya no es nuestro (fue reclamado)
+        """
+        if not self.lease_token:
+            return False
+        return type(self).extend_lease(self.lease_token, lease_seconds) > 0
+
+    @classmethod
+    def reclaim_expired(cls, lease_seconds=None):
+        """
+        Devolver a la cola los eventos cuyo worker murió en "processing"
+
+        Un evento está huérfano si su lease venció (o si quedó en processing
+        sin lease, de antes de existir los claims). Si aún le quedan intentos
+        vuelve a pending; si no, se marca como fallido.
+
+        Returns:
+            int: Número de eventos reclamados
+        """
+        if lease_seconds is None:
+            lease_seconds = settings.WEBHOOK_LEASE_SECONDS
+
+        now = timezone.now()
+        expired = cls.objects.filter(status=cls.STATUS_PROCESSING).filter(
+            models.Q(lease_expires_at__lt=now)
+            | models.Q(
+                lease_expires_at__isnull=True,
+                updated_at__lt=now - timezone.timedelta(seconds=lease_seconds),
+            )
+        )
+        release = {
+            "locked_by": None,
+            "lease_token": None,
+            "lease_expires_at": None,
+            "next_retry_at": None,
+            "last_error": "Lease expirado: el worker no terminó de procesar el evento",
+            "reclaim_count": models.F("reclaim_count") + 1,
+            "updated_at": now,
+        }
+
+        with transaction.atomic():
+            retried = expired.filter(attempts__lt=models.F("max_attempts")).update(
+                status=cls.STATUS_PENDING, **release
+            )
+            failed = expired.update(status=cls.STATUS_FAILED, **release)
+
+        return retried + failed
+
+
+class RateLimitBucket(models.Model):
+    """
+    🔹 Token bucket compartido por todos los procesos (web + workers)
+
+    Conceptos clave:
+    - Un bucket por clave (ej: "mp:api.mercadopago.com", "ghl:<location_id>")
+    - Se recarga a `rate` tokens por segundo hasta `capacity` (ráfaga)
+    - La recarga y el consumo son un solo UPDATE condicional: dos procesos
+      nunca gastan el mismo token
+    """
+
+    key = models.CharField(max_length=150, unique=True)
+    tokens = models.FloatField(help_text="Tokens disponibles en refilled_at")
+    capacity = models.FloatField(help_text="Máximo de tokens (ráfaga permitida)")
+    rate = models.FloatField(help_text="Tokens que se recargan por segundo")
+    refilled_at = models.FloatField(help_text="Epoch (segundos) de la última recarga")
+
+    class Meta:
+        db_table = "payments_rate_limit_bucket"
+
+    def __str__(self):
+        return f"{self.key} ({self.rate}/s, ráfaga {self.capacity})"
+
+    @staticmethod
+    def _available(now):
+        """Tokens disponibles ahora, como expresión SQL sobre la fila"""
+        return Least(
+            models.F("capacity"),
+            models.F("tokens") + (now - models.F("refilled_at")) * models.F("rate"),
+        )
+
+    @classmethod
+    def try_acquire(cls, key, rate, capacity, tokens=1):
+        """
+        Intentar consumir `tokens` del bucket `key` (creándolo si no existe)
+
+        Returns:
+            float: 0 si se consumieron; si no, segundos a esperar para que
+                haya tokens suficientes
+        """
+        now = time.time()
+        available = cls._available(now)
+
+        updated = (
+            cls.objects.filter(key=key)
+            .filter(GreaterThanOrEqual(available, tokens))
+            .update(tokens=available - tokens, refilled_at=now)
+        )
+        if updated:
+            return 0.0
+
+        bucket = cls.objects.filter(key=key).first()
+        if bucket is None:
+            # Primer uso de la clave: crear el bucket lleno (si otro proceso
+            # lo creó al mismo tiempo, ignore_conflicts evita el error)
+            cls.objects.bulk_create(
+                [
+                    cls(
+                        key=key,
+                        tokens=capacity,
+                        capacity=capacity,
+                        rate=rate,
+                        refilled_at=now,
+                    )
+                ],
+                ignore_conflicts=True,
+            )
+            return cls.try_acquire(key, rate, capacity, tokens)
+
+        if bucket.rate != rate or bucket.capacity != capacity:
+            # La configuración cambió: aplicarla al bucket existente
+            cls.objects.filter(pk=bucket.pk).update(rate=rate, capacity=capacity)
+
+        current = min(capacity, bucket.tokens + (now - bucket.refilled_at) * rate)
+        return max((tokens - current) / rate, 0.001)
+
+    @classmethod
+    def drain(cls, key, seconds):
+        """
+        Vaciar el bucket por `seconds` (la API respondió 429)
+
+        Los tokens quedan negativos: nadie vuelve a llamar hasta que se
+        recarguen.
+        """
+        now = time.time()
+        cls.objects.filter(key=key).update(
+            tokens=-models.F("rate") * seconds, refilled_at=now
+        )
+
+
+class GhlOutboxMessage(models.Model):
+    """
+    🔹 Outbox de efectos en GoHighLevel (tags, custom fields)
+
+    Conceptos clave:
+    - Transactional outbox: el mensaje se guarda en la MISMA transacción que
+      el cambio de estado del Payment; si uno se guarda, el otro también
+    - El procesador de webhooks ya no espera a GHL: un dispatcher aparte
+      (dispatch_ghl) drena el outbox con su propia concurrencia, reintentos
+      y rate limit
+    - Un tag que falla ya no se pierde: queda en el outbox hasta agotar
+      GHL_OUTBOX_MAX_ATTEMPTS
+    """
+
+    STATUS_PENDING = "pending"
+    STATUS_PROCESSING = "processing"
+    STATUS_SUCCESS = "success"
+    STATUS_FAILED = "failed"
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pendiente"),
+        (STATUS_PROCESSING, "Enviando"),
+        (STATUS_SUCCESS, "Enviado"),
+        (STATUS_FAILED, "Fallido"),
+    ]
+
+    ACTION_ADD_TAG = "add_tag"
+    ACTION_UPDATE_CUSTOM_FIELD = "update_custom_field"
+
+    ACTION_CHOICES = [
+        (ACTION_ADD_TAG, "Agregar tag"),
+        (ACTION_UPDATE_CUSTOM_FIELD, "Actualizar custom field"),
+    ]
+
+    payment = models.ForeignKey(
+        Payment,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="ghl_messages",
+        help_text="Pago cuyo cambio de estado originó el mensaje",
+    )
+    contact_id = models.CharField(
+        max_length=100, db_index=True, help_text="ID del contacto en GHL"
+    )
+    action = models.CharField(max_length=50, choices=ACTION_CHOICES)
+    payload = models.JSONField(
+        default=dict, help_text="Argumentos de la acción (ej: {'tag': ...})"
+    )
+
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True
+    )
+    attempts = models.IntegerField(default=0, help_text="Número de envíos intentados")
+    max_attempts = models.IntegerField(
+        default=8, help_text="Máximo de intentos antes de marcar como fallido"
+    )
+    next_retry_at = models.DateTimeField(
+        null=True, blank=True, help_text="Cuándo debe intentarse el próximo envío"
+    )
+    last_error = models.TextField(null=True, blank=True)
+
+    # Claim atómico entre dispatchers
+    locked_by = models.CharField(max_length=255, null=True, blank=True)
+    lease_token = models.CharField(max_length=32, null=True, blank=True, db_index=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        verbose_name = "Mensaje a GHL"
+        verbose_name_plural = "Outbox de GHL"
+        indexes = [models.Index(fields=["status", "next_retry_at"])]
+
+    def __str__(self):
+        return f"{self.action} → {self.contact_id} ({self.status})"
+
+    @classmethod
+    def enqueue(cls, contact_id, action, payload=None, payment=None):
+        """
+        Agregar un mensaje al outbox
+
+        Debe llamarse dentro de la transacción que guarda el cambio que lo
+        origina (transaction.atomic). El mensaje espera GHL_COALESCE_WINDOW
+        segundos para que otros cambios del mismo contacto se envíen en la
+        misma actualización (ver claim_batch).
+        """
+        next_retry_at = None
+        if settings.GHL_COALESCE_WINDOW > 0:
+            next_retry_at = timezone.now() + timezone.timedelta(
+                seconds=settings.GHL_COALESCE_WINDOW
+            )
+        return cls.objects.create(
+            payment=payment,
+            contact_id=contact_id,
+            action=action,
+            payload=payload or {},
+            max_attempts=settings.GHL_OUTBOX_MAX_ATTEMPTS,
+            next_retry_at=next_retry_at,
+        )
+
+    @classmethod
+    def ready_queryset(cls):
+        """Mensajes pendientes listos para enviar"""
+        return cls.objects.filter(status=cls.STATUS_PENDING).filter(
+            models.Q(next_retry_at__isnull=True)
+            | models.Q(next_retry_at__lte=timezone.now())
+        )
+
+    @classmethod
+    def claim_batch(cls, worker_id, limit=10, lease_seconds=None):
+        """
+        Tomar atómicamente hasta `limit` mensajes (mismo esquema que
+        WebhookEvent.claim_batch: UPDATE condicional + SKIP LOCKED)
+
+        Junto con cada mensaje listo se toman los demás pendientes del mismo
+        contacto que siguen en su ventana de coalescing (nunca intentados):
+        el dispatcher los envía todos en una sola actualización. Los que
+        esperan un reintento no se adelantan.
+
+        Returns:
+            list[GhlOutboxMessage]: Mensajes tomados por este dispatcher
+        """
+        if lease_seconds is None:
+            lease_seconds = settings.GHL_OUTBOX_LEASE_SECONDS
+
+        now = timezone.now()
+        token = uuid.uuid4().hex
+        ready_ids = cls.ready_queryset().order_by("created_at").values("id")[:limit]
+        if connection.features.has_select_for_update_skip_locked:
+            ready_ids = ready_ids.select_for_update(skip_locked=True)
+
+        claim = {
+            "status": cls.STATUS_PROCESSING,
+            "attempts": models.F("attempts") + 1,
+            "locked_by": worker_id,
+            "lease_token": token,
+            "lease_expires_at": now + timezone.timedelta(seconds=lease_seconds),
+            "updated_at": now,
+        }
+        with transaction.atomic():
+            claimed = cls.objects.filter(
+                id__in=ready_ids, status=cls.STATUS_PENDING
+            ).update(**claim)
+            if not claimed:
+                return []
+
+            contact_ids = set(
+                cls.objects.filter(lease_token=token).values_list(
+                    "contact_id", flat=True
+                )
+            )
+            cls.objects.filter(
+                contact_id__in=contact_ids, status=cls.STATUS_PENDING
+            ).filter(
+                models.Q(attempts=0)
+                | models.Q(next_retry_at__isnull=True)
+                | models.Q(next_retry_at__lte=now)
+            ).update(
+                **claim
+            )
+
+        return list(cls.objects.filter(lease_token=token).order_by("created_at"))
+
+    def mark_sent(self):
+        """Marcar como enviado"""
+        self.status = self.STATUS_SUCCESS
+        self.processed_at = timezone.now()
+        self.last_error = None
+        self.next_retry_at = None
+        return self._release_and_save(
+            ["status", "processed_at", "last_error", "next_retry_at"]
+        )
+
+    def mark_failed(self, error_message):
+        """Programar reintento con backoff exponencial (o fallar si no quedan)"""
+        self.last_error = error_message
+        if self.attempts < self.max_attempts:
+            delay = min(
+                settings.GHL_OUTBOX_RETRY_MAX,
+                settings.GHL_OUTBOX_RETRY_BASE * 2 ** (self.attempts - 1),
+            )
+            self.next_retry_at = timezone.now() + timezone.timedelta(seconds=delay)
+            self.status = self.STATUS_PENDING
+        else:
+            self.next_retry_at = None
+            self.status = self.STATUS_FAILED
+        return self._release_and_save(["status", "last_error", "next_retry_at"])
+
+    def mark_deferred(self, delay, reason):
+        """Devolver al outbox sin consumir un intento (ej: circuito abierto)"""
+        self.status = self.STATUS_PENDING
+        self.attempts = max(0, self.attempts - 1)
+        self.last_error = reason
+        self.next_retry_at = timezone.now() + timezone.timedelta(seconds=delay)
+        return self._release_and_save(
+            ["status", "attempts", "last_error", "next_retry_at"]
+        )
+
+    def _release_and_save(self, update_fields):
+        """
+        Liberar el claim y guardar solo si el lease sigue siendo nuestro
+
+        Returns:
+            bool: False si otro dispatcher reclamó el mensaje
+        """
+        token = self.lease_token
+        self.locked_by = None
+        self.lease_token = None
+        self.lease_expires_at = None
+        self.updated_at = timezone.now()
+        update_fields = update_fields + [
+            "locked_by",
+            "lease_token",
+            "lease_expires_at",
+            "updated_at",
+        ]
+        values = {field: getattr(self, field) for field in update_fields}
+        return (
+            type(self).objects.filter(pk=self.pk, lease_token=token).update(**values)
+            > 0
+        )
+
+    @classmethod
+    def extend_lease(cls, lease_token, lease_seconds=None):
+        """
+        Heartbeat: renovar el lease de los mensajes tomados con `lease_token`
+
+        Returns:
+            int: Número de mensajes cuyo lease se renovó
+        """
+        if lease_seconds is None:
+            lease_seconds = settings.GHL_OUTBOX_LEASE_SECONDS
+
+        now = timezone.now()
+        return cls.objects.filter(
+            lease_token=lease_token, status=cls.STATUS_PROCESSING
+        ).update(lease_expires_at=now + timezone.timedelta(seconds=lease_seconds))
+
+    @classmethod
+    def reclaim_expired(cls):
+        """
+        Devolver al outbox los mensajes de un dispatcher caído
+
+        Si aún les quedan intentos vuelven a pending; si no, se marcan como
+        fallidos (igual que WebhookEvent.reclaim_expired).
+
+        Returns:
+            int: Número de mensajes reclamados
+        """
+        now = timezone.now()
+        expired = cls.objects.filter(
+            status=cls.STATUS_PROCESSING, lease_expires_at__lt=now
+        )
+        release = {
+            "locked_by": None,
+            "lease_token": None,
+            "lease_expires_at": None,
+            "next_retry_at": None,
+            "last_error": "Lease expirado: el dispatcher no terminó el envío",
+            "updated_at": now,
+        }
+
+        with transaction.atomic():
+            retried = expired.filter(attempts__lt=models.F("max_attempts")).update(
+                status=cls.STATUS_PENDING, **release
+            )
+            failed = expired.update(status=cls.STATUS_FAILED, **release)
+
+        return retried + failed
+
+
+class Contact(models.Model):
+    """
+    🔹 Copia local del directorio de contactos de GoHighLevel
+
+    La mantiene sync_ghl_contacts (sincronización incremental paginada);
+    las vistas leen nombres y listados de aquí en vez de llamar a GHL.
+    """
+
+    ghl_id = models.CharField(max_length=100, unique=True, help_text="ID en GHL")
+    name = models.CharField(max_length=255, db_index=True)
+    email = models.CharField(max_length=255, blank=True, default="", db_index=True)
+    phone = models.CharField(max_length=50, blank=True, default="")
+    tags = models.JSONField(default=list, blank=True)
+    date_updated = models.DateTimeField(
+        null=True, blank=True, help_text="dateUpdated del contacto en GHL"
+    )
+    synced_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["name"]
+        verbose_name = "Contacto GHL"
+        verbose_name_plural = "Contactos GHL"
+
+    def __str__(self):
+        return f"{self.name} ({self.ghl_id})"
+
+    def to_dict(self):
+        """Mismo formato que ghl_service.get_contacts"""
+        return {
+            "id": self.ghl_id,
+            "name": self.name,
+            "email": self.email,
+            "phone": self.phone,
+            "tags": self.tags,
+        }
+
+
+class SyncState(models.Model):
+    """
+    🔹 Cursor persistente de una sincronización paginada
+
+    Se guarda después de cada página: si el proceso se corta, la próxima
+    ejecución sigue desde la última página confirmada.
+    """
+
+    name = models.CharField(max_length=100, unique=True)
+    cursor = models.JSONField(
+        default=dict, blank=True, help_text="Cursor de la próxima página"
+    )
+    pass_started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(
+        null=True, blank=True, help_text="Fin de la última pasada completa"
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Estado de sincronización"
+        verbose_name_plural = "Estados de sincronización"
+
+    def __str__(self):
+        return f"{self.name} ({'en curso' if self.cursor else 'al día'})"
+
+    @classmethod
+    def load(cls, name):
+        state, _ = cls.objects.get_or_create(name=name)
+        return state
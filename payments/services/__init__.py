@@ -1 +1,13 @@
-from .ghl_service import add_tag_to_contact, get_contacts
+from .ghl_service import (
+    add_tag_to_contact,
+    get_contacts,
+    get_contacts_cached,
+    update_contact,
+)
+
+__all__ = [
+    "add_tag_to_contact",
+    "get_contacts",
+    "get_contacts_cached",
+    "update_contact",
+]
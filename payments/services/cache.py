@@ -0,0 +1,184 @@
+"""
+🔹 Cache en memoria acotado (LRU + TTL) para uso dentro de un proceso
+
+Conceptos clave:
+- LRU: al llenarse se descarta la entrada usada hace más tiempo
+- TTL: cada entrada vence después de `ttl` segundos
+- Thread-safe: se comparte entre los threads del servidor y del worker
+- Observabilidad: aciertos/fallos en las métricas como cache.<nombre>.hits/misses
+- RefreshCache: para llamadas a APIs, con refresco en segundo plano
+  (stale-while-revalidate) y una sola carga por clave a la vez
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from django.db import connection
+
+from payments.services import metrics
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Diccionario acotado con vencimiento por entrada
+    """
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 60):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        metrics.register_gauge(f"cache.{name}.size", self.__len__)
+
+    def get(self, key, default=None):
+        """Obtener un valor vigente (cuenta como acierto o fallo)"""
+        value = self.peek(key, _MISSING)
+        if value is _MISSING:
+            metrics.increment(f"cache.{self.name}.misses")
+            return default
+
+        metrics.increment(f"cache.{self.name}.hits")
+        return value
+
+    def peek(self, key, default=None):
+        """Obtener un valor vigente sin contarlo en las métricas"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] <= now:
+                del self._data[key]
+                entry = _MISSING
+            if entry is _MISSING:
+                return default
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl: float = None):
+        """Guardar un valor (con TTL propio opcional)"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+class RefreshCache:
+    """
+    Cache de valores caros de obtener (ej: llamadas a una API externa)
+
+    - TTL: un valor vale `ttl` segundos desde que se obtuvo
+    - Stale-while-revalidate: hasta `stale_ttl` segundos después se sigue
+      devolviendo el valor vencido mientras un thread lo refresca en
+      segundo plano; quien consulta nunca espera a la API si hay valor
+    - Single-flight: si varios threads piden la misma clave sin valor, solo
+      uno llama a `loader` y los demás esperan su resultado
+    - Los resultados que `should_cache` rechaza (ej: errores) no se guardan
+      y no reemplazan a un valor anterior
+    """
+
+    def __init__(self, name, loader, ttl=60, stale_ttl=300, should_cache=None):
+        self.name = name
+        self.loader = loader
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.should_cache = should_cache or (lambda value: True)
+        self._entries = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        metrics.register_gauge(f"cache.{name}.size", self.__len__)
+
+    def get(self, *args):
+        """Valor para los argumentos `args` de `loader`"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(args)
+            if entry is not None and now < entry[0]:
+                metrics.increment(f"cache.{self.name}.hits")
+                return entry[2]
+
+            if entry is not None and now < entry[1]:
+                # Vencido pero utilizable: refrescar sin hacer esperar
+                metrics.increment(f"cache.{self.name}.stale")
+                if args not in self._inflight:
+                    self._inflight[args] = Future()
+                    threading.Thread(
+                        target=self._refresh_in_background,
+                        args=(args,),
+                        name=f"cache-{self.name}",
+                        daemon=True,
+                    ).start()
+                return entry[2]
+
+            metrics.increment(f"cache.{self.name}.misses")
+            future = self._inflight.get(args)
+            leader = future is None
+            if leader:
+                future = self._inflight[args] = Future()
+
+        if leader:
+            self._load(args)
+        return future.result()
+
+    def _refresh_in_background(self, args):
+        try:
+            self._load(args)
+        finally:
+            # El loader puede usar la BD (ej: rate limiter): cerrar la
+            # conexión de este thread
+            connection.close()
+
+    def _load(self, args):
+        future = self._inflight[args]
+        try:
+            value = self.loader(*args)
+        except Exception as e:
+            with self._lock:
+                del self._inflight[args]
+            future.set_exception(e)
+            return
+
+        with self._lock:
+            if self.should_cache(value):
+                now = time.monotonic()
+                self._entries[args] = (
+                    now + self.ttl,
+                    now + self.ttl + self.stale_ttl,
+                    value,
+                )
+            else:
+                # Error de la API: mantener el valor anterior si lo había
+                entry = self._entries.get(args)
+                if entry is not None and time.monotonic() < entry[1]:
+                    value = entry[2]
+            del self._inflight[args]
+        metrics.increment(f"cache.{self.name}.refreshes")
+        future.set_result(value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
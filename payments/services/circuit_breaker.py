@@ -0,0 +1,232 @@
+"""
+🔹 Circuit breakers por host para las llamadas a MercadoPago y GHL
+
+Conceptos clave:
+- Ventana de fallas: se miran las llamadas de los últimos
+  CIRCUIT_WINDOW_SECONDS; si fallan al menos CIRCUIT_FAILURE_RATE de ellas
+  (con un mínimo de CIRCUIT_MIN_CALLS) el circuito se abre
+- Abierto: las llamadas fallan al instante con CircuitOpenError, sin esperar
+  el timeout de una API caída
+- Semiabierto: pasados CIRCUIT_OPEN_SECONDS se deja pasar UNA llamada de
+  prueba; si funciona el circuito se cierra, si no vuelve a abrirse. Solo
+  el resultado de esa llamada (identificada por su token) decide: una
+  llamada lenta que empezó con el circuito cerrado no cuenta
+- Falla = timeout, error de conexión o respuesta 5xx (un 4xx es un error
+  nuestro: la API está respondiendo)
+
+Estados:
+    closed ──(tasa de fallas)──▶ open ──(CIRCUIT_OPEN_SECONDS)──▶ half_open
+      ▲                                                            │
+      └───────────────────(prueba exitosa)─────────────────────────┘
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import requests
+from django.conf import settings
+
+from payments.services import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """
+    El circuito del host está abierto: la llamada no se hizo
+
+    Hereda de requests.ConnectionError para que el código que ya maneja
+    errores de conexión lo trate igual (falla reintentable).
+    """
+
+    def __init__(self, name, retry_after):
+        super().__init__(
+            f"Circuito abierto para {name}, reintentar en {retry_after:.0f}s"
+        )
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker thread-safe con ventana de tiempo deslizante
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name,
+        window_seconds=None,
+        min_calls=None,
+        failure_rate=None,
+        open_seconds=None,
+    ):
+        self.name = name
+        self.window_seconds = window_seconds or settings.CIRCUIT_WINDOW_SECONDS
+        self.min_calls = min_calls or settings.CIRCUIT_MIN_CALLS
+        self.failure_rate = failure_rate or settings.CIRCUIT_FAILURE_RATE
+        self.open_seconds = open_seconds or settings.CIRCUIT_OPEN_SECONDS
+        self._lock = threading.Lock()
+        self._calls = deque()
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._probe = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _current_state(self, now):
+        if self._state == self.OPEN and now - self._opened_at >= self.open_seconds:
+            return self.HALF_OPEN
+        return self._state
+
+    def retry_after(self):
+        """Segundos hasta que el circuito deje pasar una llamada de prueba"""
+        with self._lock:
+            if self._state != self.OPEN:
+                return 0.0
+            return max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+    def is_available(self):
+        """
+        True si una llamada ahora no fallaría al instante (sin consumir la
+        llamada de prueba)
+        """
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            return state == self.CLOSED or (
+                state == self.HALF_OPEN and not self._probing
+            )
+
+    def before_call(self):
+        """
+        Pedir permiso para hacer una llamada
+
+        Returns:
+            int | None: Token de la llamada de prueba (None con el circuito
+                cerrado); pasarlo a record() o release()
+
+        Raises:
+            CircuitOpenError: si el circuito está abierto (o ya hay una
+                llamada de prueba en curso)
+        """
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == self.CLOSED:
+                return None
+            if state == self.HALF_OPEN and not self._probing:
+                self._state = self.HALF_OPEN
+                self._probing = True
+                self._probe += 1
+                return self._probe
+            retry_after = max(0.0, self.open_seconds - (now - self._opened_at))
+
+        metrics.increment(f"circuit.{self.name}.rejected")
+        raise CircuitOpenError(self.name, retry_after)
+
+    def record(self, success: bool, probe=None):
+        """
+        Registrar el resultado de una llamada permitida por before_call()
+
+        Con el circuito semiabierto solo cuenta la llamada de prueba en
+        curso (`probe` = token que devolvió before_call()).
+        """
+        with self._lock:
+            now = time.monotonic()
+
+            if self._state == self.HALF_OPEN:
+                if not self._is_current_probe(probe):
+                    return
+                self._probing = False
+                if success:
+                    self._calls.clear()
+                    self._state = self.CLOSED
+                    logger.info(f"🔌 ✓ Circuito cerrado | {self.name}")
+                else:
+                    self._open(now)
+                return
+
+            self._calls.append((now, success))
+            while self._calls and now - self._calls[0][0] > self.window_seconds:
+                self._calls.popleft()
+
+            if self._state == self.CLOSED and not success:
+                failures = sum(1 for _, ok in self._calls if not ok)
+                if (
+                    len(self._calls) >= self.min_calls
+                    and failures / len(self._calls) >= self.failure_rate
+                ):
+                    self._open(now)
+
+    def release(self, probe):
+        """
+        Devolver la llamada de prueba sin resultado (la llamada no se hizo,
+        ej: se agotó el presupuesto esperando el rate limiter)
+        """
+        with self._lock:
+            if self._is_current_probe(probe):
+                self._probing = False
+
+    def _is_current_probe(self, probe):
+        return probe is not None and self._probing and probe == self._probe
+
+    def _open(self, now):
+        self._state = self.OPEN
+        self._opened_at = now
+        self._calls.clear()
+        metrics.increment(f"circuit.{self.name}.opened")
+        logger.warning(
+            f"🔌 ✗ Circuito abierto | {self.name} | "
+            f"Reintento en {self.open_seconds:.0f}s"
+        )
+
+    def stats(self):
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            failures = sum(1 for _, ok in self._calls if not ok)
+            return {"state": state, "calls": len(self._calls), "failures": failures}
+
+
+_lock = threading.Lock()
+_breakers = {}
+_pid = None
+
+
+def get_breaker(name) -> CircuitBreaker:
+    """Circuit breaker compartido para `name` (ej: https://api.mercadopago.com)"""
+    global _pid
+
+    with _lock:
+        # El estado del padre no aplica a un proceso hijo recién creado
+        if _pid != os.getpid():
+            _breakers.clear()
+            _pid = os.getpid()
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name)
+    return breaker
+
+
+def breaker_stats() -> dict:
+    """Estado de cada circuito: name → {"state", "calls", "failures"}"""
+    with _lock:
+        breakers = dict(_breakers) if _pid == os.getpid() else {}
+    return {name: breaker.stats() for name, breaker in breakers.items()}
+
+
+def reset():
+    with _lock:
+        _breakers.clear()
+
+
+metrics.register_gauge("circuit_breakers", breaker_stats)
@@ -0,0 +1,238 @@
+"""
+🔹 Sincronización incremental de contactos de GHL a la tabla Contact
+
+Conceptos clave:
+- Paginada: páginas de GHL_CONTACT_SYNC_PAGE_SIZE con el cursor de GHL
+  (meta.startAfterId + meta.startAfter)
+- Reanudable: el cursor se guarda en SyncState después de cada página; una
+  ejecución cortada sigue desde la última página confirmada
+- Incremental: solo se escriben los contactos nuevos o con otro dateUpdated
+  (upsert en bloque); los que no cambiaron no generan escrituras
+- Los tags leídos alimentan el cache de tags conocidos de ghl_service
+- Backfill: los contactos que una vista no encuentra localmente se traen de
+  a uno (GET /contacts/{id}) en segundo plano, sin frenar la respuesta
+"""
+
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from payments.models import Contact, SyncState
+from payments.services import metrics
+from payments.services.cache import TTLCache
+from payments.services.ghl_service import (
+    get_contact,
+    get_contacts,
+    remember_contact_tags,
+)
+
+logger = logging.getLogger(__name__)
+
+SYNC_NAME = "ghl_contacts"
+
+_FIELDS = ["name", "email", "phone", "tags", "date_updated"]
+
+
+def _to_row(contact):
+    date_updated = contact.get("date_updated")
+    return Contact(
+        ghl_id=contact["id"],
+        name=contact["name"][:255],
+        email=(contact["email"] or "")[:255],
+        phone=(contact["phone"] or "")[:50],
+        tags=contact["tags"],
+        date_updated=parse_datetime(date_updated) if date_updated else None,
+    )
+
+
+def save_page(contacts):
+    """
+    Guardar una página de contactos (formato de get_contacts)
+
+    Returns:
+        int: Contactos nuevos o actualizados
+    """
+    rows = [_to_row(contact) for contact in contacts if contact.get("id")]
+    for row in rows:
+        remember_contact_tags(row.ghl_id, row.tags)
+
+    known = dict(
+        Contact.objects.filter(ghl_id__in=[row.ghl_id for row in rows]).values_list(
+            "ghl_id", "date_updated"
+        )
+    )
+    changed = [
+        row
+        for row in rows
+        if row.ghl_id not in known
+        or row.date_updated is None
+        or known[row.ghl_id] != row.date_updated
+    ]
+    if changed:
+        Contact.objects.bulk_create(
+            changed,
+            update_conflicts=True,
+            unique_fields=["ghl_id"],
+            update_fields=_FIELDS + ["synced_at"],
+        )
+    return len(changed)
+
+
+def sync_contacts(max_pages=None, page_size=None, full=False):
+    """
+    Sincronizar contactos de GHL desde el cursor guardado
+
+    Args:
+        max_pages: Páginas a procesar en esta ejecución (None: hasta el final)
+        page_size: Contactos por página (default: GHL_CONTACT_SYNC_PAGE_SIZE)
+        full: Descartar el cursor y empezar una pasada desde el principio
+
+    Returns:
+        dict: 'success', 'pages', 'fetched', 'saved', 'completed' y 'message'
+    """
+    page_size = page_size or settings.GHL_CONTACT_SYNC_PAGE_SIZE
+    state = SyncState.load(SYNC_NAME)
+    if full or not state.cursor:
+        state.cursor = {}
+        state.pass_started_at = timezone.now()
+
+    pages = fetched = saved = 0
+    completed = False
+    while max_pages is None or pages < max_pages:
+        result = get_contacts(
+            limit=page_size,
+            start_after_id=state.cursor.get("startAfterId"),
+            start_after=state.cursor.get("startAfter"),
+        )
+        if not result["success"]:
+            logger.error(
+                f"👥 ✗ Sincronización interrumpida | Página: {pages + 1} | "
+                f"Error: {result['message']}"
+            )
+            return {
+                "success": False,
+                "pages": pages,
+                "fetched": fetched,
+                "saved": saved,
+                "completed": False,
+                "message": result["message"],
+            }
+
+        contacts = result["contacts"]
+        pages += 1
+        fetched += len(contacts)
+        saved += save_page(contacts)
+
+        meta = result.get("meta") or {}
+        cursor = {
+            "startAfterId": meta.get("startAfterId"),
+            "startAfter": meta.get("startAfter"),
+        }
+        if (
+            len(contacts) < page_size
+            or not cursor["startAfterId"]
+            or cursor == state.cursor
+        ):
+            completed = True
+            state.cursor = {}
+            state.completed_at = timezone.now()
+            state.save()
+            break
+
+        state.cursor = cursor
+        state.save()
+
+    metrics.increment("contacts.sync.fetched", fetched)
+    metrics.increment("contacts.sync.saved", saved)
+    logger.info(
+        f"👥 ✓ Sincronización {'completa' if completed else 'parcial'} | "
+        f"Páginas: {pages} | Leídos: {fetched} | Guardados: {saved}"
+    )
+    return {
+        "success": True,
+        "pages": pages,
+        "fetched": fetched,
+        "saved": saved,
+        "completed": completed,
+        "message": f"{fetched} contactos leídos, {saved} nuevos o actualizados",
+    }
+
+
+# IDs que GHL no reconoce: no volver a pedirlos en cada carga del historial
+_unknown = TTLCache(
+    "ghl_unknown_contacts", maxsize=10000, ttl=settings.GHL_CONTACT_BACKFILL_RETRY
+)
+_backfilling = set()
+_backfill_lock = threading.Lock()
+
+
+def backfill_contacts(contact_ids):
+    """
+    Traer de GHL los contactos indicados y guardarlos en la tabla local
+
+    Returns:
+        int: Contactos guardados
+    """
+    contacts = []
+    for contact_id in contact_ids:
+        result = get_contact(contact_id)
+        if result["success"]:
+            contacts.append(result["contact"])
+        elif result.get("not_found"):
+            _unknown.set(contact_id, True)
+        else:
+            # GHL no responde: el resto se reintenta en otra carga
+            break
+
+    saved = save_page(contacts)
+    metrics.increment("contacts.backfill.saved", saved)
+    if saved:
+        logger.info(f"👥 ✓ Contactos completados desde GHL: {saved}")
+    return saved
+
+
+def _backfill_in_thread(contact_ids):
+    try:
+        backfill_contacts(contact_ids)
+    except Exception as e:
+        logger.error(f"👥 ✗ Error completando contactos | Error: {str(e)}")
+    finally:
+        with _backfill_lock:
+            _backfilling.difference_update(contact_ids)
+        connection.close()
+
+
+def backfill_contacts_async(contact_ids):
+    """
+    Completar en segundo plano los contactos que faltan localmente
+
+    Como mucho GHL_CONTACT_BACKFILL_BATCH IDs por llamada, sin repetir los
+    que ya se están buscando ni los que GHL no reconoció hace poco.
+
+    Returns:
+        threading.Thread | None: Thread lanzado (None si no hubo nada que buscar)
+    """
+    with _backfill_lock:
+        contact_ids = [
+            contact_id
+            for contact_id in dict.fromkeys(contact_ids)
+            if contact_id
+            and contact_id not in _backfilling
+            and _unknown.peek(contact_id) is None
+        ][: settings.GHL_CONTACT_BACKFILL_BATCH]
+        if not contact_ids:
+            return None
+        _backfilling.update(contact_ids)
+
+    thread = threading.Thread(
+        target=_backfill_in_thread,
+        args=(contact_ids,),
+        name="contact-backfill",
+        daemon=True,
+    )
+    thread.start()
+    return thread
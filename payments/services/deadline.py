@@ -0,0 +1,78 @@
+"""
+🔹 Presupuestos de tiempo (deadlines) para las llamadas salientes
+
+Conceptos clave:
+- Cada request o evento recibe un presupuesto total de tiempo; todas sus
+  llamadas a MercadoPago/GHL lo comparten
+- El timeout de conexión/lectura de cada llamada sale de lo que queda del
+  presupuesto: una API lenta no puede retener un worker indefinidamente
+- contextvars: el deadline sigue al código (funciones anidadas) sin pasarlo
+  como argumento. Un thread nuevo o de un pool NO lo hereda: hay que correr
+  el trabajo con contextvars.copy_context().run (como el hedge de
+  mp_service) o abrir el deadline dentro del thread (como WebhookProcessor)
+- Anidable: un deadline interno nunca extiende al externo
+
+Uso:
+    with deadline(15):
+        http_client.post(...)   # timeout ≤ lo que queda de los 15 s
+"""
+
+import contextvars
+import time
+from contextlib import contextmanager
+
+import requests
+
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(requests.Timeout):
+    """
+    Se agotó el presupuesto antes de hacer la llamada
+
+    Hereda de requests.Timeout: se trata igual que un timeout de la API
+    (falla clasificada como reintentable).
+    """
+
+
+@contextmanager
+def deadline(seconds: float):
+    """Limitar a `seconds` el tiempo de las llamadas hechas dentro del bloque"""
+    expires_at = time.monotonic() + seconds
+    outer = _deadline.get()
+    if outer is not None:
+        expires_at = min(expires_at, outer)
+
+    token = _deadline.set(expires_at)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """
+    Segundos que quedan del presupuesto actual
+
+    Returns:
+        float | None: None si no hay deadline activo
+    """
+    expires_at = _deadline.get()
+    if expires_at is None:
+        return None
+    return expires_at - time.monotonic()
+
+
+def timeout_for(connect: float, read: float) -> tuple:
+    """
+    Timeout (connect, read) para la próxima llamada, acotado por el presupuesto
+
+    Raises:
+        DeadlineExceeded: si ya no queda presupuesto
+    """
+    left = remaining()
+    if left is None:
+        return connect, read
+    if left <= 0:
+        raise DeadlineExceeded("Presupuesto de tiempo agotado")
+    return min(connect, left), min(read, left)
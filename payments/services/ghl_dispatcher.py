@@ -0,0 +1,249 @@
+"""
+🔹 Dispatcher del outbox de GHL
+
+Conceptos clave:
+- Drena GhlOutboxMessage con claims atómicos (varios dispatchers en paralelo)
+- Coalescing: todos los tags y custom fields pendientes de un contacto se
+  envían en una sola actualización (un POST de tags + un PUT de custom
+  fields) en vez de una llamada por mensaje
+- Concurrencia propia (GHL_DISPATCH_CONCURRENCY), independiente de la del
+  worker de webhooks: un GHL lento ya no frena el estado de los pagos
+- Reintentos con backoff exponencial hasta GHL_OUTBOX_MAX_ATTEMPTS
+- El lease del lote se renueva mientras se envía (LeaseHeartbeat), y un
+  error inesperado en un contacto solo reintenta los mensajes de ese contacto
+- Rate limit por location y circuit breaker vía http_client; con el
+  circuito abierto los mensajes esperan en el outbox sin gastar intentos
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from payments.models import GhlOutboxMessage
+from payments.services import http_client, metrics
+from payments.services.circuit_breaker import get_breaker
+from payments.services.deadline import deadline
+from payments.services.ghl_service import update_contact
+from payments.services.webhook_processor import LeaseHeartbeat, get_worker_id
+from payments.services.webhook_worker import WebhookWorker
+
+logger = logging.getLogger(__name__)
+
+
+def _ghl_breaker():
+    return get_breaker(http_client.host_of(settings.GHL_BASE_URL or ""))
+
+
+def _merge(messages):
+    """
+    Juntar los mensajes de un contacto en una sola actualización
+
+    Returns:
+        tuple: (tags, custom_fields, mensajes con acción desconocida)
+    """
+    tags = []
+    custom_fields = {}
+    unknown = []
+    for message in sorted(messages, key=lambda m: m.created_at):
+        payload = message.payload
+        if message.action == GhlOutboxMessage.ACTION_ADD_TAG:
+            tags.append(payload["tag"])
+        elif message.action == GhlOutboxMessage.ACTION_UPDATE_CUSTOM_FIELD:
+            # El valor más reciente de cada campo es el que vale
+            custom_fields[payload["field_key"]] = payload["field_value"]
+        else:
+            unknown.append(message)
+    return tags, custom_fields, unknown
+
+
+def dispatch_contact(contact_id, messages):
+    """
+    Enviar en una sola actualización todos los mensajes de un contacto y
+    registrar el resultado en cada uno
+
+    Returns:
+        int: Mensajes confirmados por GHL
+    """
+    tags, custom_fields, unknown = _merge(messages)
+    for message in unknown:
+        message.mark_failed(f"Acción desconocida: {message.action}")
+        metrics.increment("ghl.outbox.failed")
+    messages = [message for message in messages if message not in unknown]
+    if not messages:
+        return 0
+
+    try:
+        with deadline(settings.GHL_DISPATCH_BUDGET):
+            result = update_contact(contact_id, tags=tags, custom_fields=custom_fields)
+    except Exception as e:
+        result = {"success": False, "message": f"Error inesperado: {str(e)}"}
+
+    if result.get("success"):
+        for message in messages:
+            message.mark_sent()
+        metrics.increment("ghl.outbox.sent", len(messages))
+        if len(messages) > 1:
+            metrics.increment("ghl.outbox.coalesced", len(messages) - 1)
+        logger.info(
+            f"🏢 ✓ Enviado | Contact ID: {contact_id} | Mensajes: {len(messages)}"
+        )
+        return len(messages)
+
+    error_message = result.get("message", "Error desconocido")
+    breaker = _ghl_breaker()
+    if not breaker.is_available():
+        # GHL está caído: esperar al circuito sin gastar un intento
+        for message in messages:
+            message.mark_deferred(max(breaker.retry_after(), 1), error_message)
+        metrics.increment("ghl.outbox.deferred", len(messages))
+        return 0
+
+    for message in messages:
+        message.mark_failed(error_message)
+    metrics.increment("ghl.outbox.failed", len(messages))
+    if all(m.status == GhlOutboxMessage.STATUS_FAILED for m in messages):
+        logger.error(
+            f"🏢 ✗ Envío fallido permanentemente | Contact ID: {contact_id} | "
+            f"Mensajes: {len(messages)} | Error: {error_message}"
+        )
+    else:
+        logger.warning(
+            f"🏢 ⚠ Reintento programado | Contact ID: {contact_id} | "
+            f"Mensajes: {len(messages)} | Error: {error_message}"
+        )
+    return 0
+
+
+def _dispatch_group(group):
+    """
+    Enviar los mensajes de un contacto sin que un error inesperado (ej: un
+    payload mal formado) afecte a los demás contactos del lote
+
+    Returns:
+        int: Mensajes confirmados por GHL
+    """
+    contact_id, messages = group
+    try:
+        return dispatch_contact(contact_id, messages)
+    except Exception as e:
+        error_message = f"Error inesperado: {str(e)}"
+        logger.error(
+            f"🏢 ✗ Error enviando | Contact ID: {contact_id} | Error: {error_message}"
+        )
+        # Los que ya registraron su resultado soltaron el lease
+        pending = [message for message in messages if message.lease_token]
+        for message in pending:
+            message.mark_failed(error_message)
+        metrics.increment("ghl.outbox.failed", len(pending))
+        return 0
+
+
+def _dispatch_in_thread(group):
+    try:
+        return _dispatch_group(group)
+    finally:
+        close_old_connections()
+
+
+def dispatch_pending_ghl(worker_id=None, batch_size=None, concurrency=None):
+    """
+    Enviar un lote de mensajes pendientes del outbox
+
+    Returns:
+        int: Número de mensajes procesados en este lote
+    """
+    worker_id = worker_id or get_worker_id()
+    batch_size = batch_size or settings.GHL_DISPATCH_BATCH_SIZE
+    concurrency = max(1, concurrency or settings.GHL_DISPATCH_CONCURRENCY)
+
+    # Con el circuito de GHL abierto los envíos fallarían al instante
+    if not _ghl_breaker().is_available():
+        logger.warning("🏢 ⏸ Circuito de GHL abierto, outbox en espera")
+        return 0
+
+    messages = GhlOutboxMessage.claim_batch(
+        worker_id, limit=max(batch_size, concurrency)
+    )
+    if not messages:
+        return 0
+
+    groups = {}
+    for message in messages:
+        groups.setdefault(message.contact_id, []).append(message)
+
+    logger.info(
+        f"🏢 ⚡ Enviando lote a GHL | Mensajes: {len(messages)} | "
+        f"Contactos: {len(groups)}"
+    )
+
+    with LeaseHeartbeat(
+        messages[0].lease_token,
+        lease_seconds=settings.GHL_OUTBOX_LEASE_SECONDS,
+        model=GhlOutboxMessage,
+    ):
+        if concurrency == 1 or len(groups) == 1:
+            sent = sum(_dispatch_group(group) for group in groups.items())
+        else:
+            with ThreadPoolExecutor(
+                max_workers=concurrency, thread_name_prefix="ghl"
+            ) as executor:
+                sent = sum(executor.map(_dispatch_in_thread, groups.items()))
+
+    logger.info(
+        f"🏢 Resultado | ✓ Enviados: {sent} | ✗ Pendientes: {len(messages) - sent}"
+    )
+    return len(messages)
+
+
+def reclaim_expired_ghl_messages():
+    """
+    Devolver al outbox los mensajes de un dispatcher caído
+
+    Returns:
+        int: Número de mensajes reclamados
+    """
+    reclaimed = GhlOutboxMessage.reclaim_expired()
+    if reclaimed:
+        metrics.increment("ghl.outbox.reclaimed", reclaimed)
+        logger.warning(f"🏢 ♻ Mensajes reclamados por lease expirado: {reclaimed}")
+    return reclaimed
+
+
+class GhlDispatcher(WebhookWorker):
+    """
+    Loop del dispatcher: mismo ciclo que el worker de webhooks (backoff,
+    avisos, parada ordenada) pero drenando el outbox de GHL
+    """
+
+    label = "Dispatcher GHL"
+
+    def __init__(
+        self, poll_interval=None, concurrency=None, batch_size=None, max_idle=None
+    ):
+        super().__init__(
+            poll_interval=poll_interval,
+            concurrency=concurrency or settings.GHL_DISPATCH_CONCURRENCY,
+            batch_size=batch_size or settings.GHL_DISPATCH_BATCH_SIZE,
+            max_idle=max_idle,
+        )
+        self.notify_channel = settings.GHL_OUTBOX_NOTIFY_CHANNEL
+
+    def run_once(self):
+        """
+        Enviar un lote de mensajes del outbox
+
+        Returns:
+            int: Número de mensajes procesados
+        """
+        try:
+            self._reclaim_if_due()
+            return dispatch_pending_ghl(
+                batch_size=self.batch_size, concurrency=self.concurrency
+            )
+        finally:
+            close_old_connections()
+
+    def _reclaim(self):
+        return reclaim_expired_ghl_messages()
@@ -1,5 +1,12 @@
 """
 Servicio para interactuar con la API de GoHighLevel (GHL)
+
+Tags: se agregan con el endpoint aditivo de GHL (POST /contacts/{id}/tags),
+que no toca los tags que el contacto ya tiene; un PUT con la lista completa
+borraría los agregados en GHL después de leerla. Los tags conocidos se
+guardan en un cache local (GHL_TAG_CACHE_TTL) alimentado por esas respuestas
+y por los listados de contactos, solo para no enviar los que ya se sabe que
+están: el caso común es un solo POST, sin GET previo.
 """
 
 import logging
@@ -7,18 +14,94 @@ import logging
 import requests
 from django.conf import settings
 
+from payments.services import http_client
+from payments.services.cache import RefreshCache, TTLCache
+from payments.services.rate_limiter import ghl_key
+
 logger = logging.getLogger(__name__)
 
+_contact_tags = TTLCache(
+    "ghl_contact_tags",
+    maxsize=settings.GHL_TAG_CACHE_SIZE,
+    ttl=settings.GHL_TAG_CACHE_TTL,
+)
+
+
+def remember_contact_tags(contact_id: str, tags: list):
+    """Registrar los tags actuales de un contacto (ej: desde un listado)"""
+    if contact_id and tags is not None:
+        _contact_tags.set(contact_id, list(tags))
+
+
+def forget_contact_tags(contact_id: str = None):
+    """Descartar los tags conocidos de un contacto (o de todos)"""
+    if contact_id is None:
+        _contact_tags.clear()
+    else:
+        _contact_tags.delete(contact_id)
+
+
+def format_contact(contact: dict) -> dict:
+    """
+    Datos de un contacto de GHL en el formato que usa el frontend
+
+    Args:
+        contact: Contacto tal como lo devuelve la API de GHL
+
+    Returns:
+        dict: 'id', 'name', 'email', 'phone', 'tags' y 'date_updated'
+    """
+    # Intentar obtener el nombre de diferentes campos posibles
+    name = None
+
+    # Opción 1: Campo 'name'
+    if contact.get("name"):
+        name = contact.get("name")
+    # Opción 2: Concatenar firstName y lastName
+    elif contact.get("firstName") or contact.get("lastName"):
+        first = contact.get("firstName") or ""
+        last = contact.get("lastName") or ""
+        name = f"{first} {last}".strip()
+    # Opción 3: Otros campos posibles
+    elif contact.get("fullName"):
+        name = contact.get("fullName")
+    elif contact.get("fullNameLowerCase"):
+        name = contact.get("fullNameLowerCase")
+    elif contact.get("contactName"):
+        name = contact.get("contactName")
+
+    # Si no hay nombre, usar el email o "Sin nombre"
+    if not name or name.strip() == "":
+        if contact.get("email"):
+            name = contact.get("email")
+        else:
+            name = "Sin nombre"
+
+    return {
+        "id": contact.get("id"),
+        "name": name,
+        "email": contact.get("email") or "",
+        "phone": contact.get("phone") or "",
+        "tags": contact.get("tags") or [],
+        "date_updated": contact.get("dateUpdated"),
+    }
+
 
-def get_contacts(limit: int = 100) -> dict:
+def get_contacts(
+    limit: int = 100, start_after_id: str = None, start_after: int = None
+) -> dict:
     """
     Obtiene la lista de contactos de GoHighLevel
 
     Args:
-        limit: Número máximo de contactos a obtener
+        limit: Número máximo de contactos a obtener (una página, máx. 100)
+        start_after_id: Cursor de paginación (meta.startAfterId de la
+            página anterior)
+        start_after: Cursor de paginación (meta.startAfter, timestamp en ms)
 
     Returns:
-        dict: Lista de contactos con 'success', 'contacts' y 'message'
+        dict: Lista de contactos con 'success', 'contacts' y 'message'; si
+            la API la devuelve, 'meta' trae el cursor de la página siguiente
     """
     try:
         if not settings.GHL_TOKEN:
@@ -55,12 +138,20 @@ def get_contacts(limit: int = 100) -> dict:
         }
 
         params = {"locationId": settings.GHL_LOCATION_ID, "limit": limit}
+        if start_after_id and start_after:
+            params["startAfterId"] = start_after_id
+            params["startAfter"] = start_after
 
         logger.info(
             f"[GHL] Obteniendo contactos del location {settings.GHL_LOCATION_ID}"
         )
 
-        response = requests.get(url, headers=headers, params=params)
+        response = http_client.get(
+            url,
+            headers=headers,
+            params=params,
+            rate_limit_key=ghl_key(settings.GHL_LOCATION_ID),
+        )
 
         if response.status_code != 200:
             logger.error(
@@ -78,46 +169,13 @@ def get_contacts(limit: int = 100) -> dict:
 
         # Log para debug - ver la estructura de los contactos
         if contacts and len(contacts) > 0:
-            logger.info(f"[GHL] Ejemplo de contacto: {contacts[0]}")
+            logger.debug(f"[GHL] Ejemplo de contacto: {contacts[0]}")
 
         # Formatear contactos para el frontend
         formatted_contacts = []
         for contact in contacts:
-            # Intentar obtener el nombre de diferentes campos posibles
-            name = None
-
-            # Opción 1: Campo 'name'
-            if contact.get("name"):
-                name = contact.get("name")
-            # Opción 2: Concatenar firstName y lastName
-            elif contact.get("firstName") or contact.get("lastName"):
-                first = contact.get("firstName", "")
-                last = contact.get("lastName", "")
-                name = f"{first} {last}".strip()
-            # Opción 3: Otros campos posibles
-            elif contact.get("fullName"):
-                name = contact.get("fullName")
-            elif contact.get("fullNameLowerCase"):
-                name = contact.get("fullNameLowerCase")
-            elif contact.get("contactName"):
-                name = contact.get("contactName")
-
-            # Si no hay nombre, usar el email o "Sin nombre"
-            if not name or name.strip() == "":
-                if contact.get("email"):
-                    name = contact.get("email")
-                else:
-                    name = "Sin nombre"
-
-            formatted_contacts.append(
-                {
-                    "id": contact.get("id"),
-                    "name": name,
-                    "email": contact.get("email", ""),
-                    "phone": contact.get("phone", ""),
-                    "tags": contact.get("tags", []),
-                }
-            )
+            formatted_contacts.append(format_contact(contact))
+            remember_contact_tags(contact.get("id"), contact.get("tags"))
 
         logger.info(f"[GHL] Se obtuvieron {len(formatted_contacts)} contactos")
 
@@ -126,6 +184,16 @@ def get_contacts(limit: int = 100) -> dict:
             "contacts": formatted_contacts,
             "message": f"Se obtuvieron {len(formatted_contacts)} contactos",
             "total": len(formatted_contacts),
+            "meta": data.get("meta") or {},
+        }
+
+    except requests.Timeout as e:
+        logger.error(f"[GHL] Timeout obteniendo contactos: {str(e)}")
+        return {
+            "success": False,
+            "contacts": [],
+            "message": f"Timeout: {str(e)}",
+            "retryable": True,
         }
 
     except Exception as e:
@@ -137,171 +205,277 @@ def get_contacts(limit: int = 100) -> dict:
         }
 
 
-def add_tag_to_contact(contact_id: str, tag: str = "pago_confirmado") -> dict:
+def get_contact(contact_id: str) -> dict:
     """
-    Agrega un tag a un contacto en GoHighLevel
+    Obtiene un contacto de GoHighLevel por ID
 
     Args:
         contact_id: ID del contacto en GHL
-        tag: Tag a agregar (default: "pago_confirmado")
 
     Returns:
-        dict: Resultado de la operación con 'success' y 'message'
+        dict: 'success', 'message' y 'contact' (formato de format_contact);
+            'not_found' si GHL respondió 404
     """
     try:
-        if not settings.GHL_TOKEN:
-            logger.error("[GHL] GHL_TOKEN no configurado")
-            return {"success": False, "message": "GHL_TOKEN no configurado"}
-
-        if not settings.GHL_BASE_URL:
-            logger.error("[GHL] GHL_BASE_URL no configurado")
-            return {"success": False, "message": "GHL_BASE_URL no configurado"}
-
-        if not settings.GHL_LOCATION_ID:
-            logger.error("[GHL] GHL_LOCATION_ID no configurado")
-            return {"success": False, "message": "GHL_LOCATION_ID no configurado"}
+        if (
+            not settings.GHL_TOKEN
+            or not settings.GHL_BASE_URL
+            or not settings.GHL_LOCATION_ID
+        ):
+            logger.error("[GHL] Credenciales GHL no configuradas completamente")
+            return {
+                "success": False,
+                "message": "Credenciales GHL no configuradas completamente",
+            }
 
-        # Endpoint de GHL para agregar tags a un contacto
         url = f"{settings.GHL_BASE_URL.rstrip('/')}/contacts/{contact_id}"
 
         headers = {
             "Authorization": f"Bearer {settings.GHL_TOKEN}",
             "Content-Type": "application/json",
-            "Version": "2021-07-28",  # GHL API version
+            "Version": "2021-07-28",
         }
 
-        # Log de la operación
-        logger.info(
-            f"[GHL] Obteniendo contacto {contact_id} del location {settings.GHL_LOCATION_ID}"
+        response = http_client.get(
+            url, headers=headers, rate_limit_key=ghl_key(settings.GHL_LOCATION_ID)
         )
 
-        # Primero obtener los tags actuales del contacto
-        response = requests.get(url, headers=headers)
-
         if response.status_code != 200:
             logger.error(
-                f"[GHL] Error obteniendo contacto {contact_id}: {response.status_code} - {response.text}"
+                f"[GHL] Error obteniendo contacto {contact_id}: "
+                f"{response.status_code} - {response.text}"
             )
             return {
                 "success": False,
                 "message": f"Error obteniendo contacto: {response.status_code}",
-                "details": response.text,
+                "not_found": response.status_code in [400, 404],
             }
 
-        contact_data = response.json()
-        existing_tags = contact_data.get("contact", {}).get("tags", [])
+        contact = response.json().get("contact", {})
+        remember_contact_tags(contact.get("id"), contact.get("tags"))
+        return {
+            "success": True,
+            "message": "Contacto obtenido",
+            "contact": format_contact(contact),
+        }
 
-        # Verificar si el tag ya existe
-        if tag in existing_tags:
-            logger.info(f"[GHL] Tag '{tag}' ya existe en contacto {contact_id}")
-            return {
-                "success": True,
-                "message": f"Tag '{tag}' ya existía en el contacto",
-                "tag": tag,
-                "contact_id": contact_id,
-            }
+    except requests.Timeout as e:
+        logger.error(f"[GHL] Timeout obteniendo contacto {contact_id}: {str(e)}")
+        return {"success": False, "message": f"Timeout: {str(e)}", "retryable": True}
 
-        # Agregar el nuevo tag a la lista
-        new_tags = existing_tags + [tag]
+    except Exception as e:
+        logger.error(f"[GHL] Error inesperado obteniendo contacto: {str(e)}")
+        return {"success": False, "message": f"Error inesperado: {str(e)}"}
 
-        # Actualizar el contacto con los nuevos tags
-        payload = {"tags": new_tags}
 
-        update_response = requests.put(url, headers=headers, json=payload)
+_contacts_cache = RefreshCache(
+    "ghl_contacts",
+    loader=lambda limit: get_contacts(limit=limit),
+    ttl=settings.GHL_CONTACTS_CACHE_TTL,
+    stale_ttl=settings.GHL_CONTACTS_CACHE_STALE,
+    should_cache=lambda result: result.get("success"),
+)
 
-        if update_response.status_code in [200, 201]:
-            logger.info(
-                f"[GHL] Tag '{tag}' agregado exitosamente al contacto {contact_id}"
-            )
-            return {
-                "success": True,
-                "message": f"Tag '{tag}' agregado exitosamente",
-                "tag": tag,
-                "contact_id": contact_id,
-                "all_tags": new_tags,
-            }
-        else:
-            logger.error(
-                f"[GHL] Error actualizando contacto {contact_id}: {update_response.status_code} - {update_response.text}"
-            )
-            return {
-                "success": False,
-                "message": f"Error actualizando contacto: {update_response.status_code}",
-                "details": update_response.text,
-            }
 
-    except requests.RequestException as e:
-        logger.error(
-            f"[GHL] Error de conexión al actualizar contacto {contact_id}: {str(e)}"
-        )
-        return {"success": False, "message": f"Error de conexión: {str(e)}"}
+def get_contacts_cached(limit: int = 100) -> dict:
+    """
+    get_contacts con cache: un valor vigente o vencido hace poco se devuelve
+    sin esperar a GHL (y se refresca en segundo plano); los pedidos
+    simultáneos sin valor comparten una sola llamada
 
-    except Exception as e:
-        logger.error(f"[GHL] Error inesperado al agregar tag: {str(e)}")
-        return {"success": False, "message": f"Error inesperado: {str(e)}"}
+    Args:
+        limit: Número máximo de contactos a obtener
 
+    Returns:
+        dict: Mismo formato que get_contacts
+    """
+    return _contacts_cache.get(limit)
 
-def update_custom_field(
-    contact_id: str, field_key: str = "payment_status", field_value: str = "paid"
+
+def _tags_from_response(response):
+    """Tags que GHL devolvió tras agregarlos (None si no vinieron)"""
+    try:
+        body = response.json()
+    except ValueError:
+        return None
+    if not isinstance(body, dict):
+        return None
+    tags = body.get("tags")
+    if tags is None:
+        tags = (body.get("contact") or {}).get("tags")
+    return tags if isinstance(tags, list) else None
+
+
+def update_contact(
+    contact_id: str, tags: list = None, custom_fields: dict = None
 ) -> dict:
     """
-    Actualiza un custom field en un contacto de GoHighLevel
+    Agrega tags y actualiza custom fields de un contacto
+
+    Los tags van por POST /contacts/{id}/tags, que los suma a los actuales
+    sin reemplazarlos; solo se omiten los que el cache ya sabe presentes.
+    Los custom fields van en un PUT que no incluye tags. Si no hay nada
+    nuevo que enviar, no se hace ninguna llamada.
 
     Args:
         contact_id: ID del contacto en GHL
-        field_key: Nombre del campo personalizado
-        field_value: Valor a asignar
+        tags: Tags a agregar
+        custom_fields: {key: valor} de los campos personalizados
 
     Returns:
-        dict: Resultado de la operación con 'success' y 'message'
+        dict: Resultado de la operación con 'success', 'message' y
+            'added_tags' (y 'all_tags' si se conocen los tags del contacto)
     """
+    tags = list(dict.fromkeys(tags or []))
+    custom_fields = custom_fields or {}
+
     try:
-        if (
-            not settings.GHL_TOKEN
-            or not settings.GHL_BASE_URL
-            or not settings.GHL_LOCATION_ID
-        ):
-            logger.error("[GHL] Credenciales GHL no configuradas completamente")
-            return {
-                "success": False,
-                "message": "Credenciales GHL no configuradas completamente",
-            }
+        if not settings.GHL_TOKEN:
+            logger.error("[GHL] GHL_TOKEN no configurado")
+            return {"success": False, "message": "GHL_TOKEN no configurado"}
 
-        logger.info(
-            f"[GHL] Actualizando custom field {field_key}={field_value} en contacto {contact_id}"
-        )
+        if not settings.GHL_BASE_URL:
+            logger.error("[GHL] GHL_BASE_URL no configurado")
+            return {"success": False, "message": "GHL_BASE_URL no configurado"}
+
+        if not settings.GHL_LOCATION_ID:
+            logger.error("[GHL] GHL_LOCATION_ID no configurado")
+            return {"success": False, "message": "GHL_LOCATION_ID no configurado"}
 
         url = f"{settings.GHL_BASE_URL.rstrip('/')}/contacts/{contact_id}"
 
         headers = {
             "Authorization": f"Bearer {settings.GHL_TOKEN}",
             "Content-Type": "application/json",
-            "Version": "2021-07-28",
+            "Version": "2021-07-28",  # GHL API version
         }
+        rate_limit_key = ghl_key(settings.GHL_LOCATION_ID)
+
+        result = {"success": True, "contact_id": contact_id, "added_tags": []}
+
+        known_tags = _contact_tags.get(contact_id)
+        new_tags = [tag for tag in tags if known_tags is None or tag not in known_tags]
+        if known_tags is not None:
+            result["all_tags"] = known_tags + new_tags
+
+        if not new_tags and not custom_fields:
+            logger.info(f"[GHL] Contacto {contact_id} ya estaba actualizado")
+            result["message"] = "El contacto ya estaba actualizado"
+            return result
+
+        if new_tags:
+            tags_response = http_client.post(
+                f"{url}/tags",
+                headers=headers,
+                json={"tags": new_tags},
+                rate_limit_key=rate_limit_key,
+            )
 
-        payload = {"customFields": [{"key": field_key, "field_value": field_value}]}
-
-        response = requests.put(url, headers=headers, json=payload)
+            if tags_response.status_code not in [200, 201]:
+                # Los tags conocidos pueden estar desactualizados: releerlos
+                forget_contact_tags(contact_id)
+                logger.error(
+                    f"[GHL] Error agregando tags a {contact_id}: "
+                    f"{tags_response.status_code} - {tags_response.text}"
+                )
+                return {
+                    "success": False,
+                    "message": f"Error agregando tags: {tags_response.status_code}",
+                    "details": tags_response.text,
+                }
 
-        if response.status_code in [200, 201]:
-            logger.info(
-                f"[GHL] Custom field '{field_key}={field_value}' actualizado en contacto {contact_id}"
-            )
-            return {
-                "success": True,
-                "message": f"Custom field actualizado: {field_key}={field_value}",
-                "contact_id": contact_id,
-            }
-        else:
-            logger.error(
-                f"[GHL] Error actualizando custom field: {response.status_code} - {response.text}"
+            all_tags = _tags_from_response(tags_response) or result.get("all_tags")
+            if all_tags is not None:
+                result["all_tags"] = all_tags
+                remember_contact_tags(contact_id, all_tags)
+            result["added_tags"] = new_tags
+
+        if custom_fields:
+            update_response = http_client.put(
+                url,
+                headers=headers,
+                json={
+                    "customFields": [
+                        {"key": key, "field_value": value}
+                        for key, value in custom_fields.items()
+                    ]
+                },
+                rate_limit_key=rate_limit_key,
             )
-            return {
-                "success": False,
-                "message": f"Error actualizando custom field: {response.status_code}",
-                "details": response.text,
-            }
+
+            if update_response.status_code not in [200, 201]:
+                logger.error(
+                    f"[GHL] Error actualizando contacto {contact_id}: "
+                    f"{update_response.status_code} - {update_response.text}"
+                )
+                return {
+                    "success": False,
+                    "message": (
+                        f"Error actualizando contacto: {update_response.status_code}"
+                    ),
+                    "details": update_response.text,
+                }
+
+        logger.info(
+            f"[GHL] Contacto {contact_id} actualizado | "
+            f"Tags: {new_tags} | Custom fields: {custom_fields}"
+        )
+        result["message"] = "Contacto actualizado exitosamente"
+        return result
+
+    except requests.RequestException as e:
+        logger.error(
+            f"[GHL] Error de conexión al actualizar contacto {contact_id}: {str(e)}"
+        )
+        return {
+            "success": False,
+            "message": f"Error de conexión: {str(e)}",
+            "retryable": http_client.is_retryable(e),
+        }
 
     except Exception as e:
-        logger.error(f"[GHL] Error al actualizar custom field: {str(e)}")
-        return {"success": False, "message": f"Error: {str(e)}"}
+        logger.error(f"[GHL] Error inesperado al actualizar contacto: {str(e)}")
+        return {"success": False, "message": f"Error inesperado: {str(e)}"}
+
+
+def add_tag_to_contact(contact_id: str, tag: str = "pago_confirmado") -> dict:
+    """
+    Agrega un tag a un contacto en GoHighLevel
+
+    Args:
+        contact_id: ID del contacto en GHL
+        tag: Tag a agregar (default: "pago_confirmado")
+
+    Returns:
+        dict: Resultado de la operación con 'success' y 'message'
+    """
+    result = update_contact(contact_id, tags=[tag])
+    if not result["success"]:
+        return result
+
+    result["tag"] = tag
+    if result.pop("added_tags"):
+        result["message"] = f"Tag '{tag}' agregado exitosamente"
+    else:
+        result["message"] = f"Tag '{tag}' ya existía en el contacto"
+    return result
+
+
+def update_custom_field(
+    contact_id: str, field_key: str = "payment_status", field_value: str = "paid"
+) -> dict:
+    """
+    Actualiza un custom field en un contacto de GoHighLevel
+
+    Args:
+        contact_id: ID del contacto en GHL
+        field_key: Nombre del campo personalizado
+        field_value: Valor a asignar
+
+    Returns:
+        dict: Resultado de la operación con 'success' y 'message'
+    """
+    result = update_contact(contact_id, custom_fields={field_key: field_value})
+    if result["success"]:
+        result["message"] = f"Custom field actualizado: {field_key}={field_value}"
+    return result
@@ -0,0 +1,175 @@
+"""
+🔹 Cliente HTTP compartido para MercadoPago y GoHighLevel
+
+Conceptos clave:
+- Keep-alive: una requests.Session por host reutiliza las conexiones TCP+TLS
+  en lugar de hacer un handshake nuevo en cada llamada
+- Pools acotados: HTTP_POOL_MAXSIZE conexiones por host (debe cubrir la
+  concurrencia del worker y de los threads del servidor)
+- Circuit breaker por host (ver circuit_breaker.py): con la API caída las
+  llamadas fallan al instante con CircuitOpenError
+- Rate limit compartido (ver rate_limiter.py): con `rate_limit_key` la
+  llamada espera un token del bucket común a todos los procesos
+- Timeouts siempre: connect/read por defecto, acotados por el deadline activo
+  (ver deadline.py); un timeout es una falla reintentable
+- Observabilidad: requests, conexiones abiertas y reutilizadas por host en
+  /api/metrics (gauge http.pools)
+"""
+
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from payments.services import deadline, metrics, rate_limiter
+from payments.services.circuit_breaker import get_breaker
+
+_lock = threading.Lock()
+_sessions = {}
+_pid = None
+
+
+def _new_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=settings.HTTP_POOL_CONNECTIONS,
+        pool_maxsize=settings.HTTP_POOL_MAXSIZE,
+        max_retries=0,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def host_of(url: str) -> str:
+    """Origen (esquema://host[:puerto]) de `url`"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def get_session(url: str) -> requests.Session:
+    """Session compartida para el host de `url`"""
+    global _pid
+
+    host = host_of(url)
+
+    with _lock:
+        # Tras un fork las conexiones del padre no se comparten con el hijo
+        if _pid != os.getpid():
+            _sessions.clear()
+            _pid = os.getpid()
+        session = _sessions.get(host)
+        if session is None:
+            session = _sessions[host] = _new_session()
+    return session
+
+
+def request(
+    method: str, url: str, rate_limit_key: str = None, **kwargs
+) -> requests.Response:
+    """
+    Igual que requests.request, pero con la conexión del pool del host
+
+    `timeout` (número o tupla connect/read) es opcional: por defecto se usan
+    HTTP_CONNECT_TIMEOUT / HTTP_READ_TIMEOUT, y nunca más de lo que queda
+    del deadline activo.
+
+    Args:
+        rate_limit_key: Bucket del rate limiter a consumir antes de llamar
+            (ej: rate_limiter.ghl_key(location_id))
+
+    Raises:
+        requests.Timeout: la API no respondió a tiempo o se agotó el
+            presupuesto (deadline.DeadlineExceeded, rate_limiter.RateLimited)
+        CircuitOpenError: el circuito del host está abierto
+    """
+    timeout = kwargs.pop("timeout", None)
+    if timeout is None:
+        connect, read = settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT
+    elif isinstance(timeout, tuple):
+        connect, read = timeout
+    else:
+        connect = read = timeout
+
+    breaker = get_breaker(host_of(url))
+    # Un solo permiso por llamada, antes de esperar un token: con el
+    # circuito abierto se falla sin esperar al rate limiter
+    probe = breaker.before_call()
+    try:
+        if rate_limit_key:
+            rate_limiter.acquire(rate_limit_key)
+        kwargs["timeout"] = deadline.timeout_for(connect, read)
+    except BaseException:
+        # La llamada no se hizo: liberar la prueba sin decidir el circuito
+        breaker.release(probe)
+        raise
+
+    success = False
+    try:
+        response = get_session(url).request(method, url, **kwargs)
+        success = response.status_code < 500
+        if response.status_code == 429 and rate_limit_key:
+            rate_limiter.penalize(rate_limit_key, response)
+        return response
+    except requests.Timeout:
+        metrics.increment("http.timeouts")
+        raise
+    except requests.RequestException as e:
+        success = not is_retryable(e)
+        raise
+    finally:
+        breaker.record(success, probe)
+
+
+def is_available(url: str) -> bool:
+    """False si el circuito del host de `url` está abierto"""
+    return get_breaker(host_of(url)).is_available()
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """True si la falla es transitoria (timeout o error de conexión)"""
+    return isinstance(exc, (requests.Timeout, requests.ConnectionError))
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def put(url: str, **kwargs) -> requests.Response:
+    return request("PUT", url, **kwargs)
+
+
+def pool_stats() -> dict:
+    """
+    Estadísticas de reutilización de conexiones por host
+
+    Returns:
+        dict: host → {"requests", "connections", "reused"}
+    """
+    with _lock:
+        sessions = dict(_sessions) if _pid == os.getpid() else {}
+
+    stats = {}
+    for host, session in sessions.items():
+        adapter = session.get_adapter(host)
+        totals = {"requests": 0, "connections": 0}
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            totals["requests"] += pool.num_requests
+            totals["connections"] += pool.num_connections
+        totals["reused"] = max(0, totals["requests"] - totals["connections"])
+        stats[host] = totals
+    return stats
+
+
+metrics.register_gauge("http.pools", pool_stats)
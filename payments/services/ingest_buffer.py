@@ -0,0 +1,183 @@
+"""
+🔹 Ingesta de webhooks con micro-lotes (group commit)
+
+Conceptos clave:
+- Bajo ráfagas, un INSERT + transacción por webhook satura la BD (en SQLite
+  todas las escrituras se serializan en un solo lock)
+- El buffer junta los eventos que llegan durante unos milisegundos (o hasta
+  N eventos) y los guarda con un solo bulk_create en una transacción
+- Durabilidad: cada request espera a que SU lote se confirme en la BD antes
+  de responder 200, igual que con el INSERT individual (o, si la BD no
+  responde a tiempo, a que el evento esté en el spool en disco)
+- El INSERT individual tiene el mismo presupuesto (WEBHOOK_INGEST_TIMEOUT):
+  la espera por el lock de la BD se acota en vez de usar el timeout del
+  driver
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection
+
+from payments.models import WebhookEvent
+from payments.services import metrics
+from payments.services.webhook_notify import notify_new_webhook
+from payments.services.webhook_spool import seal_spool, spool_webhook
+
+logger = logging.getLogger(__name__)
+
+
+class IngestBuffer:
+    """
+    Cola en memoria + thread que guarda los eventos por lotes
+    """
+
+    def __init__(self, max_batch=None, max_wait=None):
+        self.max_batch = max_batch or settings.WEBHOOK_INGEST_BATCH_SIZE
+        if max_wait is None:
+            max_wait = settings.WEBHOOK_INGEST_BATCH_WAIT_MS / 1000
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+
+    def _ensure_started(self):
+        # Tras un fork (ej: gunicorn) el thread del padre no existe en el hijo
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(
+                target=self._run, name="webhook-ingest", daemon=True
+            )
+            self._thread.start()
+
+    def submit(self, row):
+        """
+        Encolar un evento para el próximo lote
+
+        Returns:
+            Future: se resuelve con (id del evento, resultado de ingest)
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((row, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch):
+        try:
+            results = WebhookEvent.ingest_many([row for row, _ in batch])
+        except Exception as e:
+            logger.error(f"📨 ✗ Error guardando lote | Eventos: {len(batch)} | {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        finally:
+            close_old_connections()
+
+        metrics.increment("webhooks.ingest.flushes")
+        metrics.increment("webhooks.ingest.events", len(batch))
+
+        for row, future in batch:
+            future.set_result(results[row["webhook_id"]])
+
+        if any(
+            status == WebhookEvent.INGEST_RECEIVED for _, status in results.values()
+        ):
+            notify_new_webhook()
+
+
+_buffer = IngestBuffer()
+
+
+@contextmanager
+def _lock_wait_budget(seconds):
+    """
+    Acotar cuánto espera la conexión por un lock de la BD
+
+    SQLite: busy_timeout (por defecto el del driver, 5s); PostgreSQL:
+    statement_timeout. Al vencer, la BD levanta OperationalError.
+    """
+    ms = max(1, int(seconds * 1000))
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA busy_timeout")
+            previous = cursor.fetchone()[0]
+            cursor.execute(f"PRAGMA busy_timeout = {ms}")
+        try:
+            yield
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(f"PRAGMA busy_timeout = {int(previous)}")
+    elif connection.vendor == "postgresql" and not connection.in_atomic_block:
+        with connection.cursor() as cursor:
+            cursor.execute("SET statement_timeout = %s", [ms])
+        try:
+            yield
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute("RESET statement_timeout")
+    else:
+        yield
+
+
+def ingest_webhook(webhook_id, webhook_type, mp_payment_id=None, raw_payload=None):
+    """
+    Guardar un webhook, por micro-lotes si WEBHOOK_INGEST_BATCHING está activo
+
+    Si la BD falla (ej: "database is locked") o no confirma el evento (o su
+    lote) dentro de WEBHOOK_INGEST_TIMEOUT, el evento va al spool en disco y
+    el worker lo re-inyecta después: ningún webhook confirmado se pierde.
+
+    Returns:
+        tuple: (id del evento, resultado) como WebhookEvent.ingest(); con el
+            evento en el spool: (None, WebhookEvent.INGEST_SPOOLED)
+    """
+    row = {
+        "webhook_id": webhook_id,
+        "webhook_type": webhook_type,
+        "mp_payment_id": mp_payment_id,
+        "raw_payload": raw_payload,
+    }
+
+    try:
+        if settings.WEBHOOK_INGEST_BATCHING:
+            result = _buffer.submit(row).result(timeout=settings.WEBHOOK_INGEST_TIMEOUT)
+        else:
+            with _lock_wait_budget(settings.WEBHOOK_INGEST_TIMEOUT):
+                result = WebhookEvent.ingest(
+                    webhook_id, webhook_type, mp_payment_id, raw_payload
+                )
+    except (DatabaseError, FutureTimeoutError) as e:
+        if not settings.WEBHOOK_SPOOL_ENABLED:
+            raise
+        logger.error(f"📨 ✗ BD no disponible, usando spool | ID: {webhook_id} | {e}")
+        spool_webhook(row)
+        return None, WebhookEvent.INGEST_SPOOLED
+
+    # La BD responde: cerrar el segmento del spool para que se re-inyecte
+    seal_spool()
+    return result
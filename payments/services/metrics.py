@@ -0,0 +1,59 @@
+"""
+🔹 Métricas en memoria del proceso (contadores y gauges)
+
+Conceptos clave:
+- Contadores: se incrementan desde cualquier thread (ej: eventos reclamados)
+- Gauges: funciones que se evalúan al pedir el snapshot (ej: estado actual)
+- Son por proceso: cada worker y el servidor web tienen los suyos
+"""
+
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_gauges = {}
+
+
+def increment(name: str, value: int = 1):
+    """Incrementar un contador"""
+    with _lock:
+        _counters[name] += value
+
+
+def register_gauge(name: str, func):
+    """Registrar una función que devuelve el valor actual de un gauge"""
+    with _lock:
+        _gauges[name] = func
+
+
+def get_counter(name: str) -> int:
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def snapshot() -> dict:
+    """
+    Obtener el estado actual de todas las métricas
+
+    Returns:
+        dict: {"counters": {...}, "gauges": {...}}
+    """
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+
+    gauge_values = {}
+    for name, func in gauges.items():
+        try:
+            gauge_values[name] = func()
+        except Exception as e:
+            gauge_values[name] = f"error: {str(e)}"
+
+    return {"counters": counters, "gauges": gauge_values}
+
+
+def reset():
+    """Reiniciar los contadores (usado en tests)"""
+    with _lock:
+        _counters.clear()
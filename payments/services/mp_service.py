@@ -0,0 +1,291 @@
+"""
+🔹 Lecturas resilientes a la API de MercadoPago (payments y merchant_orders)
+
+Conceptos clave:
+- Son GET idempotentes: repetirlos es seguro
+- Reintentos dentro del mismo intento del evento, con backoff exponencial y
+  jitter completo, sin pasarse del deadline activo; antes una respuesta
+  lenta devolvía el evento a la cola por un minuto entero
+- Hedging (opcional, MP_HEDGE_ENABLED): si la respuesta tarda más que el
+  p95 reciente, se lanza una segunda petición y se usa la que llegue primero
+- Cada petición tiene un read timeout propio (MP_READ_TIMEOUT), menor que
+  el presupuesto del evento, para que quede tiempo para reintentar
+- Cache LRU+TTL corto (MP_CACHE_TTL) por recurso: los reintentos y los
+  eventos payment/merchant_order del mismo checkout no vuelven a descargar
+  el mismo documento. Si un documento recién descargado muestra otro status
+  para un pago, se invalida la copia relacionada del otro recurso
+"""
+
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from django.conf import settings
+from django.db import connection
+
+from payments.services import deadline, http_client, metrics, rate_limiter
+from payments.services.cache import TTLCache
+from payments.services.circuit_breaker import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+MP_API_URL = "https://api.mercadopago.com"
+MP_RATE_LIMIT_KEY = rate_limiter.mp_key("api.mercadopago.com")
+
+
+class MercadoPagoError(Exception):
+    """MercadoPago respondió con un status inesperado"""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+    @property
+    def retryable(self):
+        return self.status_code >= 500 or self.status_code == 429
+
+
+class LatencyTracker:
+    """
+    Últimas N latencias de lecturas exitosas, para estimar percentiles
+    """
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, fraction):
+        """Percentil `fraction` (0-1) o None si no hay muestras"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._samples)
+
+    def stats(self):
+        return {
+            "samples": len(self),
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+        }
+
+
+_latency = LatencyTracker()
+metrics.register_gauge("mp.read_latency", _latency.stats)
+
+_hedge_executor = None
+_hedge_lock = threading.Lock()
+_hedge_pid = None
+
+
+def _executor():
+    global _hedge_executor, _hedge_pid
+    with _hedge_lock:
+        # Tras un fork los threads del pool del padre no existen en el hijo
+        if _hedge_executor is None or _hedge_pid != os.getpid():
+            _hedge_pid = os.getpid()
+            _hedge_executor = ThreadPoolExecutor(
+                max_workers=settings.MP_HEDGE_THREADS, thread_name_prefix="mp-hedge"
+            )
+    return _hedge_executor
+
+
+def _timed_get(url):
+    started = time.monotonic()
+    response = http_client.get(
+        url,
+        headers={"Authorization": f"Bearer {settings.MP_ACCESS_TOKEN}"},
+        timeout=(settings.HTTP_CONNECT_TIMEOUT, settings.MP_READ_TIMEOUT),
+        rate_limit_key=MP_RATE_LIMIT_KEY,
+    )
+    if response.status_code == 200:
+        _latency.record(time.monotonic() - started)
+    return response
+
+
+def _in_thread(context, url):
+    """GET en un thread del pool de hedging, con el deadline del llamador"""
+    try:
+        return context.run(_timed_get, url)
+    finally:
+        # El rate limiter usa la BD: cerrar la conexión de este thread
+        connection.close()
+
+
+def _hedge_delay():
+    """Espera antes de la petición de respaldo, o None si no hay hedging"""
+    if not settings.MP_HEDGE_ENABLED or len(_latency) < settings.MP_HEDGE_MIN_SAMPLES:
+        return None
+    return max(
+        _latency.percentile(settings.MP_HEDGE_PERCENTILE), settings.MP_HEDGE_MIN_DELAY
+    )
+
+
+def _hedged_get(url):
+    """
+    GET con petición de respaldo si la primera tarda más que el p95
+
+    Returns:
+        requests.Response: la primera respuesta que llegue (si una de las
+            dos falla, se espera a la otra)
+    """
+    delay = _hedge_delay()
+    if delay is None:
+        return _timed_get(url)
+
+    executor = _executor()
+    primary = executor.submit(_in_thread, contextvars.copy_context(), url)
+    done, pending = wait({primary}, timeout=delay)
+
+    if not done:
+        metrics.increment("mp.hedges")
+        pending.add(executor.submit(_in_thread, contextvars.copy_context(), url))
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+    while True:
+        for future in done:
+            if future.exception() is None:
+                if future is not primary:
+                    metrics.increment("mp.hedge_wins")
+                return future.result()
+            error = future.exception()
+        if not pending:
+            raise error
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+
+def _is_final(error):
+    """Errores que no vale la pena reintentar dentro de este intento"""
+    if isinstance(
+        error, (CircuitOpenError, deadline.DeadlineExceeded, rate_limiter.RateLimited)
+    ):
+        return True
+    if isinstance(error, MercadoPagoError):
+        return not error.retryable
+    return not http_client.is_retryable(error)
+
+
+def _read(path, description):
+    """
+    GET a MercadoPago con reintentos y backoff con jitter
+
+    Raises:
+        MercadoPagoError: status distinto de 200 (tras agotar reintentos si
+            era transitorio)
+        requests.RequestException: timeout/conexión tras agotar reintentos
+    """
+    url = f"{MP_API_URL}{path}"
+    attempts = settings.MP_READ_RETRIES + 1
+
+    for attempt in range(attempts):
+        try:
+            response = _hedged_get(url)
+            if response.status_code == 200:
+                return response.json()
+            raise MercadoPagoError(
+                f"Error al consultar {description}: Status {response.status_code}",
+                response.status_code,
+            )
+        except (requests.RequestException, MercadoPagoError) as e:
+            if _is_final(e) or attempt == attempts - 1:
+                raise
+
+            # Full jitter: espera aleatoria entre 0 y el backoff exponencial
+            delay = random.uniform(
+                0,
+                min(
+                    settings.MP_RETRY_BACKOFF_MAX,
+                    settings.MP_RETRY_BACKOFF * 2**attempt,
+                ),
+            )
+            left = deadline.remaining()
+            if left is not None and delay >= left:
+                raise
+
+            metrics.increment("mp.retries")
+            logger.warning(
+                f"💳 ⚠ Reintentando lectura | {description} | "
+                f"Intento: {attempt + 1}/{attempts} | Espera: {delay:.2f}s | {str(e)}"
+            )
+            time.sleep(delay)
+
+
+_payments = TTLCache(
+    "mp_payments", maxsize=settings.MP_CACHE_SIZE, ttl=settings.MP_CACHE_TTL
+)
+_orders = TTLCache(
+    "mp_orders", maxsize=settings.MP_CACHE_SIZE, ttl=settings.MP_CACHE_TTL
+)
+
+
+def _drop_stale_payment(payment_id, status):
+    """Descartar la copia en cache del pago si tiene otro status"""
+    cached = _payments.peek(str(payment_id))
+    if cached is not None and cached.get("status") != status:
+        _payments.delete(str(payment_id))
+        metrics.increment("mp.cache_invalidations")
+
+
+def _drop_stale_order(order_id, payment_id, status):
+    """Descartar la copia en cache de la orden si muestra otro status del pago"""
+    order = _orders.peek(str(order_id))
+    if order is None:
+        return
+    for payment in order.get("payments", []):
+        if (
+            str(payment.get("id")) == str(payment_id)
+            and payment.get("status") != status
+        ):
+            _orders.delete(str(order_id))
+            metrics.increment("mp.cache_invalidations")
+            return
+
+
+def get_payment(payment_id, use_cache=True) -> dict:
+    """Obtener /v1/payments/{payment_id} (del cache si está vigente)"""
+    key = str(payment_id)
+    if use_cache:
+        cached = _payments.get(key)
+        if cached is not None:
+            return cached
+
+    data = _read(f"/v1/payments/{payment_id}", f"pago {payment_id}")
+    _payments.set(key, data)
+    order_id = (data.get("order") or {}).get("id")
+    if order_id:
+        _drop_stale_order(order_id, payment_id, data.get("status"))
+    return data
+
+
+def get_merchant_order(merchant_order_id, use_cache=True) -> dict:
+    """Obtener /merchant_orders/{merchant_order_id} (del cache si está vigente)"""
+    key = str(merchant_order_id)
+    if use_cache:
+        cached = _orders.get(key)
+        if cached is not None:
+            return cached
+
+    data = _read(f"/merchant_orders/{merchant_order_id}", f"orden {merchant_order_id}")
+    _orders.set(key, data)
+    for payment in data.get("payments", []):
+        _drop_stale_payment(payment.get("id"), payment.get("status"))
+    return data
+
+
+def clear_cache():
+    _payments.clear()
+    _orders.clear()
@@ -0,0 +1,95 @@
+"""
+🔹 Rate limiter compartido para las llamadas a MercadoPago y GHL
+
+Conceptos clave:
+- Sin coordinación, N workers + la app web superan juntos el límite de la
+  API y reciben ráfagas de 429 seguidas de reintentos
+- Token bucket en la BD (RateLimitBucket): todos los procesos consumen del
+  mismo bucket con un UPDATE atómico
+- Claves: "mp:<host>" para MercadoPago y "ghl:<location_id>" para GHL (sus
+  límites son por location)
+- Si no hay token se espera lo justo, sin pasarse del deadline activo
+- Un 429 vacía el bucket por Retry-After segundos para todos los procesos
+"""
+
+import logging
+import time
+
+import requests
+from django.conf import settings
+
+from payments.models import RateLimitBucket
+from payments.services import deadline, metrics
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimited(requests.Timeout):
+    """
+    No hubo token disponible dentro del tiempo permitido
+
+    Hereda de requests.Timeout: es una falla reintentable.
+    """
+
+
+def mp_key(host: str) -> str:
+    return f"mp:{host}"
+
+
+def ghl_key(location_id: str) -> str:
+    return f"ghl:{location_id}"
+
+
+def _limits(key):
+    """(rate, capacity) configurados para el tipo de clave"""
+    if key.startswith("ghl:"):
+        return settings.GHL_RATE_LIMIT, settings.GHL_RATE_BURST
+    return settings.MP_RATE_LIMIT, settings.MP_RATE_BURST
+
+
+def acquire(key: str, max_wait: float = None):
+    """
+    Esperar (si hace falta) y consumir un token del bucket `key`
+
+    Args:
+        key: Clave del bucket (ver mp_key / ghl_key)
+        max_wait: Espera máxima (default: RATE_LIMIT_MAX_WAIT, acotada por
+            el deadline activo)
+
+    Raises:
+        RateLimited: si no hay token dentro de la espera permitida
+    """
+    if not settings.RATE_LIMIT_ENABLED:
+        return
+
+    rate, capacity = _limits(key)
+    max_wait = settings.RATE_LIMIT_MAX_WAIT if max_wait is None else max_wait
+    left = deadline.remaining()
+    if left is not None:
+        max_wait = min(max_wait, left)
+
+    started = time.monotonic()
+    while True:
+        wait = RateLimitBucket.try_acquire(key, rate, capacity)
+        if not wait:
+            waited = time.monotonic() - started
+            if waited > 0.001:
+                metrics.increment(f"ratelimit.{key}.waits")
+            return
+
+        if time.monotonic() - started + wait > max_wait:
+            metrics.increment(f"ratelimit.{key}.rejected")
+            raise RateLimited(f"Sin tokens para {key} (espera estimada {wait:.1f}s)")
+        time.sleep(wait)
+
+
+def penalize(key: str, response: requests.Response):
+    """La API respondió 429: pausar a todos los procesos por Retry-After"""
+    try:
+        seconds = float(response.headers.get("Retry-After", 1))
+    except ValueError:
+        seconds = 1.0
+
+    RateLimitBucket.drain(key, seconds)
+    metrics.increment(f"ratelimit.{key}.throttled")
+    logger.warning(f"🚦 ⚠ 429 de la API | {key} | Pausa: {seconds:.0f}s")
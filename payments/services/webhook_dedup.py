@@ -0,0 +1,35 @@
+"""
+🔹 Filtro en memoria de webhooks ya procesados
+
+MercadoPago reenvía muchas veces la misma notificación (payment_123,
+merchant_order_456). Una vez que la BD confirmó que un webhook_id ya se
+procesó, lo recordamos un tiempo para responder "already_processed" sin
+volver a consultar la BD.
+
+Solo se guardan eventos procesados: ese estado es final, así que el
+filtro nunca puede descartar un evento que aún falta procesar.
+"""
+
+from django.conf import settings
+
+from payments.services.cache import TTLCache
+
+_processed = TTLCache(
+    "webhook_dedup",
+    maxsize=settings.WEBHOOK_DEDUP_CACHE_SIZE,
+    ttl=settings.WEBHOOK_DEDUP_CACHE_TTL,
+)
+
+
+def is_known_processed(webhook_id: str) -> bool:
+    """True si sabemos (sin ir a la BD) que este webhook ya se procesó"""
+    return webhook_id in _processed
+
+
+def remember_processed(webhook_id: str):
+    """Recordar que este webhook ya se procesó"""
+    _processed.set(webhook_id, True)
+
+
+def clear():
+    _processed.clear()
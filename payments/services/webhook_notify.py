@@ -0,0 +1,238 @@
+"""
+🔹 Aviso inmediato a los workers cuando llega un webhook nuevo
+
+Conceptos clave:
+- Event-driven: mp_webhook avisa al guardar un evento y el worker ocioso
+  despierta al instante, sin esperar a la próxima consulta
+- PostgreSQL: LISTEN/NOTIFY sobre un canal (llega a workers de otros hosts)
+- SQLite/desarrollo: datagramas a sockets Unix en WEBHOOK_NOTIFY_DIR, uno
+  por worker; en Windows (sin AF_UNIX) solo avisos dentro del mismo proceso
+- Red de seguridad: el worker sigue consultando la cola cada tanto, así que
+  un aviso perdido solo retrasa el procesamiento, nunca lo impide
+- Canales: cada cola tiene el suyo (webhooks: WEBHOOK_NOTIFY_CHANNEL,
+  outbox de GHL: GHL_OUTBOX_NOTIFY_CHANNEL)
+"""
+
+import logging
+import os
+import select
+import socket
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+
+logger = logging.getLogger(__name__)
+
+# Eventos de los listeners locales de este proceso, por canal
+_local_events = {}
+_local_lock = threading.Lock()
+
+# Máximo que se bloquea cada espera: permite ver la señal de parada a tiempo
+_WAIT_SLICE = 1.0
+
+
+def _notify_dir(channel):
+    return Path(settings.WEBHOOK_NOTIFY_DIR) / channel
+
+
+def _use_postgres():
+    return connection.vendor == "postgresql"
+
+
+def notify(channel):
+    """Despertar a los workers ociosos de `channel` (nunca lanza excepciones)"""
+    if not settings.WEBHOOK_NOTIFY_ENABLED:
+        return
+
+    try:
+        if _use_postgres():
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_notify(%s, '')", [channel])
+        else:
+            _notify_local(channel)
+    except Exception as e:
+        logger.warning(f"🔔 ⚠ No se pudo avisar a los workers | Error: {str(e)}")
+
+
+def notify_new_webhook():
+    """Despertar a los workers de webhooks ociosos"""
+    notify(settings.WEBHOOK_NOTIFY_CHANNEL)
+
+
+def _notify_local(channel):
+    with _local_lock:
+        for event in _local_events.get(channel, ()):
+            event.set()
+
+    if not hasattr(socket, "AF_UNIX"):
+        return
+
+    notify_dir = _notify_dir(channel)
+    if not notify_dir.is_dir():
+        return
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+        sender.setblocking(False)
+        for path in notify_dir.glob("*.sock"):
+            try:
+                sender.sendto(b"1", str(path))
+            except BlockingIOError:
+                # Buffer lleno: el worker ya tiene avisos pendientes
+                pass
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Socket de un worker que ya no existe
+                path.unlink(missing_ok=True)
+
+
+class LocalListener:
+    """
+    Espera avisos por socket Unix (o evento en memoria si no hay AF_UNIX)
+    """
+
+    def __init__(self, channel):
+        self._channel = channel
+        self._event = threading.Event()
+        self._sock = None
+        self._path = None
+
+        with _local_lock:
+            _local_events.setdefault(channel, set()).add(self._event)
+
+        if hasattr(socket, "AF_UNIX"):
+            notify_dir = _notify_dir(channel)
+            notify_dir.mkdir(parents=True, exist_ok=True)
+            self._path = (
+                notify_dir / f"worker-{os.getpid()}-{uuid.uuid4().hex[:8]}.sock"
+            )
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._sock.bind(str(self._path))
+            self._sock.setblocking(False)
+
+    def wait(self, timeout):
+        """
+        Returns:
+            bool: True si llegó un aviso antes del timeout
+        """
+        if self._sock is None:
+            notified = self._event.wait(timeout)
+            self._event.clear()
+            return notified
+
+        ready, _, _ = select.select([self._sock], [], [], timeout)
+        if not ready:
+            return False
+
+        # Consumir todos los avisos acumulados
+        try:
+            while self._sock.recv(64):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        with _local_lock:
+            _local_events.get(self._channel, set()).discard(self._event)
+        if self._sock is not None:
+            self._sock.close()
+            self._path.unlink(missing_ok=True)
+
+
+class PostgresListener:
+    """
+    Espera avisos con LISTEN sobre una conexión dedicada
+    """
+
+    def __init__(self, channel):
+        self._wrapper = connections.create_connection(DEFAULT_DB_ALIAS)
+        self._wrapper.ensure_connection()
+        with self._wrapper.cursor() as cursor:
+            cursor.execute(f'LISTEN "{channel}"')
+
+    def wait(self, timeout):
+        from django.db.backends.postgresql.psycopg_any import is_psycopg3
+
+        raw = self._wrapper.connection
+        if is_psycopg3:
+            for _ in raw.notifies(timeout=timeout, stop_after=1):
+                return True
+            return False
+
+        # psycopg2
+        if not select.select([raw], [], [], timeout)[0]:
+            return False
+        raw.poll()
+        notified = bool(raw.notifies)
+        raw.notifies.clear()
+        return notified
+
+    def close(self):
+        self._wrapper.close()
+
+
+class WakeupListener:
+    """
+    Listener que usa el worker para dormir hasta que llegue trabajo
+
+    Si el backend falla (ej: se cae la conexión de LISTEN) se degrada a
+    esperar el timeout completo, como un polling normal.
+    """
+
+    def __init__(self, channel=None):
+        self.channel = channel or settings.WEBHOOK_NOTIFY_CHANNEL
+        self._backend = None
+        self._open()
+
+    def _open(self):
+        try:
+            if _use_postgres():
+                self._backend = PostgresListener(self.channel)
+            else:
+                self._backend = LocalListener(self.channel)
+        except Exception as e:
+            logger.warning(
+                f"🔔 ⚠ Avisos no disponibles, solo polling | Error: {str(e)}"
+            )
+            self._backend = None
+
+    def wait(self, timeout, stop_event=None):
+        """
+        Dormir hasta `timeout` segundos, un aviso o la señal de parada
+
+        Returns:
+            bool: True si despertó por un aviso
+        """
+        if self._backend is None:
+            self._open()
+
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (stop_event is not None and stop_event.is_set()):
+                return False
+
+            if self._backend is None:
+                if stop_event is not None:
+                    stop_event.wait(min(remaining, _WAIT_SLICE))
+                else:
+                    time.sleep(min(remaining, _WAIT_SLICE))
+                continue
+
+            try:
+                if self._backend.wait(min(remaining, _WAIT_SLICE)):
+                    return True
+            except Exception as e:
+                logger.warning(f"🔔 ⚠ Error esperando avisos | Error: {str(e)}")
+                self.close()
+
+    def close(self):
+        if self._backend is not None:
+            try:
+                self._backend.close()
+            except Exception:
+                pass
+            self._backend = None
@@ -6,29 +6,82 @@ Conceptos clave:
 - Idempotencia: Procesamos cada evento una sola vez
 - Resilencia: Reintentos automáticos con backoff exponencial
 - Observabilidad: Logs detallados de cada paso
+- Coalescing: los eventos payment_X y merchant_order_Y de un mismo pago se
+  resuelven con un solo trabajo (una consulta a MP, una escritura, un aviso
+  a GHL) cuando el status ya es terminal
+- GHL fuera del camino crítico: el aviso a GHL se guarda en el outbox en la
+  misma transacción que el cambio del Payment y lo envía dispatch_ghl
 """
 
 import json
 import logging
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
 from django.conf import settings
-from django.utils import timezone
+from django.db import close_old_connections, connection, transaction
 
-from payments.models import Payment, WebhookEvent
-from payments.services import add_tag_to_contact
+from payments.models import GhlOutboxMessage, Payment, WebhookEvent
+from payments.services import http_client, metrics, mp_service
+from payments.services.cache import TTLCache
+from payments.services.circuit_breaker import CircuitOpenError
+from payments.services.deadline import deadline
+from payments.services.webhook_notify import notify
 
 logger = logging.getLogger(__name__)
 
+# Estados de MP que ya no cambian (salvo devoluciones, que llegan como otro status)
+TERMINAL_STATUSES = {"approved", "rejected", "cancelled", "refunded", "charged_back"}
+
+# webhook_id → webhook_id del evento que ya hizo su trabajo (ventana corta)
+_coalesced = TTLCache(
+    "webhook_coalesce", maxsize=10000, ttl=settings.WEBHOOK_COALESCE_WINDOW
+)
+
+
+def _select_order_payment(payments):
+    """
+    Elegir el pago de una merchant_order que representa su estado
+
+    El aprobado si lo hay; si no, el más reciente (por fecha de
+    actualización/creación y, a igualdad, por ID).
+
+    Returns:
+        dict | None: Pago elegido (None si la orden no tiene pagos)
+    """
+    if not payments:
+        return None
+    approved = [p for p in payments if p.get("status") == "approved"]
+    if approved:
+        return approved[-1]
+
+    def _recency(payment_info):
+        return (
+            payment_info.get("last_modified")
+            or payment_info.get("date_last_updated")
+            or payment_info.get("date_created")
+            or "",
+            int(payment_info.get("id") or 0),
+        )
+
+    return max(payments, key=_recency)
+
+
+def get_worker_id():
+    """Identificador de este worker (host:pid) para el claim de eventos"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
 
 class WebhookProcessor:
     """
     Procesador de eventos de webhooks con reintentos automáticos
     """
 
-    def __init__(self, event: WebhookEvent):
+    def __init__(self, event: WebhookEvent, worker_id=None):
         self.event = event
-        self.mp_headers = {"Authorization": f"Bearer {settings.MP_ACCESS_TOKEN}"}
+        self.worker_id = worker_id or get_worker_id()
 
     def process(self):
         """
@@ -37,30 +90,65 @@ class WebhookProcessor:
         Returns:
             bool: True si se procesó exitosamente, False si falló
         """
+        # Los eventos de claim_batch ya vienen tomados; si no (modo inline),
+        # tomarlo ahora de forma atómica
+        if not self.event.lease_token:
+            if not self.event.mark_processing(self.worker_id):
+                logger.info(
+                    f"⚙️ Evento ya tomado por otro worker | ID: {self.event.webhook_id}"
+                )
+                return False
+
         logger.info(
             f"[WEBHOOK-PROCESSOR] ⚡ Procesando {self.event.webhook_type} | "
-            f"ID: {self.event.webhook_id} | Intento: {self.event.attempts + 1}/{self.event.max_attempts}"
+            f"ID: {self.event.webhook_id} | "
+            f"Intento: {self.event.attempts}/{self.event.max_attempts}"
         )
 
-        # Marcar como en proceso
-        self.event.mark_processing()
-
         try:
-            # Determinar el tipo de webhook y procesarlo
-            if self.event.webhook_type == "payment":
-                self._process_payment_webhook()
-            elif self.event.webhook_type == "merchant_order":
-                self._process_merchant_order_webhook()
-            else:
-                raise ValueError(
-                    f"Tipo de webhook desconocido: {self.event.webhook_type}"
+            # Otro evento del mismo pago ya hizo este trabajo
+            covered_by = _coalesced.peek(self.event.webhook_id)
+            if covered_by:
+                self.event.mark_coalesced(covered_by)
+                metrics.increment("webhooks.coalesced")
+                logger.info(
+                    f"⚙️ ⇉ Evento coalescido | ID: {self.event.webhook_id} "
+                    f"→ {covered_by}"
                 )
+                return True
+
+            # Todas las llamadas del evento comparten WEBHOOK_EVENT_BUDGET
+            with deadline(settings.WEBHOOK_EVENT_BUDGET):
+                # Determinar el tipo de webhook y procesarlo
+                if self.event.webhook_type == "payment":
+                    self._process_payment_webhook()
+                elif self.event.webhook_type == "merchant_order":
+                    self._process_merchant_order_webhook()
+                else:
+                    raise ValueError(
+                        f"Tipo de webhook desconocido: {self.event.webhook_type}"
+                    )
 
             # Si llegamos aquí, el procesamiento fue exitoso
-            self.event.mark_success()
+            if not self.event.mark_success():
+                logger.warning(
+                    "⚙️ ⚠ Lease perdido, otro worker reclamó el evento | "
+                    f"ID: {self.event.webhook_id}"
+                )
             logger.info(f"⚙️ ✓ Evento procesado | ID: {self.event.webhook_id}")
             return True
 
+        except CircuitOpenError as e:
+            # La API está caída: esperar a que el circuito pruebe de nuevo,
+            # sin gastar un intento del evento
+            delay = max(e.retry_after, 1)
+            self.event.mark_deferred(delay, str(e))
+            metrics.increment("webhooks.deferred")
+            logger.warning(
+                f"⚙️ ⏸ Evento diferido | ID: {self.event.webhook_id} | {str(e)}"
+            )
+            return False
+
         except Exception as e:
             # Capturar el error y programar reintento
             error_message = str(e)
@@ -68,6 +156,7 @@ class WebhookProcessor:
                 "error_type": type(e).__name__,
                 "error_message": error_message,
                 "attempt": self.event.attempts,
+                "retryable": http_client.is_retryable(e),
             }
 
             self.event.mark_failed(error_message, error_details)
@@ -95,19 +184,8 @@ class WebhookProcessor:
 
         logger.info(f"💳 ➡️ Consultando MP | Payment ID: {payment_id}")
 
-        # Consultar detalles del pago a MercadoPago
-        response = requests.get(
-            f"https://api.mercadopago.com/v1/payments/{payment_id}",
-            headers=self.mp_headers,
-            timeout=10,
-        )
-
-        if response.status_code != 200:
-            raise Exception(
-                f"Error al consultar pago {payment_id}: Status {response.status_code}"
-            )
-
-        payment_data = response.json()
+        # Consultar detalles del pago a MercadoPago (con reintentos)
+        payment_data = mp_service.get_payment(payment_id)
         status = payment_data.get("status")
         preference_id = payment_data.get("preference_id")
         external_reference = payment_data.get("external_reference")
@@ -121,31 +199,18 @@ class WebhookProcessor:
             f"💳 IDs | preference_id: {preference_id} | external_reference: {external_reference}"
         )
 
-        # Buscar el pago en nuestra BD
-        payment = None
-
-        # Intento 1: Buscar por preference_id (si existe)
-        if preference_id:
-            payment = Payment.objects.filter(preference_id=preference_id).first()
-            if payment:
-                logger.info(f"💳 ✓ Encontrado por preference_id: {preference_id}")
-
-        # Intento 2: Buscar por external_reference (appointment_id)
-        if not payment and external_reference:
-            payment = Payment.objects.filter(appointment_id=external_reference).first()
-            if payment:
-                logger.info(
-                    f"💳 ✓ Encontrado por external_reference: {external_reference}"
-                )
-                # Actualizar el preference_id si no lo tiene
-                if not payment.preference_id and preference_id:
-                    payment.preference_id = preference_id
-
-        # Intento 3: Buscar por payment_id (si ya fue procesado antes)
-        if not payment:
-            payment = Payment.objects.filter(payment_id=payment_id).first()
-            if payment:
-                logger.info(f"💳 ✓ Encontrado por payment_id: {payment_id}")
+        # Buscar el pago en nuestra BD (una sola query indexada)
+        payment, found_by = Payment.resolve(
+            preference_id=preference_id,
+            appointment_id=external_reference,
+            payment_id=payment_id,
+        )
+        extra_fields = {}
+        if payment:
+            logger.info(f"💳 ✓ Encontrado por {found_by}")
+            # Actualizar el preference_id si no lo tiene
+            if not payment.preference_id and preference_id:
+                extra_fields["preference_id"] = preference_id
 
         if not payment:
             error_msg = f"No se encontró pago en BD. preference_id: {preference_id}, external_reference: {external_reference}, payment_id: {payment_id}"
@@ -153,10 +218,15 @@ class WebhookProcessor:
             raise Exception(error_msg)
 
         # Solo actualizar si hay cambios
+        changed = False
         if payment.payment_id != payment_id or payment.status != status:
-            payment.payment_id = payment_id
-            payment.status = status
-            payment.save()
+            # El aviso a GHL se guarda junto con el cambio de estado
+            with transaction.atomic():
+                changed = payment.apply_mp_status(payment_id, status, **extra_fields)
+                if changed and status == "approved":
+                    self._enqueue_ghl_tag(payment)
+
+        if changed:
             logger.info(
                 f"💳 ✓ Actualizado | Payment ID: {payment_id} → Status: {status}"
             )
@@ -166,32 +236,22 @@ class WebhookProcessor:
             if preference_id:
                 self.event.preference_id = preference_id
             self.event.save(update_fields=["payment", "preference_id"])
-
-            # Si el pago fue aprobado, actualizar GHL
-            if status == "approved":
-                self._add_ghl_tag(payment.contact_id)
         else:
             logger.info(f"💳 Sin cambios | Payment ID: {payment_id}")
 
+        # La orden de este pago ya no aporta nada nuevo
+        order_id = (payment_data.get("order") or {}).get("id")
+        if status in TERMINAL_STATUSES and order_id:
+            self._coalesce([f"merchant_order_{order_id}"])
+
     def _process_merchant_order_webhook(self):
         """Procesar webhook de tipo 'merchant_order'"""
         merchant_order_id = self.event.webhook_id.split("_")[-1]
 
         logger.info(f"📦 ➡️ Consultando orden | ID: {merchant_order_id}")
 
-        # Consultar detalles de la orden
-        response = requests.get(
-            f"https://api.mercadopago.com/merchant_orders/{merchant_order_id}",
-            headers=self.mp_headers,
-            timeout=10,
-        )
-
-        if response.status_code != 200:
-            raise Exception(
-                f"Error al consultar orden {merchant_order_id}: Status {response.status_code}"
-            )
-
-        order_data = response.json()
+        # Consultar detalles de la orden (con reintentos)
+        order_data = mp_service.get_merchant_order(merchant_order_id)
         preference_id = order_data.get("preference_id")
         payments = order_data.get("payments", [])
         total_amount = order_data.get("total_amount", 0)
@@ -201,7 +261,8 @@ class WebhookProcessor:
             f"📦 ⬅️ Respuesta MP | Status: {order_status} | Monto: ${total_amount} | Pagos: {len(payments)}"
         )
 
-        # Procesar cada pago en la orden
+        # Aplicar un solo pago por orden: los intentos rechazados previos no
+        # deben pisar al aprobado según el orden en que MP los liste
         if preference_id:
             payment = Payment.objects.filter(preference_id=preference_id).first()
 
@@ -211,18 +272,20 @@ class WebhookProcessor:
                 )
 
             has_changes = False
-
-            for payment_info in payments:
-                payment_id = str(payment_info.get("id"))
-                status = payment_info.get("status")
-
-                # Solo actualizar si es un payment_id nuevo
-                if payment_id and (
-                    not payment.payment_id or payment.payment_id != payment_id
-                ):
-                    payment.payment_id = payment_id
-                    payment.status = status
-                    payment.save()
+            payment_info = _select_order_payment(payments)
+            payment_id = str(payment_info.get("id") or "") if payment_info else ""
+            status = payment_info.get("status") if payment_info else None
+
+            # Solo actualizar si es un payment_id o status nuevo
+            if payment_id and (
+                payment.payment_id != payment_id or payment.status != status
+            ):
+                with transaction.atomic():
+                    changed = payment.apply_mp_status(payment_id, status)
+                    if changed and status == "approved":
+                        self._enqueue_ghl_tag(payment)
+                # Si no cambió, otro evento del mismo pago ya lo aplicó
+                if changed:
                     has_changes = True
 
                     logger.info(
@@ -237,64 +300,188 @@ class WebhookProcessor:
                         update_fields=["payment", "mp_payment_id", "preference_id"]
                     )
 
-                    # Si el pago fue aprobado, actualizar GHL
-                    if status == "approved":
-                        self._add_ghl_tag(payment.contact_id)
-
             if not has_changes:
                 logger.info(f"📦 Sin cambios | Orden: {merchant_order_id}")
+
+            # Los eventos de pagos terminales de esta orden ya no aportan nada
+            self._coalesce(
+                [
+                    f"payment_{payment_info.get('id')}"
+                    for payment_info in payments
+                    if payment_info.get("status") in TERMINAL_STATUSES
+                ]
+            )
         else:
             logger.warning(
                 f"📦 ⚠ preference_id no encontrado | Orden: {merchant_order_id}"
             )
 
-    def _add_ghl_tag(self, contact_id):
-        """Agregar tag a contacto en GoHighLevel"""
-        logger.info(f"🏢 ➡️ Agregando tag | Contact ID: {contact_id}")
+    def _coalesce(self, webhook_ids):
+        """
+        Dar por resueltos los eventos `webhook_ids` con el trabajo de este
+
+        Los que siguen en cola se cierran en la BD; los que este proceso
+        tome dentro de WEBHOOK_COALESCE_WINDOW (ej: el mismo lote) se
+        cierran al empezar a procesarlos.
+        """
+        webhook_ids = [
+            webhook_id
+            for webhook_id in webhook_ids
+            if webhook_id != self.event.webhook_id
+        ]
+        if not webhook_ids:
+            return
+
+        for webhook_id in webhook_ids:
+            _coalesced.set(webhook_id, self.event.webhook_id)
+
+        coalesced = WebhookEvent.coalesce_pending(webhook_ids, self.event.webhook_id)
+        if coalesced:
+            metrics.increment("webhooks.coalesced", coalesced)
+            logger.info(
+                f"⚙️ ⇉ Eventos coalescidos | {', '.join(webhook_ids)} "
+                f"→ {self.event.webhook_id}"
+            )
+
+    def _enqueue_ghl_tag(self, payment):
+        """Guardar en el outbox el tag de pago confirmado (dentro de la transacción)"""
+        GhlOutboxMessage.enqueue(
+            payment.contact_id,
+            GhlOutboxMessage.ACTION_ADD_TAG,
+            {"tag": "pago_confirmado"},
+            payment=payment,
+        )
+        # Despertar al dispatcher solo si la transacción se confirma
+        transaction.on_commit(lambda: notify(settings.GHL_OUTBOX_NOTIFY_CHANNEL))
+        logger.info(f"🏢 ➡️ Tag encolado | Contact ID: {payment.contact_id}")
+
 
+class LeaseHeartbeat:
+    """
+    Renueva en segundo plano el lease de un lote mientras se procesa
+
+    Así los eventos que esperan su turno dentro del lote no se reclaman
+    como huérfanos aunque el lote tarde más que WEBHOOK_LEASE_SECONDS.
+    Sirve para cualquier modelo con `extend_lease` (ej: GhlOutboxMessage).
+    """
+
+    def __init__(self, lease_token, lease_seconds=None, model=WebhookEvent):
+        self.lease_token = lease_token
+        self.lease_seconds = lease_seconds or settings.WEBHOOK_LEASE_SECONDS
+        self.model = model
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop_event.set()
+        self._thread.join()
+
+    def _run(self):
         try:
-            result = add_tag_to_contact(contact_id, "pago_confirmado")
+            # Renovar a un tercio del lease para tolerar un heartbeat perdido
+            while not self._stop_event.wait(self.lease_seconds / 3):
+                try:
+                    self.model.extend_lease(self.lease_token, self.lease_seconds)
+                except Exception as e:
+                    # Ej: "database is locked" en SQLite; se reintenta en el
+                    # próximo tick en vez de dejar vencer el lease
+                    logger.error(f"⚙️ ✗ Error renovando lease | Error: {str(e)}")
+        finally:
+            # Cada thread tiene su propia conexión a la BD
+            connection.close()
+
+
+def reclaim_expired_webhooks():
+    """
+    Devolver a la cola los eventos cuyo lease expiró (worker caído)
 
-            if result.get("success"):
-                logger.info(f"🏢 ✓ Tag agregado | {result.get('message')}")
-            else:
-                # No lanzar excepción aquí, solo logueamos el error
-                # El webhook se considera exitoso aunque GHL falle
-                logger.error(f"🏢 ✗ Error agregando tag | {result.get('message')}")
-        except Exception as e:
-            # No lanzar excepción aquí, solo logueamos el error
-            logger.error(f"🏢 ✗ Excepción agregando tag | {str(e)}")
+    Returns:
+        int: Número de eventos reclamados
+    """
+    reclaimed = WebhookEvent.reclaim_expired()
+    if reclaimed:
+        metrics.increment("webhooks.reclaimed", reclaimed)
+        logger.warning(f"⚙️ ♻ Eventos reclamados por lease expirado: {reclaimed}")
+    return reclaimed
+
+
+def _process_in_thread(event, worker_id):
+    """Procesar un evento dentro de un thread del pool"""
+    try:
+        return WebhookProcessor(event, worker_id).process()
+    finally:
+        # Cada thread abre su propia conexión: cerrarla como al final de un request
+        close_old_connections()
 
 
-def process_pending_webhooks():
+def process_pending_webhooks(worker_id=None, batch_size=None, concurrency=1):
     """
     Procesar todos los webhooks pendientes que estén listos para reintento
 
-    Este método debe ser llamado periódicamente (ej: cada 1 minuto con cron)
+    Este método lo llama el worker (process_webhooks --loop) o un cron.
+    Los eventos se toman con un claim atómico, así que varios workers
+    pueden ejecutarlo en paralelo sin procesar dos veces el mismo evento.
+
+    Args:
+        worker_id: Identificador del worker (default: host:pid)
+        batch_size: Máximo de eventos a tomar en este lote
+            (default: WEBHOOK_BATCH_SIZE)
+        concurrency: Eventos del lote que se procesan a la vez (threads).
+            Casi todo el tiempo se pasa esperando a MP/GHL, así que con N
+            threads el lote se vacía ~N veces más rápido.
+
+    Returns:
+        int: Número de eventos procesados en este lote
     """
-    now = timezone.now()
+    worker_id = worker_id or get_worker_id()
+    batch_size = batch_size or settings.WEBHOOK_BATCH_SIZE
+    concurrency = max(1, concurrency)
+
+    # Con el circuito de MP abierto todos los eventos fallarían al instante:
+    # dejarlos en la cola en lugar de tomarlos
+    if not http_client.is_available(mp_service.MP_API_URL):
+        logger.warning("⚙️ ⏸ Circuito de MercadoPago abierto, cola en espera")
+        return 0
 
-    # Buscar eventos pendientes que:
+    # Tomar eventos pendientes que:
     # 1. Estén en estado pending
     # 2. No tengan next_retry_at (primera vez) O ya haya pasado el tiempo de espera
-    pending_events = (
-        WebhookEvent.objects.filter(status=WebhookEvent.STATUS_PENDING, processed=False)
-        .filter(models.Q(next_retry_at__isnull=True) | models.Q(next_retry_at__lte=now))
-        .order_by("created_at")[:10]
-    )  # Procesar máximo 10 eventos por vez
+    # (al menos uno por thread, para no dejar threads ociosos)
+    pending_events = WebhookEvent.claim_batch(
+        worker_id, limit=max(batch_size, concurrency)
+    )
 
     if not pending_events:
         logger.debug("⚙️ No hay eventos pendientes")
-        return
+        return 0
 
     logger.info(f"⚙️ ⚡ Procesando lote | Eventos: {len(pending_events)}")
 
     success_count = 0
     failed_count = 0
 
-    for event in pending_events:
-        processor = WebhookProcessor(event)
-        if processor.process():
+    with LeaseHeartbeat(pending_events[0].lease_token):
+        if concurrency == 1:
+            results = [
+                WebhookProcessor(event, worker_id).process() for event in pending_events
+            ]
+        else:
+            with ThreadPoolExecutor(
+                max_workers=concurrency, thread_name_prefix="webhook"
+            ) as executor:
+                results = list(
+                    executor.map(
+                        lambda event: _process_in_thread(event, worker_id),
+                        pending_events,
+                    )
+                )
+
+    for result in results:
+        if result:
             success_count += 1
         else:
             failed_count += 1
@@ -303,6 +490,4 @@ def process_pending_webhooks():
         f"⚙️ Resultado | ✓ Exitosos: {success_count} | ✗ Fallidos: {failed_count}"
     )
 
-
-# Importar Q para las queries
-from django.db import models
+    return success_count + failed_count
@@ -0,0 +1,252 @@
+"""
+🔹 Spool en disco para webhooks cuando la BD no acepta escrituras
+
+Conceptos clave:
+- Con SQLite, escrituras concurrentes fallan con "database is locked"; antes
+  el webhook se perdía aunque respondiéramos 200 a MercadoPago
+- Si la BD falla (o tarda más que el presupuesto) el evento se agrega a un
+  segmento en disco (JSON por línea, solo-append) y se confirma igual
+- fsync por grupos: varios requests concurrentes comparten un mismo fsync
+- Un timer del proceso dueño cierra el segmento al cumplir su edad máxima,
+  aunque no lleguen más webhooks: lo ya confirmado a MP no queda esperando
+- El worker re-inyecta los segmentos cerrados en WebhookEvent con
+  ingest_many (idempotente: un evento que sí llegó a la BD no se duplica)
+
+Ciclo de vida de un segmento:
+    segment-<ns>-<pid>.open       → se está escribiendo (bloqueado con flock)
+    segment-<ns>-<pid>.jsonl      → cerrado, listo para re-inyectar
+    segment-<ns>-<pid>.replaying  → tomado por un worker
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from payments.models import WebhookEvent
+from payments.services import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo se re-inyectan segmentos cerrados
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Un segmento en .replaying más viejo que esto quedó de un worker caído
+_STALE_REPLAY_SECONDS = 600
+
+
+class WebhookSpool:
+    """
+    Segmentos solo-append en disco, uno abierto por proceso
+    """
+
+    def __init__(self, directory=None, segment_max_bytes=None, segment_max_age=None):
+        self.directory = Path(directory or settings.WEBHOOK_SPOOL_DIR)
+        self.segment_max_bytes = (
+            segment_max_bytes or settings.WEBHOOK_SPOOL_SEGMENT_MAX_BYTES
+        )
+        self.segment_max_age = segment_max_age or settings.WEBHOOK_SPOOL_SEGMENT_MAX_AGE
+        self._write_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._file = None
+        self._path = None
+        self._opened_at = None
+        self._seal_timer = None
+        self._pid = None
+        self._written = 0
+        self._synced = 0
+
+    @property
+    def has_open_segment(self):
+        return self._file is not None and self._pid == os.getpid()
+
+    def append(self, row):
+        """
+        Agregar un evento al spool y esperar a que esté en disco (fsync)
+        """
+        line = json.dumps(row, default=str) + "\n"
+
+        with self._write_lock:
+            if self._needs_rotation():
+                self._rotate()
+            self._file.write(line)
+            self._file.flush()
+            self._written += 1
+            sequence = self._written
+
+        metrics.increment("webhooks.spool.appended")
+
+        # Group commit: un solo fsync cubre todas las escrituras hechas
+        # hasta ese momento; los demás threads ya quedan confirmados
+        with self._sync_lock:
+            if self._synced >= sequence:
+                return
+            target = self._written
+            os.fsync(self._file.fileno())
+            self._synced = target
+
+    def seal(self):
+        """Cerrar el segmento abierto para que el worker pueda re-inyectarlo"""
+        with self._write_lock:
+            if self.has_open_segment:
+                self._close_segment()
+
+    def _seal_if_aged(self, path):
+        """Timer: cerrar el segmento `path` si sigue abierto y ya venció"""
+        with self._write_lock:
+            if self.has_open_segment and self._path == path:
+                self._close_segment()
+                logger.info(f"💾 Segmento cerrado por antigüedad | {path.name}")
+
+    def _needs_rotation(self):
+        if not self.has_open_segment:
+            return True
+        if time.monotonic() - self._opened_at > self.segment_max_age:
+            return True
+        return self._file.tell() >= self.segment_max_bytes
+
+    def _rotate(self):
+        if self.has_open_segment:
+            self._close_segment()
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._pid = os.getpid()
+        self._path = self.directory / f"segment-{time.time_ns()}-{self._pid}.open"
+        self._file = open(self._path, "a", encoding="utf-8")
+        if fcntl is not None:
+            # Mientras el proceso viva, nadie re-inyecta este segmento
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._opened_at = time.monotonic()
+
+        # Cerrar el segmento a tiempo aunque no lleguen más escrituras
+        self._seal_timer = threading.Timer(
+            self.segment_max_age, self._seal_if_aged, args=(self._path,)
+        )
+        self._seal_timer.daemon = True
+        self._seal_timer.start()
+
+    def _close_segment(self):
+        if self._seal_timer is not None:
+            self._seal_timer.cancel()
+            self._seal_timer = None
+        with self._sync_lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._synced = self._written
+            self._file.close()
+            self._path.rename(self._path.with_suffix(".jsonl"))
+            self._file = None
+            self._path = None
+
+    def _claimable_segments(self):
+        """Segmentos cerrados, de un proceso muerto o a medio re-inyectar"""
+        if not self.directory.is_dir():
+            return []
+
+        segments = list(self.directory.glob("segment-*.jsonl"))
+
+        now = time.time()
+        for path in self.directory.glob("segment-*.replaying"):
+            try:
+                if now - path.stat().st_mtime > _STALE_REPLAY_SECONDS:
+                    segments.append(path)
+            except FileNotFoundError:
+                continue
+
+        if fcntl is not None:
+            for path in self.directory.glob("segment-*.open"):
+                if path == self._path:
+                    continue
+                try:
+                    with open(path, "rb") as handle:
+                        fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except (BlockingIOError, FileNotFoundError):
+                    # Lo tiene un proceso vivo (o ya lo tomaron)
+                    continue
+                segments.append(path)
+
+        return sorted(segments)
+
+    def replay(self, batch_size=500):
+        """
+        Re-inyectar los segmentos pendientes en WebhookEvent
+
+        Returns:
+            int: Número de eventos nuevos que entraron a la cola
+        """
+        created = 0
+        for path in self._claimable_segments():
+            claimed = path.with_suffix(".replaying")
+            try:
+                # rename atómico: solo un worker toma cada segmento
+                if path != claimed:
+                    path.rename(claimed)
+                os.utime(claimed)
+            except FileNotFoundError:
+                continue
+
+            try:
+                rows = self._read_segment(claimed)
+            except FileNotFoundError:
+                continue
+            for start in range(0, len(rows), batch_size):
+                results = WebhookEvent.ingest_many(rows[start : start + batch_size])
+                created += sum(
+                    1
+                    for _, status in results.values()
+                    if status == WebhookEvent.INGEST_RECEIVED
+                )
+
+            claimed.unlink(missing_ok=True)
+            metrics.increment("webhooks.spool.replayed", len(rows))
+            logger.info(
+                f"💾 ✓ Segmento re-inyectado | {claimed.name} | Eventos: {len(rows)}"
+            )
+
+        return created
+
+    def _read_segment(self, path):
+        rows = []
+        with open(path, encoding="utf-8") as handle:
+            for number, line in enumerate(handle, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Última línea cortada por una caída a mitad de escritura
+                    logger.warning(f"💾 ⚠ Línea inválida | {path.name}:{number}")
+        return rows
+
+
+_spool = WebhookSpool()
+
+
+def spool_webhook(row):
+    """Guardar un evento en el spool de este proceso"""
+    row = dict(row, spooled_at=timezone.now().isoformat())
+    _spool.append(row)
+    logger.warning(f"💾 ⚠ Webhook guardado en spool | ID: {row['webhook_id']}")
+
+
+def seal_spool():
+    """Cerrar el segmento abierto (la BD volvió a aceptar escrituras)"""
+    if _spool.has_open_segment:
+        _spool.seal()
+
+
+def replay_spool():
+    """
+    Re-inyectar en la BD los eventos guardados en el spool
+
+    Returns:
+        int: Número de eventos nuevos en la cola
+    """
+    return _spool.replay()
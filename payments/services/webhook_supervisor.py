@@ -0,0 +1,233 @@
+"""
+🔹 Supervisor multi-proceso para los workers de webhooks
+
+Conceptos clave:
+- Procesos hijos: cada worker es un `process_webhooks --loop` independiente
+- Auto-reparación: si un worker muere, se levanta otro; si mueren seguido
+  (ej: fallan al arrancar) la espera antes de relanzar crece exponencialmente
+- Autoescalado: la cantidad de workers sigue al backlog y a la antigüedad
+  del evento más viejo, entre --workers y --max-workers
+- Parada ordenada: SIGTERM se reenvía a los hijos, que terminan su lote;
+  la espera máxima cubre el peor caso de un lote con el deadline por evento
+"""
+
+import logging
+import math
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from payments.models import WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+# Margen sobre el peor caso de un lote al esperar que los workers terminen
+_DRAIN_GRACE = 10
+
+
+class WebhookSupervisor:
+    """
+    Mantiene entre `min_workers` y `max_workers` procesos worker vivos
+    """
+
+    def __init__(
+        self,
+        min_workers=1,
+        max_workers=None,
+        poll_interval=None,
+        concurrency=None,
+        batch_size=None,
+        max_idle=None,
+    ):
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers or self.min_workers)
+        self.poll_interval = poll_interval
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_idle = max_idle
+        self.check_interval = settings.WEBHOOK_SCALE_INTERVAL
+        self.backlog_per_worker = settings.WEBHOOK_BACKLOG_PER_WORKER
+        self.max_event_age = settings.WEBHOOK_MAX_EVENT_AGE
+        self.drain_timeout = self._drain_timeout()
+        self.respawn_backoff = settings.WEBHOOK_RESPAWN_BACKOFF
+        self.respawn_backoff_max = settings.WEBHOOK_RESPAWN_BACKOFF_MAX
+        self.workers = []
+        self._started_at = {}
+        self._crashes = 0
+        self._respawn_at = 0.0
+        self._low_backlog_checks = 0
+        self._stop_event = threading.Event()
+
+    def _drain_timeout(self):
+        """
+        Espera máxima para que un worker termine su lote tras SIGTERM
+
+        Un worker a la mitad de un lote puede necesitar una ronda completa
+        de eventos por cada `concurrency` del lote, cada uno acotado por
+        WEBHOOK_EVENT_BUDGET. Matarlo antes deja sus eventos bloqueados
+        hasta que venza su lease (WEBHOOK_LEASE_SECONDS), así que conviene
+        esperar. WEBHOOK_DRAIN_TIMEOUT solo puede alargar la espera.
+        """
+        batch_size = self.batch_size or settings.WEBHOOK_BATCH_SIZE
+        concurrency = max(1, self.concurrency or settings.WEBHOOK_CONCURRENCY)
+        rounds = math.ceil(max(batch_size, concurrency) / concurrency)
+        worst_batch = rounds * settings.WEBHOOK_EVENT_BUDGET + _DRAIN_GRACE
+        return max(settings.WEBHOOK_DRAIN_TIMEOUT, worst_batch)
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+
+    def _handle_signal(self, signum, frame):
+        # No loguear aquí: el handler puede interrumpir una escritura del log
+        self._stop_event.set()
+
+    def _worker_command(self):
+        command = [
+            sys.executable,
+            str(settings.BASE_DIR / "manage.py"),
+            "process_webhooks",
+            "--loop",
+        ]
+        if self.poll_interval is not None:
+            command += ["--interval", str(self.poll_interval)]
+        if self.concurrency is not None:
+            command += ["--concurrency", str(self.concurrency)]
+        if self.batch_size is not None:
+            command += ["--batch-size", str(self.batch_size)]
+        if self.max_idle is not None:
+            command += ["--max-idle", str(self.max_idle)]
+        return command
+
+    def _spawn(self):
+        process = subprocess.Popen(self._worker_command())
+        self.workers.append(process)
+        self._started_at[process.pid] = time.monotonic()
+        logger.info(
+            f"🧭 ➕ Worker iniciado | PID: {process.pid} | Total: {len(self.workers)}"
+        )
+
+    def _retire(self):
+        """Pedir a un worker que termine su lote y salga (SIGTERM)"""
+        process = self.workers.pop()
+        self._started_at.pop(process.pid, None)
+        process.terminate()
+        logger.info(
+            f"🧭 ➖ Worker retirado | PID: {process.pid} | Total: {len(self.workers)}"
+        )
+        return process
+
+    def _reap(self):
+        """Quitar de la lista los workers que terminaron (se reemplazan al escalar)"""
+        now = time.monotonic()
+        for process in list(self.workers):
+            returncode = process.poll()
+            if returncode is None:
+                continue
+            self.workers.remove(process)
+            uptime = now - self._started_at.pop(process.pid, now)
+
+            # Un worker que vivió más que la espera máxima no cuenta como
+            # parte de una racha de caídas
+            if uptime > self.respawn_backoff_max:
+                self._crashes = 0
+            self._crashes += 1
+            delay = min(
+                self.respawn_backoff_max,
+                self.respawn_backoff * 2 ** (self._crashes - 1),
+            )
+            self._respawn_at = max(self._respawn_at, now + delay)
+            logger.error(
+                f"🧭 ✗ Worker terminó inesperadamente | PID: {process.pid} | "
+                f"Código: {returncode} | Vivió: {uptime:.1f}s | "
+                f"Relanzamiento en: {delay:.1f}s"
+            )
+
+    def desired_workers(self, current, pending, oldest_age):
+        """
+        Calcular cuántos workers hacen falta para el backlog actual
+
+        - Un worker por cada WEBHOOK_BACKLOG_PER_WORKER eventos pendientes
+        - Si el evento más viejo supera WEBHOOK_MAX_EVENT_AGE, uno más
+        - Para bajar se requieren 3 chequeos seguidos con menos backlog
+          (evita subir y bajar workers en cada ráfaga)
+        """
+        desired = math.ceil(pending / self.backlog_per_worker)
+        if oldest_age > self.max_event_age:
+            desired = max(desired, current + 1)
+        desired = min(self.max_workers, max(self.min_workers, desired))
+
+        if desired < current:
+            self._low_backlog_checks += 1
+            if self._low_backlog_checks < 3:
+                return current
+            self._low_backlog_checks = 0
+            return current - 1
+
+        self._low_backlog_checks = 0
+        return desired
+
+    def _scale(self):
+        try:
+            stats = WebhookEvent.backlog_stats()
+        except Exception as e:
+            logger.error(f"🧭 ✗ Error consultando backlog | Error: {str(e)}")
+            stats = {"pending": 0, "oldest_age": 0}
+        finally:
+            close_old_connections()
+
+        current = len(self.workers)
+        desired = self.desired_workers(current, stats["pending"], stats["oldest_age"])
+        if desired != current:
+            logger.info(
+                f"🧭 Escalando {current} → {desired} | Pendientes: {stats['pending']} | "
+                f"Más antiguo: {stats['oldest_age']:.0f}s"
+            )
+
+        retired = []
+        if len(self.workers) < desired and time.monotonic() < self._respawn_at:
+            # Caídas recientes: esperar antes de relanzar (evita un loop de forks)
+            desired = len(self.workers)
+        while len(self.workers) < desired:
+            self._spawn()
+        while len(self.workers) > desired:
+            retired.append(self._retire())
+        return retired
+
+    def _wait_all(self, processes):
+        """Esperar a que los workers terminen su lote; forzar si tardan demasiado"""
+        deadline = time.monotonic() + self.drain_timeout
+        for process in processes:
+            try:
+                process.wait(timeout=max(0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                logger.warning(f"🧭 ⚠ Worker no terminó a tiempo | PID: {process.pid}")
+                process.kill()
+                process.wait()
+
+    def run(self):
+        logger.info(
+            f"🧭 Supervisor iniciado | Workers: {self.min_workers}-{self.max_workers}"
+        )
+
+        # Workers retirados al escalar hacia abajo que aún terminan su lote
+        draining = []
+
+        while not self._stop_event.is_set():
+            self._reap()
+            draining = [p for p in draining if p.poll() is None]
+            draining += self._scale()
+            self._stop_event.wait(self.check_interval)
+
+        logger.info(f"🧭 ⏹ Drenando {len(self.workers)} workers...")
+        for process in self.workers:
+            process.terminate()
+        self._wait_all(self.workers + draining)
+        self.workers = []
+        self._started_at = {}
+        logger.info("🧭 Supervisor detenido")
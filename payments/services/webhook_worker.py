@@ -0,0 +1,186 @@
+"""
+🔹 Worker que consume la cola de eventos de webhooks en segundo plano
+
+Conceptos clave:
+- Cola en BD: mp_webhook solo inserta el WebhookEvent y responde
+- Worker de larga duración: drena la cola lote tras lote mientras haya trabajo
+- Backoff: con la cola vacía la espera crece hasta WEBHOOK_MAX_IDLE_SLEEP
+- Avisos: mp_webhook despierta al worker ocioso apenas guarda un evento
+- Parada ordenada: SIGTERM/SIGINT terminan el lote actual antes de salir
+- Recuperación: cada tanto se reclaman eventos con lease expirado y se
+  re-inyectan los webhooks que quedaron en el spool en disco
+"""
+
+import logging
+import signal
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from payments.services.webhook_notify import WakeupListener
+from payments.services.webhook_processor import (
+    process_pending_webhooks,
+    reclaim_expired_webhooks,
+)
+from payments.services.webhook_spool import replay_spool
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookWorker:
+    """
+    Loop de procesamiento de webhooks pendientes
+    """
+
+    # Nombre en los logs y canal de avisos (None: WEBHOOK_NOTIFY_CHANNEL)
+    label = "Worker"
+    notify_channel = None
+
+    def __init__(
+        self, poll_interval=None, concurrency=None, batch_size=None, max_idle=None
+    ):
+        if poll_interval is None:
+            poll_interval = settings.WEBHOOK_POLL_INTERVAL
+        if concurrency is None:
+            concurrency = settings.WEBHOOK_CONCURRENCY
+        if batch_size is None:
+            batch_size = settings.WEBHOOK_BATCH_SIZE
+        if max_idle is None:
+            max_idle = settings.WEBHOOK_MAX_IDLE_SLEEP
+        self.poll_interval = poll_interval
+        self.max_idle = max(poll_interval, max_idle)
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self._idle_rounds = 0
+        self.reclaim_interval = settings.WEBHOOK_RECLAIM_INTERVAL
+        self._last_reclaim = None
+        self.spool_replay_interval = settings.WEBHOOK_SPOOL_REPLAY_INTERVAL
+        self._last_spool_replay = None
+        # Totales de la recuperación hecha por este worker (para reportar)
+        self.reclaimed = 0
+        self.replayed = 0
+        self._stop_event = threading.Event()
+
+    @property
+    def stopping(self):
+        return self._stop_event.is_set()
+
+    def install_signal_handlers(self):
+        """Registrar SIGTERM/SIGINT para detener el worker al terminar el lote"""
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+
+    def _handle_signal(self, signum, frame):
+        # No loguear aquí: el handler puede interrumpir una escritura del log
+        self.stop()
+
+    def stop(self):
+        """Solicitar la detención del loop"""
+        self._stop_event.set()
+
+    def run_once(self):
+        """
+        Procesar un lote de eventos pendientes
+
+        Returns:
+            int: Número de eventos procesados
+        """
+        try:
+            self._reclaim_if_due()
+            self._replay_spool_if_due()
+            return process_pending_webhooks(
+                batch_size=self.batch_size, concurrency=self.concurrency
+            )
+        finally:
+            # Igual que en un request: no dejar conexiones viejas abiertas
+            close_old_connections()
+
+    def _reclaim_if_due(self):
+        """Reclamar leases expirados como mucho cada `reclaim_interval` segundos"""
+        now = time.monotonic()
+        if self._last_reclaim is not None:
+            if now - self._last_reclaim < self.reclaim_interval:
+                return
+        self._last_reclaim = now
+        self.reclaimed += self._reclaim()
+
+    def _reclaim(self):
+        return reclaim_expired_webhooks()
+
+    def _replay_spool_if_due(self):
+        """Pasar a la cola los webhooks que quedaron en el spool en disco"""
+        now = time.monotonic()
+        if self._last_spool_replay is not None:
+            if now - self._last_spool_replay < self.spool_replay_interval:
+                return
+        self._last_spool_replay = now
+        try:
+            self.replayed += replay_spool()
+        except Exception as e:
+            # La BD puede seguir sin aceptar escrituras: se reintenta luego
+            logger.error(f"⚙️ ✗ Error re-inyectando spool | Error: {str(e)}")
+
+    def _idle_sleep(self):
+        """
+        Espera cuando la cola está vacía: crece exponencialmente desde
+        `poll_interval` hasta `max_idle` mientras no aparezca trabajo
+        """
+        sleep = min(self.max_idle, self.poll_interval * (2**self._idle_rounds))
+        if sleep < self.max_idle:
+            self._idle_rounds += 1
+        return sleep
+
+    def drain(self):
+        """
+        Procesar lotes seguidos hasta vaciar la cola (o hasta la detención)
+
+        Returns:
+            int: Total de eventos procesados
+        """
+        total = 0
+        while not self.stopping:
+            processed = self.run_once()
+            if not processed:
+                break
+            total += processed
+        return total
+
+    def run(self):
+        """Procesar lotes hasta que se solicite la detención"""
+        logger.info(
+            f"⚙️ {self.label} iniciado | Lote: {self.batch_size} | "
+            f"Concurrencia: {self.concurrency} | "
+            f"Espera: {self.poll_interval}-{self.max_idle}s"
+        )
+
+        listener = (
+            WakeupListener(self.notify_channel)
+            if settings.WEBHOOK_NOTIFY_ENABLED
+            else None
+        )
+
+        try:
+            while not self.stopping:
+                try:
+                    processed = self.run_once()
+                except Exception as e:
+                    logger.error(f"⚙️ ✗ Error en el worker | Error: {str(e)}")
+                    processed = 0
+
+                # Mientras haya trabajo, seguir pidiendo lotes sin esperar;
+                # solo con la cola vacía se duerme (con backoff) hasta que
+                # llegue un aviso de mp_webhook
+                if processed:
+                    self._idle_rounds = 0
+                elif listener is not None:
+                    if listener.wait(self._idle_sleep(), self._stop_event):
+                        self._idle_rounds = 0
+                else:
+                    self._stop_event.wait(self._idle_sleep())
+        finally:
+            if listener is not None:
+                listener.close()
+
+        logger.info(f"⚙️ ⏹ {self.label} detenido")
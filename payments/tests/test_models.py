@@ -4,7 +4,8 @@ Tests básicos para el modelo Payment
 
 from django.test import TestCase
 
-from payments.models import Payment, WebhookEvent
+from payments.models import Payment, RateLimitBucket, WebhookEvent
+from payments.services import rate_limiter
 
 
 class PaymentModelTest(TestCase):
@@ -39,6 +40,34 @@ class PaymentModelTest(TestCase):
         self.assertEqual(str(payment), expected_str)
 
 
+class PaymentResolveTest(TestCase):
+    """Pruebas de la búsqueda del pago de una notificación"""
+
+    def test_resolve_uses_one_query_and_keeps_priority(self):
+        """preference_id tiene prioridad sobre appointment_id y payment_id"""
+        by_appointment = Payment.objects.create(
+            appointment_id="Cita_001", contact_id="c1", preference_id="", amount=10
+        )
+        by_preference = Payment.objects.create(
+            appointment_id="Cita_002",
+            contact_id="c2",
+            preference_id="pref_2",
+            amount=10,
+        )
+
+        with self.assertNumQueries(1):
+            payment, found_by = Payment.resolve(
+                preference_id="pref_2", appointment_id="Cita_001", payment_id="99"
+            )
+        self.assertEqual((payment, found_by), (by_preference, "preference_id"))
+
+        payment, found_by = Payment.resolve(
+            preference_id="pref_x", appointment_id="Cita_001"
+        )
+        self.assertEqual((payment, found_by), (by_appointment, "appointment_id"))
+        self.assertEqual(Payment.resolve(payment_id="404"), (None, None))
+
+
 class WebhookEventModelTest(TestCase):
     """Pruebas básicas para el modelo WebhookEvent"""
 
@@ -56,3 +85,100 @@ class WebhookEventModelTest(TestCase):
         self.assertEqual(webhook.webhook_id, "webhook_123")
         self.assertEqual(webhook.webhook_type, "payment")
         self.assertEqual(webhook.mp_payment_id, "123456789")
+
+    def test_claim_batch_does_not_return_claimed_events(self):
+        """Dos workers no toman el mismo evento"""
+        for i in range(3):
+            WebhookEvent.objects.create(
+                webhook_id=f"payment_{i}",
+                webhook_type="payment",
+                raw_payload={},
+            )
+
+        first = WebhookEvent.claim_batch("worker-a", limit=2)
+        second = WebhookEvent.claim_batch("worker-b", limit=2)
+
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertFalse({e.id for e in first} & {e.id for e in second})
+        for event in first:
+            self.assertEqual(event.status, WebhookEvent.STATUS_PROCESSING)
+            self.assertEqual(event.locked_by, "worker-a")
+            self.assertEqual(event.attempts, 1)
+
+    def test_mark_processing_is_atomic(self):
+        """Un evento ya tomado no puede marcarse en proceso otra vez"""
+        webhook = WebhookEvent.objects.create(
+            webhook_id="payment_999", webhook_type="payment", raw_payload={}
+        )
+        other = WebhookEvent.objects.get(pk=webhook.pk)
+
+        self.assertTrue(webhook.mark_processing("worker-a"))
+        self.assertFalse(other.mark_processing("worker-b"))
+        self.assertIsNotNone(webhook.lease_token)
+
+    def test_reclaim_expired_returns_event_to_queue(self):
+        """Un evento con lease vencido vuelve a pending"""
+        from django.utils import timezone
+
+        webhook = WebhookEvent.objects.create(
+            webhook_id="payment_777", webhook_type="payment", raw_payload={}
+        )
+        webhook.mark_processing("worker-a")
+        WebhookEvent.objects.filter(pk=webhook.pk).update(
+            lease_expires_at=timezone.now() - timezone.timedelta(seconds=1)
+        )
+
+        self.assertEqual(WebhookEvent.reclaim_expired(), 1)
+
+        webhook.refresh_from_db()
+        self.assertEqual(webhook.status, WebhookEvent.STATUS_PENDING)
+        self.assertEqual(webhook.reclaim_count, 1)
+        self.assertIsNone(webhook.lease_token)
+
+        # El worker original ya no puede pisar el estado
+        stale = WebhookEvent.objects.get(pk=webhook.pk)
+        stale.lease_token = "token-viejo"
+        self.assertFalse(stale.mark_success())
+
+    def test_ingest_is_insert_or_ignore(self):
+        """ingest() inserta una sola vez y reporta los duplicados"""
+        event_id, status = WebhookEvent.ingest("payment_321", "payment", "321", {})
+        self.assertEqual(status, WebhookEvent.INGEST_RECEIVED)
+
+        dup_id, status = WebhookEvent.ingest("payment_321", "payment", "321", {})
+        self.assertEqual(dup_id, event_id)
+        self.assertEqual(status, WebhookEvent.INGEST_ALREADY_RECEIVED)
+
+        WebhookEvent.objects.filter(pk=event_id).update(processed=True)
+        _, status = WebhookEvent.ingest("payment_321", "payment", "321", {})
+        self.assertEqual(status, WebhookEvent.INGEST_ALREADY_PROCESSED)
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+
+        event = WebhookEvent.objects.get(pk=event_id)
+        self.assertEqual(event.raw_payload, {})
+        self.assertIsNotNone(event.created_at)
+
+
+class RateLimitBucketTest(TestCase):
+    """Pruebas del token bucket compartido"""
+
+    def test_consumes_burst_then_asks_to_wait(self):
+        """Se consume la ráfaga y luego hay que esperar la recarga"""
+        for _ in range(2):
+            self.assertEqual(RateLimitBucket.try_acquire("ghl:loc", 1, 2), 0)
+
+        wait = RateLimitBucket.try_acquire("ghl:loc", 1, 2)
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 1)
+        self.assertEqual(RateLimitBucket.objects.count(), 1)
+
+    def test_drain_pauses_bucket(self):
+        """Un 429 deja el bucket sin tokens por los segundos indicados"""
+        RateLimitBucket.try_acquire("mp:host", 10, 10)
+        RateLimitBucket.drain("mp:host", 5)
+
+        self.assertGreater(RateLimitBucket.try_acquire("mp:host", 10, 10), 4)
+        with self.settings(RATE_LIMIT_MAX_WAIT=0.1):
+            with self.assertRaises(rate_limiter.RateLimited):
+                rate_limiter.acquire("mp:host")
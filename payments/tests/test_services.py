@@ -0,0 +1,432 @@
+"""
+Tests básicos para los servicios de integración (HTTP, MercadoPago y GHL)
+"""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import requests
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from payments.models import Contact, SyncState
+from payments.services import (
+    contact_sync,
+    ghl_service,
+    http_client,
+    metrics,
+    mp_service,
+)
+from payments.services.cache import RefreshCache
+from payments.services.circuit_breaker import CircuitBreaker, CircuitOpenError
+from payments.services.deadline import DeadlineExceeded, deadline, remaining
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    """Servidor HTTP local con keep-alive para las pruebas"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path.startswith("/slow"):
+            time.sleep(2)
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalServerMixin:
+    """Levanta el servidor local una vez por clase de pruebas"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _KeepAliveHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+
+class HttpClientTest(LocalServerMixin, SimpleTestCase):
+    """Pruebas del pool de conexiones de http_client"""
+
+    def test_reuses_connection_per_host(self):
+        for _ in range(3):
+            response = http_client.get(f"{self.base_url}/ping", timeout=5)
+            self.assertEqual(response.status_code, 200)
+
+        self.assertIs(
+            http_client.get_session(f"{self.base_url}/otra"),
+            http_client.get_session(self.base_url),
+        )
+
+        stats = http_client.pool_stats()[self.base_url]
+        self.assertEqual(stats["connections"], 1)
+        self.assertGreaterEqual(stats["reused"], 2)
+        self.assertIn(self.base_url, metrics.snapshot()["gauges"]["http.pools"])
+
+
+class DeadlineTest(LocalServerMixin, SimpleTestCase):
+    """Pruebas de los presupuestos de tiempo (deadlines)"""
+
+    def test_nested_deadline_never_extends_outer(self):
+        self.assertIsNone(remaining())
+        with deadline(1):
+            with deadline(60):
+                self.assertLessEqual(remaining(), 1)
+        self.assertIsNone(remaining())
+
+    def test_read_timeout_bounded_by_budget(self):
+        started = time.monotonic()
+        with deadline(0.3):
+            with self.assertRaises(requests.Timeout) as ctx:
+                http_client.get(f"{self.base_url}/slow")
+        self.assertLess(time.monotonic() - started, 1.5)
+        self.assertTrue(http_client.is_retryable(ctx.exception))
+
+    def test_exhausted_budget_skips_call(self):
+        with deadline(0):
+            with self.assertRaises(DeadlineExceeded):
+                http_client.get(f"{self.base_url}/ping")
+
+
+class CircuitBreakerTest(SimpleTestCase):
+    """Pruebas del circuit breaker por host"""
+
+    def _breaker(self):
+        return CircuitBreaker(
+            "test", window_seconds=60, min_calls=4, failure_rate=0.5, open_seconds=0.1
+        )
+
+    def test_opens_on_failure_rate_and_fails_fast(self):
+        breaker = self._breaker()
+        for success in (True, False, True, False):
+            breaker.before_call()
+            breaker.record(success)
+
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+
+    def test_half_open_allows_single_probe(self):
+        breaker = self._breaker()
+        for _ in range(4):
+            breaker.record(False)
+        time.sleep(0.15)
+
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        probe = breaker.before_call()
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+
+        breaker.record(True, probe)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_stale_call_does_not_decide_the_probe(self):
+        breaker = self._breaker()
+        # Empezó con el circuito cerrado y termina durante la prueba
+        self.assertIsNone(breaker.before_call())
+        for _ in range(4):
+            breaker.record(False)
+        time.sleep(0.15)
+        probe = breaker.before_call()
+
+        breaker.record(True)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        breaker.record(False, probe)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def test_probe_is_released_if_the_call_never_happens(self):
+        breaker = self._breaker()
+        for _ in range(4):
+            breaker.record(False)
+        time.sleep(0.15)
+
+        with (
+            mock.patch.object(http_client, "get_breaker", return_value=breaker),
+            mock.patch.object(
+                http_client.rate_limiter,
+                "acquire",
+                side_effect=DeadlineExceeded("sin presupuesto"),
+            ),
+        ):
+            with self.assertRaises(DeadlineExceeded):
+                http_client.get("https://api.example.com/x", rate_limit_key="k")
+
+        # La prueba no quedó tomada: la siguiente llamada puede hacerla
+        self.assertTrue(breaker.is_available())
+        probe = breaker.before_call()
+        breaker.record(True, probe)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+class MercadoPagoReadTest(SimpleTestCase):
+    """Pruebas de las lecturas a MercadoPago (reintentos, hedge, cache)"""
+
+    def setUp(self):
+        mp_service.clear_cache()
+
+    def _response(self, status_code, data=None):
+        response = mock.Mock(status_code=status_code)
+        response.json.return_value = data or {}
+        return response
+
+    @override_settings(MP_RETRY_BACKOFF=0.01)
+    def test_transient_error_is_retried_within_attempt(self):
+        responses = [self._response(503), self._response(200, {"status": "approved"})]
+        with mock.patch.object(mp_service, "_timed_get", side_effect=responses):
+            self.assertEqual(mp_service.get_payment("1"), {"status": "approved"})
+
+    def test_client_error_is_not_retried(self):
+        with mock.patch.object(
+            mp_service, "_timed_get", return_value=self._response(404)
+        ) as get:
+            with self.assertRaises(mp_service.MercadoPagoError):
+                mp_service.get_payment("1")
+        self.assertEqual(get.call_count, 1)
+
+    @override_settings(MP_HEDGE_ENABLED=True, MP_HEDGE_MIN_SAMPLES=5)
+    def test_slow_read_is_hedged(self):
+        for _ in range(5):
+            mp_service._latency.record(0.01)
+        calls = []
+
+        def fake_get(url):
+            calls.append(url)
+            if len(calls) == 1:
+                time.sleep(0.5)
+            return self._response(200, {"id": len(calls)})
+
+        wins = metrics.get_counter("mp.hedge_wins")
+        with mock.patch.object(mp_service, "_timed_get", side_effect=fake_get):
+            self.assertEqual(mp_service.get_merchant_order("9"), {"id": 2})
+        self.assertEqual(metrics.get_counter("mp.hedge_wins"), wins + 1)
+
+    def test_documents_are_cached_until_status_changes(self):
+        payment = self._response(
+            200, {"id": 1, "status": "pending", "order": {"id": 7}}
+        )
+        order = self._response(
+            200, {"id": 7, "payments": [{"id": 1, "status": "approved"}]}
+        )
+        with mock.patch.object(
+            mp_service, "_timed_get", side_effect=[payment, order, payment]
+        ) as get:
+            mp_service.get_payment(1)
+            mp_service.get_payment(1)
+            self.assertEqual(get.call_count, 1)
+
+            # La orden muestra otro status: la copia del pago ya no sirve
+            mp_service.get_merchant_order(7)
+            mp_service.get_payment(1)
+            self.assertEqual(get.call_count, 3)
+
+
+@override_settings(
+    GHL_TOKEN="token", GHL_BASE_URL="https://ghl.test", GHL_LOCATION_ID="loc"
+)
+class GhlUpdateContactTest(SimpleTestCase):
+    """Pruebas de la actualización de contactos en GHL"""
+
+    def setUp(self):
+        ghl_service.forget_contact_tags()
+
+    def _response(self, status_code, data=None):
+        response = mock.Mock(status_code=status_code)
+        response.json.return_value = data or {}
+        return response
+
+    def test_tags_are_added_without_replacing_the_list(self):
+        added = self._response(200, {"tags": ["lead", "vip", "pago_confirmado"]})
+        with (
+            mock.patch.object(http_client, "get") as get,
+            mock.patch.object(http_client, "post", return_value=added) as post,
+            mock.patch.object(
+                http_client, "put", return_value=self._response(200)
+            ) as put,
+        ):
+            result = ghl_service.update_contact(
+                "c1",
+                tags=["vip", "pago_confirmado"],
+                custom_fields={"payment_status": "paid"},
+            )
+
+        self.assertTrue(result["success"])
+        get.assert_not_called()
+        post.assert_called_once()
+        self.assertTrue(post.call_args.args[0].endswith("/contacts/c1/tags"))
+        self.assertEqual(
+            post.call_args.kwargs["json"], {"tags": ["vip", "pago_confirmado"]}
+        )
+        # El PUT solo lleva custom fields: los tags del contacto no se pisan
+        put.assert_called_once()
+        self.assertEqual(
+            put.call_args.kwargs["json"],
+            {"customFields": [{"key": "payment_status", "field_value": "paid"}]},
+        )
+        self.assertEqual(result["all_tags"], ["lead", "vip", "pago_confirmado"])
+
+    def test_known_tags_skip_the_call(self):
+        ghl_service.remember_contact_tags("c1", ["pago_confirmado"])
+        with (
+            mock.patch.object(http_client, "post") as post,
+            mock.patch.object(http_client, "put") as put,
+        ):
+            result = ghl_service.add_tag_to_contact("c1")
+
+        self.assertTrue(result["success"])
+        self.assertIn("ya existía", result["message"])
+        post.assert_not_called()
+        put.assert_not_called()
+
+    def test_only_unknown_tags_are_posted(self):
+        added = self._response(200, {"tags": ["lead", "pago_confirmado"]})
+        with mock.patch.object(http_client, "post", return_value=added) as post:
+            ghl_service.add_tag_to_contact("c1")
+            # La respuesta dejó los tags en el cache: nada que hacer
+            result = ghl_service.add_tag_to_contact("c1")
+            ghl_service.add_tag_to_contact("c1", "vip")
+
+        self.assertTrue(result["success"])
+        self.assertEqual(post.call_count, 2)
+        self.assertEqual(post.call_args.kwargs["json"], {"tags": ["vip"]})
+
+    def test_failed_post_forgets_known_tags(self):
+        ghl_service.remember_contact_tags("c1", ["lead"])
+        with mock.patch.object(http_client, "post", return_value=self._response(500)):
+            result = ghl_service.add_tag_to_contact("c1")
+
+        self.assertFalse(result["success"])
+        self.assertIsNone(ghl_service._contact_tags.peek("c1"))
+
+
+class ContactSyncTest(TestCase):
+    """Pruebas de la sincronización de contactos de GHL"""
+
+    def _page(self, ids, next_id=None):
+        contacts = [
+            {
+                "id": contact_id,
+                "name": f"Contacto {contact_id}",
+                "email": "",
+                "phone": "",
+                "tags": [],
+                "date_updated": "2025-01-01T00:00:00Z",
+            }
+            for contact_id in ids
+        ]
+        meta = {"startAfterId": next_id, "startAfter": 1} if next_id else {}
+        return {"success": True, "contacts": contacts, "meta": meta, "message": ""}
+
+    def test_sync_resumes_from_saved_cursor(self):
+        pages = [self._page(["a", "b"], next_id="b"), self._page(["c"])]
+        with mock.patch.object(
+            contact_sync, "get_contacts", side_effect=pages
+        ) as get_contacts:
+            first = contact_sync.sync_contacts(max_pages=1, page_size=2)
+            self.assertFalse(first["completed"])
+            self.assertEqual(
+                SyncState.objects.get().cursor, {"startAfterId": "b", "startAfter": 1}
+            )
+
+            second = contact_sync.sync_contacts(page_size=2)
+
+        self.assertTrue(second["completed"])
+        self.assertEqual(get_contacts.call_args.kwargs["start_after_id"], "b")
+        self.assertEqual(Contact.objects.count(), 3)
+        self.assertEqual(SyncState.objects.get().cursor, {})
+
+    def test_backfill_saves_found_and_remembers_unknown_contacts(self):
+        found = {
+            "success": True,
+            "contact": dict(self._page(["a"])["contacts"][0]),
+        }
+        with mock.patch.object(
+            contact_sync,
+            "get_contact",
+            side_effect=[found, {"success": False, "not_found": True}],
+        ):
+            self.assertEqual(contact_sync.backfill_contacts(["a", "zz"]), 1)
+
+        self.assertTrue(Contact.objects.filter(ghl_id="a").exists())
+        # GHL no conoce "zz": no se vuelve a pedir por un tiempo
+        self.assertIsNone(contact_sync.backfill_contacts_async(["zz"]))
+        contact_sync._unknown.clear()
+
+    def test_unchanged_contacts_are_not_rewritten(self):
+        with mock.patch.object(
+            contact_sync, "get_contacts", return_value=self._page(["a", "b"])
+        ):
+            self.assertEqual(contact_sync.sync_contacts()["saved"], 2)
+            self.assertEqual(contact_sync.sync_contacts()["saved"], 0)
+
+
+class RefreshCacheTest(SimpleTestCase):
+    """Pruebas del cache con refresco en segundo plano"""
+
+    def test_concurrent_misses_share_one_load(self):
+        calls = []
+
+        def loader(key):
+            calls.append(key)
+            time.sleep(0.2)
+            return {"success": True, "key": key}
+
+        cache = RefreshCache("test_single_flight", loader, ttl=60)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cache.get(1)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, [{"success": True, "key": 1}] * 5)
+
+    def test_stale_value_is_served_while_refreshing(self):
+        values = iter([1, 2])
+        refreshed = threading.Event()
+
+        def loader():
+            value = next(values)
+            if value == 2:
+                refreshed.set()
+            return value
+
+        cache = RefreshCache("test_stale", loader, ttl=0.05, stale_ttl=60)
+        self.assertEqual(cache.get(), 1)
+        time.sleep(0.1)
+
+        self.assertEqual(cache.get(), 1)
+        self.assertTrue(refreshed.wait(1))
+        time.sleep(0.05)
+        self.assertEqual(cache.get(), 2)
+
+    def test_failed_load_is_not_cached(self):
+        values = iter([{"success": True}, {"success": False}])
+        cache = RefreshCache(
+            "test_failed",
+            lambda: next(values),
+            ttl=0,
+            stale_ttl=0,
+            should_cache=lambda result: result["success"],
+        )
+        self.assertEqual(cache.get(), {"success": True})
+        self.assertEqual(cache.get(), {"success": False})
+        self.assertEqual(len(cache), 1)
@@ -3,6 +3,7 @@ Tests básicos para las vistas de webhooks
 """
 
 import json
+from unittest import mock
 
 from django.test import Client, TestCase
 from django.urls import reverse
@@ -38,3 +39,89 @@ class WebhookViewTest(TestCase):
         )
 
         self.assertEqual(response.status_code, 400)
+
+    def test_webhook_queue_mode_only_enqueues(self):
+        """En modo queue el webhook solo se guarda como pendiente"""
+        from payments.models import WebhookEvent
+
+        webhook_data = {"resource": "987654321", "topic": "payment"}
+
+        with self.settings(WEBHOOK_PROCESSING_MODE="queue"):
+            response = self.client.post(
+                self.webhook_url,
+                data=json.dumps(webhook_data),
+                content_type="application/json",
+            )
+
+        self.assertEqual(response.status_code, 200)
+        event = WebhookEvent.objects.get(webhook_id="payment_987654321")
+        self.assertEqual(event.status, WebhookEvent.STATUS_PENDING)
+        self.assertEqual(event.attempts, 0)
+
+    def test_webhook_duplicate_processed_is_served_from_memory(self):
+        """Un duplicado ya procesado se confirma sin consultar la BD"""
+        from payments.models import WebhookEvent
+        from payments.services import metrics, webhook_dedup
+
+        webhook_dedup.clear()
+        WebhookEvent.objects.create(
+            webhook_id="payment_111",
+            webhook_type="payment",
+            raw_payload={},
+            processed=True,
+        )
+        webhook_data = json.dumps({"resource": "111", "topic": "payment"})
+
+        response = self.client.post(
+            self.webhook_url, data=webhook_data, content_type="application/json"
+        )
+        self.assertEqual(response.json()["status"], "already_processed")
+
+        hits = metrics.get_counter("cache.webhook_dedup.hits")
+        with self.assertNumQueries(0):
+            response = self.client.post(
+                self.webhook_url, data=webhook_data, content_type="application/json"
+            )
+        self.assertEqual(response.json()["status"], "already_processed")
+        self.assertEqual(metrics.get_counter("cache.webhook_dedup.hits"), hits + 1)
+
+
+class ContactViewsTest(TestCase):
+    """Pruebas de las vistas que leen la copia local de contactos"""
+
+    def setUp(self):
+        from payments.models import Contact, Payment
+
+        Contact.objects.create(ghl_id="c1", name="Ana Pérez", email="ana@test.com")
+        Contact.objects.create(ghl_id="c2", name="Bruno Díaz")
+        Payment.objects.create(
+            appointment_id="Cita_001", contact_id="c1", preference_id="p1", amount=50
+        )
+
+    def test_contacts_are_served_from_local_table(self):
+        response = self.client.get("/api/contacts", {"q": "ana"})
+
+        data = response.json()
+        self.assertEqual(data["total"], 1)
+        self.assertEqual(data["contacts"][0]["id"], "c1")
+
+    def test_payments_history_uses_local_names(self):
+        response = self.client.get("/api/payments")
+
+        self.assertEqual(response.json()["payments"][0]["contact_name"], "Ana Pérez")
+
+    def test_missing_names_are_backfilled_in_background(self):
+        from payments.models import Payment
+
+        Payment.objects.create(
+            appointment_id="Cita_002", contact_id="c9", preference_id="p2", amount=10
+        )
+
+        with mock.patch("payments.views.backfill_contacts_async") as backfill:
+            response = self.client.get("/api/payments")
+
+        names = {
+            p["contact_id"]: p["contact_name"] for p in response.json()["payments"]
+        }
+        self.assertEqual(names, {"c1": "Ana Pérez", "c9": "c9"})
+        backfill.assert_called_once_with({"c9"})
@@ -0,0 +1,633 @@
+"""
+Tests básicos para el procesamiento de la cola de webhooks
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock
+
+from django.db import OperationalError
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+
+from payments.models import GhlOutboxMessage, Payment, WebhookEvent
+from payments.services import circuit_breaker, ghl_dispatcher, webhook_processor
+from payments.services.mp_service import MP_API_URL
+from payments.services.webhook_processor import (
+    LeaseHeartbeat,
+    WebhookProcessor,
+    process_pending_webhooks,
+)
+
+
+class ProcessPendingWebhooksTest(TransactionTestCase):
+    """Pruebas del procesamiento por lotes"""
+
+    def _create_events(self, count):
+        for i in range(count):
+            WebhookEvent.objects.create(
+                webhook_id=f"payment_{i}", webhook_type="payment", raw_payload={}
+            )
+
+    def test_concurrent_batch_uses_thread_pool(self):
+        """Con concurrency > 1 cada evento se procesa en un thread del pool"""
+        self._create_events(4)
+        threads = set()
+
+        def fake_process(processor):
+            threads.add(threading.current_thread().name)
+            return processor.event.mark_success()
+
+        with mock.patch.object(WebhookProcessor, "process", fake_process):
+            processed = process_pending_webhooks(batch_size=4, concurrency=4)
+
+        self.assertEqual(processed, 4)
+        self.assertTrue(all(name.startswith("webhook") for name in threads))
+        self.assertEqual(
+            WebhookEvent.objects.filter(status=WebhookEvent.STATUS_SUCCESS).count(), 4
+        )
+
+    def test_heartbeat_keeps_renewing_after_a_failure(self):
+        """Un extend_lease fallido (ej: BD bloqueada) no corta la renovación"""
+        calls = []
+
+        def flaky_extend(lease_token, lease_seconds=None):
+            calls.append(lease_token)
+            if len(calls) == 1:
+                raise OperationalError("database is locked")
+            return 1
+
+        with mock.patch.object(WebhookEvent, "extend_lease", flaky_extend):
+            with LeaseHeartbeat("token", lease_seconds=0.15):
+                deadline_at = time.monotonic() + 2
+                while len(calls) < 3 and time.monotonic() < deadline_at:
+                    time.sleep(0.02)
+
+        self.assertGreaterEqual(len(calls), 3)
+
+    def test_drain_processes_batches_until_empty(self):
+        """--drain sigue pidiendo lotes mientras haya eventos"""
+        from payments.services.webhook_worker import WebhookWorker
+
+        self._create_events(5)
+
+        def fake_process(processor):
+            return processor.event.mark_success()
+
+        worker = WebhookWorker(batch_size=2)
+        with mock.patch.object(WebhookProcessor, "process", fake_process):
+            processed = worker.drain()
+
+        self.assertEqual(processed, 5)
+        self.assertEqual(WebhookEvent.backlog_stats()["pending"], 0)
+
+    def test_one_shot_command_recovers_once(self):
+        """El modo de una pasada reclama leases y re-inyecta el spool una vez"""
+        from django.core.management import call_command
+
+        from payments.services import webhook_worker
+
+        with (
+            mock.patch.object(
+                webhook_worker, "reclaim_expired_webhooks", return_value=2
+            ) as reclaim,
+            mock.patch.object(webhook_worker, "replay_spool", return_value=0) as replay,
+        ):
+            call_command("process_webhooks", stdout=StringIO())
+
+        reclaim.assert_called_once()
+        replay.assert_called_once()
+
+    def test_idle_sleep_backs_off_up_to_max(self):
+        """Con la cola vacía la espera crece exponencialmente hasta el máximo"""
+        from payments.services.webhook_worker import WebhookWorker
+
+        worker = WebhookWorker(poll_interval=1, max_idle=5)
+        sleeps = [worker._idle_sleep() for _ in range(5)]
+
+        self.assertEqual(sleeps, [1, 2, 4, 5, 5])
+
+
+class WebhookSupervisorTest(TransactionTestCase):
+    """Pruebas del cálculo de autoescalado del supervisor"""
+
+    def test_desired_workers_follows_backlog(self):
+        """Sube con el backlog y baja de a uno tras varios chequeos"""
+        from payments.services.webhook_supervisor import WebhookSupervisor
+
+        supervisor = WebhookSupervisor(min_workers=1, max_workers=4)
+        per_worker = supervisor.backlog_per_worker
+
+        self.assertEqual(supervisor.desired_workers(1, per_worker * 3, 0), 3)
+        self.assertEqual(supervisor.desired_workers(3, per_worker * 10, 0), 4)
+        self.assertEqual(supervisor.desired_workers(2, 0, 10**6), 3)
+
+        # Sin backlog: se mantiene hasta el tercer chequeo y baja de a uno
+        self.assertEqual(supervisor.desired_workers(4, 0, 0), 4)
+        self.assertEqual(supervisor.desired_workers(4, 0, 0), 4)
+        self.assertEqual(supervisor.desired_workers(4, 0, 0), 3)
+
+    def _supervisor(self, script):
+        from payments.services.webhook_supervisor import WebhookSupervisor
+
+        supervisor = WebhookSupervisor(min_workers=1)
+        supervisor._worker_command = lambda: [sys.executable, "-c", script]
+        return supervisor
+
+    @override_settings(WEBHOOK_RESPAWN_BACKOFF=30, WEBHOOK_RESPAWN_BACKOFF_MAX=60)
+    def test_crashing_worker_is_respawned_with_backoff(self):
+        """Un worker que muere al arrancar no se relanza en cada chequeo"""
+        supervisor = self._supervisor("import sys; sys.exit(1)")
+
+        supervisor._scale()
+        supervisor.workers[0].wait()
+        supervisor._reap()
+        supervisor._scale()
+        self.assertEqual(supervisor.workers, [])
+
+        # Vencida la espera se relanza; otra caída duplica la espera
+        supervisor._respawn_at = 0
+        supervisor._scale()
+        self.assertEqual(len(supervisor.workers), 1)
+        supervisor.workers[0].wait()
+        before = time.monotonic()
+        supervisor._reap()
+        self.assertGreaterEqual(supervisor._respawn_at - before, 59)
+
+    def test_sigterm_lets_workers_finish_their_batch(self):
+        """Al detenerse, el supervisor espera a que el worker salga solo"""
+        with tempfile.TemporaryDirectory() as tmp:
+            ready = os.path.join(tmp, "ready")
+            supervisor = self._supervisor(
+                "import pathlib, signal, sys, time\n"
+                "def stop(*args):\n"
+                "    time.sleep(0.3)\n"
+                "    sys.exit(0)\n"
+                "signal.signal(signal.SIGTERM, stop)\n"
+                f"pathlib.Path({ready!r}).touch()\n"
+                "time.sleep(30)\n"
+            )
+            supervisor.check_interval = 0.05
+            runner = threading.Thread(target=supervisor.run)
+            runner.start()
+
+            for _ in range(100):
+                if os.path.exists(ready):
+                    break
+                time.sleep(0.05)
+            process = supervisor.workers[0]
+            supervisor._stop_event.set()
+            runner.join(10)
+
+        self.assertFalse(runner.is_alive())
+        self.assertEqual(process.returncode, 0)
+
+    @override_settings(WEBHOOK_EVENT_BUDGET=30, WEBHOOK_DRAIN_TIMEOUT=60)
+    def test_drain_timeout_covers_a_full_batch(self):
+        from payments.services.webhook_supervisor import WebhookSupervisor
+
+        supervisor = WebhookSupervisor(batch_size=10, concurrency=2)
+        self.assertGreaterEqual(supervisor.drain_timeout, 5 * 30)
+
+
+class WebhookNotifyTest(TransactionTestCase):
+    """Pruebas del aviso inmediato a workers ociosos"""
+
+    def test_notify_wakes_idle_listener(self):
+        """Un aviso despierta al listener antes del timeout"""
+        import tempfile
+
+        from payments.services.webhook_notify import (
+            WakeupListener,
+            notify_new_webhook,
+        )
+
+        with tempfile.TemporaryDirectory() as notify_dir:
+            with self.settings(WEBHOOK_NOTIFY_DIR=notify_dir):
+                listener = WakeupListener()
+                try:
+                    self.assertFalse(listener.wait(0.05))
+                    notify_new_webhook()
+                    self.assertTrue(listener.wait(5))
+                    self.assertFalse(listener.wait(0.05))
+                finally:
+                    listener.close()
+
+
+class IngestBufferTest(TransactionTestCase):
+    """Pruebas de la ingesta por micro-lotes"""
+
+    def test_concurrent_submits_are_flushed_together(self):
+        """Los eventos que llegan juntos se guardan en un mismo lote"""
+        from payments.services.ingest_buffer import IngestBuffer
+
+        buffer = IngestBuffer(max_batch=10, max_wait=0.2)
+        rows = [
+            {"webhook_id": f"payment_{i}", "webhook_type": "payment"} for i in range(3)
+        ]
+        rows.append({"webhook_id": "payment_0", "webhook_type": "payment"})
+
+        futures = [buffer.submit(row) for row in rows]
+        results = [future.result(timeout=5) for future in futures]
+
+        self.assertEqual(WebhookEvent.objects.count(), 3)
+        self.assertTrue(
+            all(status == WebhookEvent.INGEST_RECEIVED for _, status in results)
+        )
+        self.assertEqual(results[0][0], results[3][0])
+
+    @override_settings(WEBHOOK_INGEST_BATCHING=False, WEBHOOK_INGEST_TIMEOUT=0.25)
+    def test_direct_ingest_waits_for_locks_within_budget(self):
+        """El INSERT individual acota la espera por locks a su presupuesto"""
+        from django.db import connection
+
+        from payments.services.ingest_buffer import ingest_webhook
+
+        def busy_timeout():
+            with connection.cursor() as cursor:
+                cursor.execute("PRAGMA busy_timeout")
+                return cursor.fetchone()[0]
+
+        before = busy_timeout()
+        seen = []
+        original = WebhookEvent.ingest.__func__
+
+        def ingest(cls, *args, **kwargs):
+            seen.append(busy_timeout())
+            return original(cls, *args, **kwargs)
+
+        with mock.patch.object(WebhookEvent, "ingest", classmethod(ingest)):
+            _, status = ingest_webhook("payment_1", "payment", "1", {})
+
+        self.assertEqual(status, WebhookEvent.INGEST_RECEIVED)
+        self.assertEqual(seen, [250])
+        self.assertEqual(busy_timeout(), before)
+
+
+class WebhookSpoolTest(TransactionTestCase):
+    """Pruebas del spool en disco para cuando la BD no responde"""
+
+    def test_webhook_is_spooled_and_replayed_when_db_fails(self):
+        """Si la BD falla el webhook va al spool y luego entra a la cola"""
+        import json
+        import tempfile
+
+        from django.db import OperationalError
+
+        from payments.services.webhook_spool import WebhookSpool
+
+        with tempfile.TemporaryDirectory() as spool_dir:
+            spool = WebhookSpool(directory=spool_dir)
+            with (
+                mock.patch(
+                    "payments.services.ingest_buffer.spool_webhook", spool.append
+                ),
+                mock.patch.object(
+                    WebhookEvent,
+                    "ingest",
+                    side_effect=OperationalError("database is locked"),
+                ),
+            ):
+                response = self.client.post(
+                    "/webhooks/mp",
+                    data=json.dumps({"resource": "4242", "topic": "payment"}),
+                    content_type="application/json",
+                )
+
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.json()["spooled"])
+            self.assertEqual(WebhookEvent.objects.count(), 0)
+
+            spool.seal()
+            self.assertEqual(spool.replay(), 1)
+            self.assertEqual(spool.replay(), 0)
+
+        event = WebhookEvent.objects.get(webhook_id="payment_4242")
+        self.assertEqual(event.status, WebhookEvent.STATUS_PENDING)
+        self.assertEqual(event.mp_payment_id, "4242")
+
+    def test_idle_segment_is_sealed_by_age(self):
+        """Sin más tráfico el segmento igual se cierra y se re-inyecta"""
+        from payments.services.webhook_spool import WebhookSpool
+
+        with tempfile.TemporaryDirectory() as spool_dir:
+            spool = WebhookSpool(directory=spool_dir, segment_max_age=0.1)
+            spool.append(
+                {
+                    "webhook_id": "payment_77",
+                    "webhook_type": "payment",
+                    "raw_payload": {},
+                }
+            )
+            self.assertEqual(spool.replay(), 0)
+
+            for _ in range(50):
+                if not spool.has_open_segment:
+                    break
+                time.sleep(0.05)
+            self.assertEqual(spool.replay(), 1)
+
+
+class CircuitOpenDeferTest(TransactionTestCase):
+    """Pruebas de eventos que encuentran el circuito de MP abierto"""
+
+    def setUp(self):
+        breaker = circuit_breaker.get_breaker(MP_API_URL)
+        for _ in range(breaker.min_calls):
+            breaker.record(False)
+
+    def tearDown(self):
+        circuit_breaker.reset()
+
+    def test_open_circuit_leaves_queue_untouched(self):
+        WebhookEvent.objects.create(
+            webhook_id="payment_1",
+            webhook_type="payment",
+            mp_payment_id="1",
+            raw_payload={},
+        )
+
+        self.assertEqual(process_pending_webhooks(), 0)
+        event = WebhookEvent.objects.get()
+        self.assertEqual(event.status, WebhookEvent.STATUS_PENDING)
+        self.assertEqual(event.attempts, 0)
+
+    def test_event_is_deferred_without_consuming_attempt(self):
+        event = WebhookEvent.objects.create(
+            webhook_id="payment_1",
+            webhook_type="payment",
+            mp_payment_id="1",
+            raw_payload={},
+        )
+
+        self.assertFalse(WebhookProcessor(event).process())
+
+        event.refresh_from_db()
+        self.assertEqual(event.status, WebhookEvent.STATUS_PENDING)
+        self.assertEqual(event.attempts, 0)
+        self.assertIsNotNone(event.next_retry_at)
+        self.assertIsNone(event.lease_token)
+
+
+class CoalescingTest(TransactionTestCase):
+    """Pruebas de eventos payment/merchant_order del mismo pago"""
+
+    def setUp(self):
+        webhook_processor._coalesced.clear()
+        Payment.objects.create(
+            appointment_id="Cita_001",
+            contact_id="contact_1",
+            preference_id="pref_1",
+            amount=100,
+        )
+        for webhook_id, webhook_type, mp_payment_id in (
+            ("payment_1", "payment", "1"),
+            ("merchant_order_7", "merchant_order", None),
+        ):
+            WebhookEvent.objects.create(
+                webhook_id=webhook_id,
+                webhook_type=webhook_type,
+                mp_payment_id=mp_payment_id,
+                raw_payload={},
+            )
+
+    def test_order_event_is_coalesced_into_payment_event(self):
+        payment_doc = {
+            "status": "approved",
+            "preference_id": "pref_1",
+            "order": {"id": 7},
+        }
+        with (
+            mock.patch.object(
+                webhook_processor.mp_service, "get_payment", return_value=payment_doc
+            ),
+            mock.patch.object(
+                webhook_processor.mp_service, "get_merchant_order"
+            ) as get_order,
+        ):
+            process_pending_webhooks()
+            process_pending_webhooks()
+
+        self.assertEqual(GhlOutboxMessage.objects.count(), 1)
+        get_order.assert_not_called()
+        self.assertEqual(Payment.objects.get().status, "approved")
+
+        order_event = WebhookEvent.objects.get(webhook_id="merchant_order_7")
+        self.assertEqual(order_event.status, WebhookEvent.STATUS_SUCCESS)
+        self.assertEqual(order_event.error_details, {"coalesced_into": "payment_1"})
+
+    def test_order_applies_only_its_approved_payment(self):
+        order_doc = {
+            "preference_id": "pref_1",
+            "order_status": "paid",
+            "payments": [
+                {"id": 1, "status": "approved"},
+                {"id": 2, "status": "rejected"},
+            ],
+        }
+        WebhookEvent.objects.filter(webhook_id="payment_1").delete()
+        with mock.patch.object(
+            webhook_processor.mp_service,
+            "get_merchant_order",
+            return_value=order_doc,
+        ):
+            process_pending_webhooks()
+            WebhookEvent.objects.create(
+                webhook_id="merchant_order_7_retry",
+                webhook_type="merchant_order",
+                raw_payload={},
+            )
+            process_pending_webhooks()
+
+        payment = Payment.objects.get()
+        self.assertEqual(payment.status, "approved")
+        self.assertEqual(payment.payment_id, "1")
+        self.assertEqual(GhlOutboxMessage.objects.count(), 1)
+
+    def test_late_rejected_payment_does_not_override_approved(self):
+        WebhookEvent.objects.filter(webhook_id="merchant_order_7").delete()
+        WebhookEvent.objects.create(
+            webhook_id="payment_2",
+            webhook_type="payment",
+            mp_payment_id="2",
+            raw_payload={},
+        )
+        docs = {
+            "1": {"status": "approved", "preference_id": "pref_1"},
+            "2": {"status": "rejected", "preference_id": "pref_1"},
+        }
+        with mock.patch.object(
+            webhook_processor.mp_service,
+            "get_payment",
+            side_effect=lambda payment_id: docs[payment_id],
+        ):
+            process_pending_webhooks()
+
+        payment = Payment.objects.get()
+        self.assertEqual(payment.status, "approved")
+        self.assertEqual(payment.payment_id, "1")
+        self.assertEqual(GhlOutboxMessage.objects.count(), 1)
+        self.assertFalse(payment.apply_mp_status("3", "pending"))
+
+    def test_conditional_update_changes_row_once(self):
+        payment = Payment.objects.get()
+        stale = Payment.objects.get()
+
+        self.assertTrue(payment.apply_mp_status("1", "approved"))
+        self.assertFalse(stale.apply_mp_status("1", "approved"))
+
+
+@override_settings(GHL_COALESCE_WINDOW=0)
+class GhlDispatcherTest(TransactionTestCase):
+    """Pruebas del envío del outbox de GHL"""
+
+    def setUp(self):
+        self.message = GhlOutboxMessage.enqueue(
+            "contact_1", GhlOutboxMessage.ACTION_ADD_TAG, {"tag": "pago_confirmado"}
+        )
+
+    def tearDown(self):
+        circuit_breaker.reset()
+
+    def test_sent_message_is_marked_success(self):
+        with mock.patch.object(
+            ghl_dispatcher,
+            "update_contact",
+            return_value={"success": True, "message": "ok"},
+        ) as update:
+            processed = ghl_dispatcher.dispatch_pending_ghl(concurrency=2)
+
+        self.assertEqual(processed, 1)
+        update.assert_called_once_with(
+            "contact_1", tags=["pago_confirmado"], custom_fields={}
+        )
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, GhlOutboxMessage.STATUS_SUCCESS)
+        self.assertIsNone(self.message.locked_by)
+
+    def test_failed_send_is_retried_later(self):
+        with mock.patch.object(
+            ghl_dispatcher,
+            "update_contact",
+            return_value={"success": False, "message": "Error HTTP 500"},
+        ):
+            ghl_dispatcher.dispatch_pending_ghl()
+            # Con backoff pendiente no se vuelve a tomar en el siguiente lote
+            self.assertEqual(ghl_dispatcher.dispatch_pending_ghl(), 0)
+
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, GhlOutboxMessage.STATUS_PENDING)
+        self.assertEqual(self.message.attempts, 1)
+        self.assertEqual(self.message.last_error, "Error HTTP 500")
+
+    def test_contact_messages_are_merged_into_one_update(self):
+        with override_settings(GHL_COALESCE_WINDOW=60):
+            # Todavía dentro de su ventana: viajan con el mensaje listo
+            GhlOutboxMessage.enqueue(
+                "contact_1",
+                GhlOutboxMessage.ACTION_UPDATE_CUSTOM_FIELD,
+                {"field_key": "payment_status", "field_value": "paid"},
+            )
+            GhlOutboxMessage.enqueue(
+                "contact_1", GhlOutboxMessage.ACTION_ADD_TAG, {"tag": "vip"}
+            )
+            other = GhlOutboxMessage.enqueue(
+                "contact_2", GhlOutboxMessage.ACTION_ADD_TAG, {"tag": "vip"}
+            )
+
+        with mock.patch.object(
+            ghl_dispatcher,
+            "update_contact",
+            return_value={"success": True, "message": "ok"},
+        ) as update:
+            processed = ghl_dispatcher.dispatch_pending_ghl()
+
+        self.assertEqual(processed, 3)
+        update.assert_called_once_with(
+            "contact_1",
+            tags=["pago_confirmado", "vip"],
+            custom_fields={"payment_status": "paid"},
+        )
+        self.assertEqual(
+            GhlOutboxMessage.objects.filter(
+                status=GhlOutboxMessage.STATUS_SUCCESS
+            ).count(),
+            3,
+        )
+        other.refresh_from_db()
+        self.assertEqual(other.status, GhlOutboxMessage.STATUS_PENDING)
+
+    def test_malformed_payload_only_fails_its_contact(self):
+        broken = GhlOutboxMessage.enqueue(
+            "contact_2", GhlOutboxMessage.ACTION_ADD_TAG, {"etiqueta": "vip"}
+        )
+
+        with mock.patch.object(
+            ghl_dispatcher,
+            "update_contact",
+            return_value={"success": True, "message": "ok"},
+        ):
+            processed = ghl_dispatcher.dispatch_pending_ghl(concurrency=2)
+
+        self.assertEqual(processed, 2)
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, GhlOutboxMessage.STATUS_SUCCESS)
+        broken.refresh_from_db()
+        self.assertEqual(broken.status, GhlOutboxMessage.STATUS_PENDING)
+        self.assertEqual(broken.attempts, 1)
+        self.assertIsNone(broken.lease_token)
+        self.assertIn("Error inesperado", broken.last_error)
+
+    @override_settings(GHL_OUTBOX_LEASE_SECONDS=0.3)
+    def test_lease_is_renewed_while_sending(self):
+        def slow_update(contact_id, **kwargs):
+            time.sleep(0.6)
+            # Otro dispatcher no puede reclamarlo mientras se envía
+            self.assertEqual(ghl_dispatcher.reclaim_expired_ghl_messages(), 0)
+            return {"success": True, "message": "ok"}
+
+        with mock.patch.object(ghl_dispatcher, "update_contact", new=slow_update):
+            ghl_dispatcher.dispatch_pending_ghl()
+
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, GhlOutboxMessage.STATUS_SUCCESS)
+
+    def test_reclaim_fails_message_out_of_attempts(self):
+        GhlOutboxMessage.claim_batch("dispatcher-a")
+        GhlOutboxMessage.objects.filter(pk=self.message.pk).update(
+            max_attempts=1,
+            lease_expires_at=timezone.now() - timezone.timedelta(seconds=1),
+        )
+
+        self.assertEqual(ghl_dispatcher.reclaim_expired_ghl_messages(), 1)
+
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, GhlOutboxMessage.STATUS_FAILED)
+        self.assertIsNone(self.message.lease_token)
+
+    def test_backing_off_sibling_is_not_claimed_early(self):
+        with mock.patch.object(
+            ghl_dispatcher,
+            "update_contact",
+            return_value={"success": False, "message": "Error HTTP 500"},
+        ):
+            ghl_dispatcher.dispatch_pending_ghl()
+
+        GhlOutboxMessage.enqueue(
+            "contact_1", GhlOutboxMessage.ACTION_ADD_TAG, {"tag": "vip"}
+        )
+        with mock.patch.object(
+            ghl_dispatcher,
+            "update_contact",
+            return_value={"success": True, "message": "ok"},
+        ) as update:
+            self.assertEqual(ghl_dispatcher.dispatch_pending_ghl(), 1)
+
+        update.assert_called_once_with("contact_1", tags=["vip"], custom_fields={})
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, GhlOutboxMessage.STATUS_PENDING)
+        self.assertEqual(self.message.attempts, 1)
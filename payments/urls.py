@@ -3,6 +3,7 @@ from django.urls import path
 from .views import (
     create_payment,
     get_contacts_view,
+    get_metrics,
     get_next_appointment_id,
     get_payment_status,
     get_payments_history,
@@ -16,6 +17,7 @@ urlpatterns = [
     path("api/contacts", get_contacts_view, name="get_contacts"),
     path("api/payments", get_payments_history, name="payments_history"),
     path("api/webhook-events", get_webhook_events, name="webhook_events"),
+    path("api/metrics", get_metrics, name="metrics"),
     path(
         "api/next-appointment-id", get_next_appointment_id, name="next_appointment_id"
     ),
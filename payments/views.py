@@ -4,14 +4,18 @@ import os
 
 import requests
 from django.conf import settings
+from django.db.models import Count, OuterRef, Q, Subquery, Sum
 from django.http import JsonResponse
 from django.shortcuts import render
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 
-from .models import Payment
-from .services import add_tag_to_contact, get_contacts
+from .models import Contact, Payment
+from .services import add_tag_to_contact, get_contacts_cached, http_client, metrics
+from .services.contact_sync import backfill_contacts_async
+from .services.deadline import deadline
+from .services.mp_service import MP_API_URL, MP_RATE_LIMIT_KEY
 
 # Configurar logging
 logger = logging.getLogger(__name__)
@@ -23,10 +27,39 @@ def home(request):
 
 
 def get_contacts_view(request):
-    """API endpoint para obtener contactos de GHL"""
+    """
+    API endpoint para obtener contactos de GHL
+
+    Lee la copia local que mantiene sync_ghl_contacts (parámetros opcionales
+    `q` para buscar por nombre/email/teléfono y `limit`); hasta la primera
+    sincronización consulta GHL (con cache, ver get_contacts_cached).
+    """
     try:
-        result = get_contacts(limit=100)
-        return JsonResponse(result)
+        if not Contact.objects.exists():
+            return JsonResponse(get_contacts_cached(limit=100))
+
+        contacts = Contact.objects.all()
+        query = request.GET.get("q", "").strip()
+        if query:
+            contacts = contacts.filter(
+                Q(name__icontains=query)
+                | Q(email__icontains=query)
+                | Q(phone__icontains=query)
+            )
+        try:
+            limit = min(int(request.GET.get("limit", 100)), 1000)
+        except ValueError:
+            limit = 100
+
+        contacts_list = [contact.to_dict() for contact in contacts[:limit]]
+        return JsonResponse(
+            {
+                "success": True,
+                "contacts": contacts_list,
+                "message": f"Se obtuvieron {len(contacts_list)} contactos",
+                "total": contacts.count(),
+            }
+        )
     except Exception as e:
         logger.error(f"Error obteniendo contactos: {str(e)}")
         return JsonResponse(
@@ -97,47 +130,77 @@ def get_webhook_events(request):
         )
 
 
-def get_payments_history(request):
-    """API endpoint para obtener el historial de pagos"""
+def get_metrics(request):
+    """API endpoint con métricas de la cola de webhooks y del proceso web"""
     try:
-        from .services import get_contacts
+        from .models import WebhookEvent
 
-        # Obtener todos los pagos ordenados por fecha de creación (más recientes primero)
-        payments = Payment.objects.all().order_by("-created_at")
+        queue = WebhookEvent.objects.aggregate(
+            pending=Count("id", filter=Q(status=WebhookEvent.STATUS_PENDING)),
+            processing=Count("id", filter=Q(status=WebhookEvent.STATUS_PROCESSING)),
+            failed=Count("id", filter=Q(status=WebhookEvent.STATUS_FAILED)),
+            reclaimed=Sum("reclaim_count", default=0),
+        )
 
-        # Obtener contactos de GHL para mostrar nombres (máximo 100)
-        contacts_result = get_contacts(limit=100)
-        contacts_dict = {}
-        if contacts_result.get("success"):
-            contacts_dict = {
-                c["id"]: c["name"] for c in contacts_result.get("contacts", [])
-            }
+        return JsonResponse({"success": True, "queue": queue, **metrics.snapshot()})
+    except Exception as e:
+        logger.error(f"Error obteniendo métricas: {str(e)}")
+        return JsonResponse(
+            {"success": False, "message": f"Error: {str(e)}"}, status=500
+        )
+
+
+def get_payments_history(request):
+    """
+    API endpoint para obtener el historial de pagos
+
+    Es una lectura local: el nombre de cada contacto sale de la tabla
+    Contact en la misma query (subquery por ghl_id, indexado). Los
+    contactos que todavía no están se piden a GHL en segundo plano y
+    aparecen en la próxima carga.
+    """
+    try:
+        contact_name = Contact.objects.filter(ghl_id=OuterRef("contact_id")).values(
+            "name"
+        )[:1]
+
+        # Todos los pagos ordenados por fecha de creación (más recientes primero)
+        payments = (
+            Payment.objects.annotate(contact_name=Subquery(contact_name))
+            .order_by("-created_at")
+            .values(
+                "id",
+                "appointment_id",
+                "contact_id",
+                "contact_name",
+                "preference_id",
+                "payment_id",
+                "amount",
+                "status",
+                "created_at",
+            )
+        )
 
         payments_list = []
+        missing_contacts = set()
         for payment in payments:
-            contact_name = contacts_dict.get(
-                payment.contact_id, payment.contact_id[:20]
-            )
+            if payment["contact_name"] is None:
+                missing_contacts.add(payment["contact_id"])
+                payment["contact_name"] = payment["contact_id"][:20]
 
             # Generar init_point para pagos pendientes
-            init_point = None
-            if payment.status == "pending" and payment.preference_id:
-                init_point = f"https://www.mercadopago.com.pe/checkout/v1/redirect?pref_id={payment.preference_id}"
+            payment["init_point"] = None
+            if payment["status"] == "pending" and payment["preference_id"]:
+                payment["init_point"] = (
+                    f"https://www.mercadopago.com.pe/checkout/v1/redirect?pref_id={payment['preference_id']}"
+                )
 
-            payments_list.append(
-                {
-                    "id": payment.id,
-                    "appointment_id": payment.appointment_id,
-                    "contact_id": payment.contact_id,
-                    "contact_name": contact_name,
-                    "preference_id": payment.preference_id,
-                    "payment_id": payment.payment_id,
-                    "amount": float(payment.amount),
-                    "status": payment.status,
-                    "init_point": init_point,
-                    "created_at": payment.created_at.strftime("%Y-%m-%d %H:%M:%S"),
-                }
-            )
+            payment["amount"] = float(payment["amount"])
+            payment["created_at"] = payment["created_at"].strftime("%Y-%m-%d %H:%M:%S")
+            payments_list.append(payment)
+
+        if missing_contacts:
+            backfill_contacts_async(missing_contacts)
 
         return JsonResponse(
             {"success": True, "payments": payments_list, "total": len(payments_list)}
@@ -253,11 +316,13 @@ def create_payment(request):
             "Authorization": f"Bearer {settings.MP_ACCESS_TOKEN}",
             "Content-Type": "application/json",
         }
-        response = requests.post(
-            "https://api.mercadopago.com/checkout/preferences",
-            headers=headers,
-            data=json.dumps(payload),
-        )
+        with deadline(settings.CREATE_PAYMENT_BUDGET):
+            response = http_client.post(
+                f"{MP_API_URL}/checkout/preferences",
+                headers=headers,
+                data=json.dumps(payload),
+                rate_limit_key=MP_RATE_LIMIT_KEY,
+            )
         if response.status_code != 201:
             error_msg = f"No se pudo crear la preferencia. Status: {response.status_code}, Response: {response.text}"
             logger.error(error_msg)
@@ -297,6 +362,12 @@ def create_payment(request):
         error_msg = f"Campo requerido faltante: {str(e)}"
         logger.error(error_msg)
         return JsonResponse({"error": error_msg}, status=400)
+    except requests.Timeout as e:
+        logger.error(f"Timeout creando preferencia en MercadoPago: {e}")
+        return JsonResponse(
+            {"error": "MercadoPago no respondió a tiempo, intenta nuevamente"},
+            status=504,
+        )
     except Exception as e:
         error_msg = f"Error en create_payment: {e}"
         logger.error(error_msg)
@@ -338,16 +409,22 @@ def mp_webhook(request):
     🔹 Endpoint de webhook con arquitectura event-driven
 
     Estrategia:
-    1. ✅ Responder 200 OK inmediatamente (confirmar recepción)
-    2. 💾 Guardar evento en BD
-    3. ⚡ Procesar de forma asíncrona
+    1. 💾 Guardar evento en BD
+    2. ✅ Responder 200 OK inmediatamente (confirmar recepción)
+    3. ⚡ El worker (process_webhooks --loop) lo procesa en segundo plano
 
     Beneficios:
     - No perdemos webhooks aunque el servidor esté lento
     - MercadoPago no reintenta innecesariamente
     - Podemos reintentar procesamiento en caso de error
+
+    Con WEBHOOK_PROCESSING_MODE="inline" se conserva el procesamiento
+    dentro del request (útil en desarrollo sin worker).
     """
     from .models import WebhookEvent
+    from .services import webhook_dedup
+    from .services.ingest_buffer import ingest_webhook
+    from .services.webhook_notify import notify_new_webhook
     from .services.webhook_processor import WebhookProcessor
 
     try:
@@ -413,48 +490,61 @@ def mp_webhook(request):
             )
             return JsonResponse({"error": "Tipo de webhook no reconocido"}, status=400)
 
-        # 🔹 PASO 1: Verificar si ya existe este evento (idempotencia)
-        existing_event = WebhookEvent.objects.filter(webhook_id=webhook_id).first()
+        # 🔹 PASO 0: Duplicado conocido en memoria → responder sin tocar la BD
+        if webhook_dedup.is_known_processed(webhook_id):
+            logger.debug(f"📨 ✓ Webhook duplicado (en memoria) | ID: {webhook_id}")
+            return JsonResponse({"status": "already_processed"})
 
-        if existing_event:
-            # Si ya fue procesado exitosamente, solo confirmar
-            if existing_event.processed:
-                logger.debug(
-                    f"📨 ✓ Webhook duplicado (ya procesado) | ID: {webhook_id}"
-                )
-                return JsonResponse({"status": "already_processed"})
-
-            # Si está pendiente o falló, lo reprocesaremos más tarde
-            logger.info(
-                f"📨 ⚡ Webhook existente | ID: {webhook_id} | Intento: {existing_event.attempts}"
-            )
-            return JsonResponse({"status": "already_received"})
-
-        # 🔹 PASO 2: Guardar el evento en la base de datos
-        event = WebhookEvent.objects.create(
+        # 🔹 PASO 1 y 2: Guardar el evento si es nuevo (idempotencia)
+        # Un solo INSERT ... ON CONFLICT: sin SELECT previo ni carreras
+        # entre reintentos simultáneos de MercadoPago (o micro-lotes con
+        # WEBHOOK_INGEST_BATCHING)
+        event_id, ingest_status = ingest_webhook(
             webhook_id=webhook_id,
             webhook_type=webhook_type,
             mp_payment_id=payment_id,
             raw_payload=payload,
-            status=WebhookEvent.STATUS_PENDING,
         )
 
-        logger.info(f"📨 ✓ Webhook guardado | ID: {webhook_id} | DB ID: {event.id}")
+        if ingest_status == WebhookEvent.INGEST_ALREADY_PROCESSED:
+            # Si ya fue procesado exitosamente, solo confirmar
+            webhook_dedup.remember_processed(webhook_id)
+            logger.debug(f"📨 ✓ Webhook duplicado (ya procesado) | ID: {webhook_id}")
+            return JsonResponse({"status": "already_processed"})
+
+        if ingest_status == WebhookEvent.INGEST_ALREADY_RECEIVED:
+            # Si está pendiente o falló, lo reprocesaremos más tarde
+            logger.info(f"📨 ⚡ Webhook existente | ID: {webhook_id}")
+            return JsonResponse({"status": "already_received"})
+
+        if ingest_status == WebhookEvent.INGEST_SPOOLED:
+            # La BD no respondió: el evento está en disco y el worker lo
+            # pasará a la cola; igual confirmamos para que MP no reintente
+            return JsonResponse({"status": "received", "spooled": True})
+
+        logger.info(f"📨 ✓ Webhook guardado | ID: {webhook_id} | DB ID: {event_id}")
 
         # 🔹 PASO 3: Confirmar recepción INMEDIATAMENTE (200 OK)
         # Esto es crítico: debemos responder rápido para que MP no reintente
-        response = JsonResponse({"status": "received", "event_id": event.id})
-
-        # 🔹 PASO 4: Procesar de forma asíncrona (después de confirmar)
-        # En producción, esto debería ser con Celery o similar
-        # Por ahora, lo procesamos en el mismo request (pero después de responder)
-        try:
-            processor = WebhookProcessor(event)
-            processor.process()
-        except Exception as e:
-            # Si falla el procesamiento, no afecta la respuesta
-            # El evento quedará como pendiente y se reintentará después
-            logger.error(f"📨 ✗ Error procesando | ID: {webhook_id} | Error: {str(e)}")
+        response = JsonResponse({"status": "received", "event_id": event_id})
+
+        # 🔹 PASO 4 (solo modo inline): procesar dentro del request
+        # En modo "queue" el evento queda pendiente y se despierta al worker
+        if settings.WEBHOOK_PROCESSING_MODE != "inline":
+            # Con micro-lotes avisa el flush del lote (un aviso por lote)
+            if not settings.WEBHOOK_INGEST_BATCHING:
+                notify_new_webhook()
+        else:
+            try:
+                processor = WebhookProcessor(WebhookEvent.objects.get(pk=event_id))
+                if processor.process():
+                    webhook_dedup.remember_processed(webhook_id)
+            except Exception as e:
+                # Si falla el procesamiento, no afecta la respuesta
+                # El evento quedará como pendiente y se reintentará después
+                logger.error(
+                    f"📨 ✗ Error procesando | ID: {webhook_id} | Error: {str(e)}"
+                )
 
         return response
 